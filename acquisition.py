@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+import time
+from logging import Logger
+
+import yaml
+
+import enviroplus_reader
+import log_setup
+import shared_ring
+import startup
+
+BANNER = """acquisition.py - Samples the Enviro plus sensors and publishes
+the readings in shared memory for luftdaten-influxdb.py and other
+local consumers, which can be restarted without stopping sampling.
+
+Press Ctrl+C to exit!
+
+"""
+
+
+# Sampling on its own process and GIL: every snapshot is written to the shared memory ring, nothing else is done here
+class Acquisition:
+    def __init__(self, config: dict, logger: Logger, timer: startup.StartupTimer) -> None:
+        self.logger = logger
+        self.timer = timer
+        self.init = startup.ParallelInit(logger, timer)
+        acquisition_cfg = config.get('acquisition') or {}
+        self.ring = shared_ring.SharedRingWriter(acquisition_cfg.get('name', shared_ring.DEFAULT_NAME),
+                                                 capacity=acquisition_cfg.get('capacity', 3600))
+        logger.info("Publishing readings in shared memory ring {} of {} readings".format(self.ring.name,
+                                                                                         self.ring.capacity))
+        self.reader = enviroplus_reader.EnviroPlusReader(logger, create_devices=False)
+        sampling_cfg = config.get('sampling', {})
+        self.scheduler = self.reader.scheduler(logger, tick=sampling_cfg.get('tick', 2),
+                                               periods=sampling_cfg.get('periods'))
+
+    def attach_device(self, name):
+        return lambda device: self.reader.attach(name, device)
+
+    def start(self):
+        for name in ('pms5003', 'gas', 'ltr559'):
+            self.init.submit(name, enviroplus_reader.DEVICE_FACTORIES[name], self.attach_device(name))
+        with self.timer.phase('bme280'):
+            self.reader.attach('bme280', enviroplus_reader.create_bme280())
+        self.init.report_when_done()
+
+    def run(self):
+        update_time = time.time()
+        first_sample = True
+        for values in self.scheduler.run():
+            self.ring.append(values)
+            if first_sample:
+                self.logger.info("First sample {:.3f}s after start".format(self.timer.milestone('first sample')))
+                first_sample = False
+            if time.time() - update_time > 120:
+                update_time = time.time()
+                self.logger.info("Sampling: {}, {} readings published".format(self.scheduler.stats(),
+                                                                             self.ring.sequence))
+
+    def stop(self):
+        self.ring.close()
+
+
+def main():
+    timer = startup.StartupTimer()
+    config = yaml.safe_load(open("config.yml"))
+    print(BANNER)
+
+    logger = log_setup.get_logger('/var/log/luftdaten-acquisition.log')
+    acquisition = Acquisition(config, logger, timer)
+    acquisition.start()
+    try:
+        acquisition.run()
+    finally:
+        acquisition.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+import math
+from typing import List, Sequence
+
+from reading_buffer import FIELDS
+
+NANOS = 1000 * 1000 * 1000
+
+
+# Streaming quantile estimate in constant memory, P² algorithm by Jain and Chlamtac
+class P2Quantile:
+    __slots__ = ('p', 'heights', 'positions', 'desired', 'increments')
+
+    def __init__(self, p: float) -> None:
+        self.p = p
+        self.heights = []
+        self.positions = [1, 2, 3, 4, 5]
+        self.desired = [1, 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5]
+        self.increments = [0, p / 2, p, (1 + p) / 2, 1]
+
+    def add(self, x):
+        heights = self.heights
+        if len(heights) < 5:
+            heights.append(x)
+            heights.sort()
+            return
+        if x < heights[0]:
+            heights[0] = x
+            k = 0
+        elif x >= heights[4]:
+            heights[4] = x
+            k = 3
+        else:
+            k = next(i for i in range(4) if heights[i] <= x < heights[i + 1])
+        positions = self.positions
+        for i in range(k + 1, 5):
+            positions[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+        for i in (1, 2, 3):
+            d = self.desired[i] - positions[i]
+            if (d >= 1 and positions[i + 1] - positions[i] > 1) or (d <= -1 and positions[i - 1] - positions[i] < -1):
+                d = 1 if d > 0 else -1
+                height = self._parabolic(i, d)
+                if not heights[i - 1] < height < heights[i + 1]:
+                    height = heights[i] + d * (heights[i + d] - heights[i]) / (positions[i + d] - positions[i])
+                heights[i] = height
+                positions[i] += d
+
+    def _parabolic(self, i, d):
+        h, n = self.heights, self.positions
+        return h[i] + d / (n[i + 1] - n[i - 1]) * (
+                (n[i] - n[i - 1] + d) * (h[i + 1] - h[i]) / (n[i + 1] - n[i])
+                + (n[i + 1] - n[i] - d) * (h[i] - h[i - 1]) / (n[i] - n[i - 1]))
+
+    def value(self) -> float:
+        if not self.heights:
+            return float('nan')
+        if len(self.heights) < 5:
+            return self.heights[min(len(self.heights) - 1, int(round(self.p * (len(self.heights) - 1))))]
+        return self.heights[2]
+
+
+class FieldStats:
+    __slots__ = ('count', 'total', 'min', 'max', 'quantiles')
+
+    def __init__(self, quantiles: Sequence[float]) -> None:
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.quantiles = [P2Quantile(q) for q in quantiles]
+
+    def add(self, x):
+        self.count += 1
+        self.total += x
+        if x < self.min:
+            self.min = x
+        if x > self.max:
+            self.max = x
+        for quantile in self.quantiles:
+            quantile.add(x)
+
+    def mean(self) -> float:
+        return self.total / self.count if self.count else float('nan')
+
+
+# Tumbling (step == window) or sliding (step < window) time windows over the reading stream. Every window keeps
+# constant size statistics per field and is emitted as one values dict, with the mean under the field name so
+# sinks can use it like a raw reading, plus <field>_min, <field>_max and <field>_p<quantile>. count is the most
+# readings of any field, with counts every field also gets <field>_count, the readings that had it.
+class WindowAggregator:
+    def __init__(self, window: float, step: float = None, fields: Sequence[str] = FIELDS,
+                 quantiles: Sequence[float] = (0.5, 0.9), counts: bool = False) -> None:
+        self.window = int(window * NANOS)
+        self.step = int((step or window) * NANOS)
+        if self.window % self.step:
+            raise ValueError("Window {}s is not a multiple of step {}s".format(window, step))
+        self.fields = tuple(fields)
+        self.quantiles = tuple(quantiles)
+        self.counts = counts
+        self.windows = {}
+        self.watermark = 0
+        self.late = 0
+
+    def output_fields(self) -> List[str]:
+        output = ['count']
+        for field in self.fields:
+            output += [field, field + '_min', field + '_max']
+            if self.counts:
+                output.append(field + '_count')
+            output += ['{}_p{}'.format(field, int(q * 100)) for q in self.quantiles]
+        return output
+
+    # Add a reading, returns the windows it closed
+    def add(self, values) -> List[dict]:
+        ts = values['ts']
+        closed = self._close(ts)
+        if ts < self.watermark:
+            self.late += 1
+            return closed
+        first_start = (ts - self.window) // self.step * self.step + self.step
+        for start in range(max(first_start, self.watermark - self.window + self.step), ts + 1, self.step):
+            window = self.windows.get(start)
+            if window is None:
+                window = self.windows[start] = {field: FieldStats(self.quantiles) for field in self.fields}
+            for field in self.fields:
+                x = values.get(field)
+                if x is not None and x == x:
+                    window[field].add(x)
+        return closed
+
+    def _close(self, ts):
+        closed = []
+        for start in sorted(self.windows):
+            if start + self.window > ts:
+                break
+            closed.append(self._emit(start, self.windows.pop(start)))
+            self.watermark = start + self.window
+        return closed
+
+    # Emit every open window, on shutdown
+    def flush(self) -> List[dict]:
+        closed = [self._emit(start, self.windows.pop(start)) for start in sorted(self.windows)]
+        if closed:
+            self.watermark = closed[-1]['ts']
+        return closed
+
+    def _emit(self, start, window):
+        record = {'ts': start + self.window, 'count': max(stats.count for stats in window.values())}
+        for field, stats in window.items():
+            record[field] = round(stats.mean(), 4)
+            record[field + '_min'] = stats.min if stats.count else float('nan')
+            record[field + '_max'] = stats.max if stats.count else float('nan')
+            if self.counts:
+                record[field + '_count'] = stats.count
+            for q, quantile in zip(self.quantiles, stats.quantiles):
+                record['{}_p{}'.format(field, int(q * 100))] = quantile.value()
+        return record
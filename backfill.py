@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+# Backfills InfluxDB from the logged readings, after an outage the logs are the only copy. Readings are read from
+# the JSON lines readings log, and from the main log where older versions wrote them. The current and rotated logs
+# are parsed in chunks on a process pool, readings are deduplicated by ts and written in large batches.
+#
+#   python backfill.py --since '2020-04-20 10:00' --until '2020-04-21 08:30'
+#   python backfill.py --dry-run /var/log/luftdaten.log.2020-04-20
+import argparse
+import ast
+import glob
+import gzip
+import json
+import logging
+import math
+import os
+import re
+import sys
+import time
+from datetime import datetime
+from multiprocessing import Pool
+
+import yaml
+
+from reading_buffer import FIELDS
+
+LOG_PATTERNS = ('/var/log/luftdaten-readings.jsonl*', '/var/log/luftdaten.log*')
+CHUNK_SIZE = 8 * 1024 * 1024
+# Readings are logged at DEBUG as the repr of the values dict
+READING_MARKER = ' [DEBUG] {'
+# Readings are flat dicts of numbers, parsed with a regular expression; anything else goes through literal_eval
+FLAT_READING = re.compile(r"\{'[^']*': [-+\w.]+(?:, '[^']*': [-+\w.]+)*\}")
+READING_ITEM = re.compile(r"'([^']*)': ([-+\w.]+)")
+NAN_LITERAL = re.compile(r'\bnan\b')
+NAN = float('nan')
+
+
+# Oldest rotated file first, the current log last; TimedRotatingFileHandler suffixes rotated files with the date
+def log_files(patterns=LOG_PATTERNS):
+    paths = [path for pattern in patterns for path in glob.glob(pattern)]
+    return sorted(paths, key=lambda path: (path.endswith(('.log', '.jsonl')), path))
+
+
+# Byte ranges of roughly chunk_size, a compressed file is a single chunk as it can't be read from an offset
+def chunks(paths, chunk_size: int = CHUNK_SIZE):
+    for path in paths:
+        size = os.path.getsize(path)
+        if path.endswith('.gz'):
+            yield path, 0, None
+            continue
+        for start in range(0, size, chunk_size):
+            yield path, start, min(start + chunk_size, size)
+
+
+def _literal_reading(text):
+    try:
+        return ast.literal_eval(text)
+    except (ValueError, SyntaxError):
+        pass
+    # Readings taken while a sensor failed hold NaN, which has no literal
+    try:
+        return ast.literal_eval(NAN_LITERAL.sub('None', text))
+    except (ValueError, SyntaxError):
+        return None
+
+
+# Readings logged as the repr of the values dict
+def _parse_logged(text):
+    if FLAT_READING.fullmatch(text):
+        try:
+            return {field: int(value) if field == 'ts' else float(value)
+                    for field, value in READING_ITEM.findall(text)}
+        except ValueError:
+            pass
+    return _literal_reading(text)
+
+
+def parse_reading(line):
+    if line.startswith('{'):
+        try:
+            values = json.loads(line)
+        except ValueError:
+            return None
+    else:
+        position = line.find(READING_MARKER)
+        if position < 0 or "'ts':" not in line:
+            return None
+        values = _parse_logged(line[position + len(READING_MARKER) - 1:].rstrip())
+    if not isinstance(values, dict) or not isinstance(values.get('ts'), int):
+        return None
+    # Sensors that were not up yet are missing, the encoder leaves NaN fields out
+    reading = {field: NAN for field in FIELDS}
+    for field, value in values.items():
+        if field in reading and isinstance(value, (int, float)) and not isinstance(value, bool):
+            reading[field] = float(value)
+    reading['ts'] = values['ts']
+    return reading
+
+
+def _lines(path, start, end):
+    if end is None:
+        with gzip.open(path, 'rt', errors='replace') as f:
+            yield from f
+        return
+    with open(path, 'rb') as f:
+        f.seek(start)
+        # A line belongs to the chunk it starts in
+        if start:
+            f.readline()
+        while f.tell() <= end:
+            line = f.readline()
+            if not line:
+                return
+            yield line.decode(errors='replace')
+
+
+# Parsed on the pool: returns the readings within [since, until) and the bytes read
+def parse_chunk(chunk):
+    path, start, end, since, until = chunk
+    readings = []
+    for line in _lines(path, start, end):
+        values = parse_reading(line)
+        if values is not None and since <= values['ts'] < until:
+            readings.append(values)
+    return readings, (os.path.getsize(path) if end is None else end - start)
+
+
+def parse_time(text):
+    return int(datetime.fromisoformat(text).timestamp() * 1e9) if text else None
+
+
+def create_influxdb(config, logger):
+    import influxdb_local_weather_client
+    import line_protocol
+
+    influxdb_cfg = config['influxdb']
+    return influxdb_local_weather_client.InfluxDbWeather(
+        influxdb_cfg['host'], influxdb_cfg['port'], influxdb_cfg['database'],
+        influxdb_cfg['username'], influxdb_cfg['password'], logger,
+        encoder=line_protocol.LineProtocolEncoder(influxdb_cfg.get('schema', line_protocol.DEFAULT_SCHEMA)),
+        compression=influxdb_cfg.get('compression', influxdb_local_weather_client.GZIP))
+
+
+class Backfill:
+    def __init__(self, write, logger: logging.Logger, batch_size: int = 50000) -> None:
+        self.write = write
+        self.logger = logger
+        self.batch_size = batch_size
+        self.seen = set()
+        self.pending = []
+        self.readings = 0
+        self.duplicates = 0
+        self.written = 0
+
+    def add(self, readings):
+        for values in readings:
+            self.readings += 1
+            if values['ts'] in self.seen:
+                self.duplicates += 1
+                continue
+            self.seen.add(values['ts'])
+            self.pending.append(values)
+            if len(self.pending) >= self.batch_size:
+                self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        if self.write:
+            self.write(self.pending)
+        self.written += len(self.pending)
+        self.pending = []
+
+    def run(self, paths, since, until, processes=None, chunk_size=CHUNK_SIZE, progress=sys.stderr):
+        total = sum(os.path.getsize(path) for path in paths)
+        done = 0
+        start = time.perf_counter()
+        work = [chunk + (since, until) for chunk in chunks(paths, chunk_size)]
+        with Pool(processes) as pool:
+            for readings, nbytes in pool.imap_unordered(parse_chunk, work):
+                self.add(readings)
+                done += nbytes
+                elapsed = time.perf_counter() - start
+                progress.write("\r{:5.1f}% {:>10} readings, {:>8} duplicates, {:>10} written, {:.0f} readings/s".format(
+                    100 * done / max(total, 1), self.readings, self.duplicates, self.written,
+                    self.readings / max(elapsed, 1e-9)))
+                progress.flush()
+        self.flush()
+        progress.write('\n')
+        self.logger.info("Backfill of {} files done in {:.1f}s: {} readings, {} duplicates, {} written".format(
+            len(paths), time.perf_counter() - start, self.readings, self.duplicates, self.written))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write the readings of the luftdaten logs to InfluxDB")
+    parser.add_argument('paths', nargs='*', help="log files, by default {}".format(' and '.join(LOG_PATTERNS)))
+    parser.add_argument('--config', default='config.yml')
+    parser.add_argument('--since', help="first time to backfill, e.g. '2020-04-20 10:00'")
+    parser.add_argument('--until', help="time to backfill up to, excluded")
+    parser.add_argument('--batch-size', type=int, default=50000, help="readings per InfluxDB write")
+    parser.add_argument('--processes', type=int, help="parse processes, by default one per CPU")
+    parser.add_argument('--dry-run', action='store_true', help="parse and count only, without writing")
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s [%(levelname)s] %(message)s', level=logging.INFO)
+    logger = logging.getLogger('backfill')
+    paths = args.paths or log_files()
+    if not paths:
+        logger.error("No log files found")
+        return 1
+    write = None
+    if not args.dry_run:
+        influxdb = create_influxdb(yaml.safe_load(open(args.config)), logger)
+        write = influxdb.write_values
+    since = parse_time(args.since) or 0
+    until = parse_time(args.until) or math.inf
+    Backfill(write, logger, batch_size=args.batch_size).run(paths, since, until, processes=args.processes)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
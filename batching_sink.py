@@ -0,0 +1,223 @@
+import math
+import threading
+import time
+from abc import ABC, abstractmethod
+from logging import Logger
+from typing import Callable, Optional
+
+from circuit_breaker import CircuitBreaker
+from network_monitor import NetworkMonitor
+
+# Sent to a sink instead of a reading, only to let it check its age trigger
+FLUSH_TICK = object()
+# What a reading takes in memory, a float per field, used to account the bytes of readings held in lists
+BYTES_PER_FIELD = 8
+
+
+# Raised by a write that failed after getting part of the batch through: its first written readings, or all but the
+# unwritten ones when given, are not written again
+class PartialWriteError(Exception):
+    def __init__(self, cause: Exception, written: int = 0, unwritten: list = None) -> None:
+        super().__init__("{} ({} readings written)".format(cause, written))
+        self.cause = cause
+        self.written = written
+        self.unwritten = unwritten
+
+
+# Flush as soon as any limit is reached: pending readings, pending bytes or seconds since the oldest pending reading
+class FlushPolicy:
+    def __init__(self, max_count: int = 100, max_bytes: Optional[int] = None, max_age: Optional[float] = None) -> None:
+        self.max_count = max_count
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+
+    def reason(self, count: int, nbytes: int, age: float) -> Optional[str]:
+        if not count:
+            return None
+        if count >= self.max_count:
+            return 'count'
+        if self.max_bytes and nbytes >= self.max_bytes:
+            return 'bytes'
+        if self.max_age is not None and age >= self.max_age:
+            return 'age'
+        return None
+
+
+# Flush size from what the uplink costs, as measured by the sink's UplinkTraffic: enough readings per request for the
+# per-request overhead to fit in bytes_per_hour next to the readings themselves, or without a budget to stay under
+# max_overhead of the readings' bytes, and for round trips to keep the uplink busy at most max_busy of the time.
+# initial_count applies until a request was measured. The count limit moves between min_count and the cap max_count
+# as readings arrive, max_bytes and max_age apply as in FlushPolicy and bound how long readings wait.
+class AdaptiveFlushPolicy(FlushPolicy):
+    def __init__(self, traffic, bytes_per_hour: Optional[int] = None, min_count: int = 1, max_count: int = 5000,
+                 max_bytes: Optional[int] = None, max_age: Optional[float] = None, max_busy: float = 0.05,
+                 max_overhead: float = 0.1, initial_count: int = 100) -> None:
+        super().__init__(min(initial_count, max_count), max_bytes, max_age)
+        self.traffic = traffic
+        self.bytes_per_hour = bytes_per_hour
+        self.min_count = min_count
+        self.count_cap = max_count
+        self.max_busy = max_busy
+        self.max_overhead = max_overhead
+        self.initial_count = self.max_count
+        self.over_budget = False
+
+    # Readings per flush at an arrival rate of readings_per_hour
+    def target_count(self, readings_per_hour: float) -> int:
+        if self.traffic.rtt is None or self.traffic.bytes_per_reading is None:
+            return self.initial_count
+        target = max(self.min_count, readings_per_hour * self.traffic.rtt / (self.max_busy * 3600))
+        if self.bytes_per_hour:
+            spare = self.bytes_per_hour - readings_per_hour * self.traffic.bytes_per_reading
+            # The readings alone take the whole budget, the largest batches keep the overhead down
+            self.over_budget = spare <= 0
+            if self.over_budget:
+                return self.count_cap
+            target = max(target, readings_per_hour * self.traffic.request_overhead / spare)
+        elif self.traffic.bytes_per_reading > 0:
+            target = max(target, self.traffic.request_overhead / (self.max_overhead * self.traffic.bytes_per_reading))
+        return min(self.count_cap, int(math.ceil(target)))
+
+    # The count limit follows the arrival rate of the pending readings once the uplink was measured
+    def reason(self, count: int, nbytes: int, age: float) -> Optional[str]:
+        if count > 1 and age > 0 and self.traffic.rtt is not None:
+            self.max_count = self.target_count((count - 1) / age * 3600)
+        return super().reason(count, nbytes, age)
+
+
+# Common batching for all sinks: subclasses keep the pending readings, this decides when to write them, backs off
+# on failures and does the final flush on shutdown. send() takes readings or FLUSH_TICK.
+class BatchingSink(ABC):
+    def __init__(self, name: str, write: Callable, logger: Logger, policy: FlushPolicy = None,
+                 breaker: CircuitBreaker = None, network: NetworkMonitor = None,
+                 clock: Callable[[], float] = time.monotonic) -> None:
+        self.name = name
+        self.write = write
+        self.logger = logger
+        self.policy = policy or FlushPolicy()
+        self.breaker = breaker or CircuitBreaker(name, logger)
+        self.network = network
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.first_pending = None
+        self.flushes = {}
+
+    @abstractmethod
+    def pending_count(self) -> int:
+        pass
+
+    @abstractmethod
+    def pending_bytes(self) -> int:
+        pass
+
+    # Take a reading, sinks writing from a shared store only get notified
+    def receive(self, values):
+        pass
+
+    # Write everything pending, raising when the sink failed
+    @abstractmethod
+    def write_pending(self):
+        pass
+
+    def send(self, values):
+        with self.lock:
+            if values is not FLUSH_TICK:
+                self.receive(values)
+            count = self.pending_count()
+            if not count:
+                return
+            now = self.clock()
+            if self.first_pending is None:
+                self.first_pending = now
+            reason = self.policy.reason(count, self.pending_bytes(), now - self.first_pending)
+            if reason is None or (self.network and not self.network.is_online()):
+                return
+            if self.breaker.allow():
+                self._flush(reason)
+
+    def _flush(self, reason):
+        try:
+            self.write_pending()
+            self.first_pending = None
+            self.flushes[reason] = self.flushes.get(reason, 0) + 1
+            self.breaker.record_success()
+        except Exception as e:
+            self.breaker.record_failure()
+            self.logger.warning("Sink {} failed, {} readings ({} bytes) waiting: {}".format(
+                self.name, self.pending_count(), self.pending_bytes(), e))
+
+    # Final flush on shutdown, tried once whatever the breaker says
+    def close(self):
+        with self.lock:
+            if not self.pending_count() or (self.network and not self.network.is_online()):
+                return
+            self.logger.info("Flushing {} readings to {}".format(self.pending_count(), self.name))
+            try:
+                self.write_pending()
+                self.first_pending = None
+            except Exception as e:
+                self.logger.warning("Final flush of sink {} failed: {}".format(self.name, e))
+
+    def collect_metrics(self):
+        for reason, count in self.flushes.items():
+            yield 'sink_flushes_total', 'counter', {'sink': self.name, 'reason': reason}, count
+
+
+# Batching sink keeping its own list of readings, oldest ones are dropped above max_pending
+class ListBatchingSink(BatchingSink):
+    def __init__(self, name: str, write: Callable, logger: Logger, policy: FlushPolicy = None,
+                 max_pending: int = 10000, **kwargs) -> None:
+        super().__init__(name, write, logger, policy, **kwargs)
+        self.values = []
+        self.nbytes = 0
+        self.max_pending = max_pending
+        self.lost = 0
+
+    def pending_count(self) -> int:
+        return len(self.values)
+
+    def pending_bytes(self) -> int:
+        return self.nbytes
+
+    def receive(self, values):
+        self.values.append(values)
+        self.nbytes += BYTES_PER_FIELD * len(values)
+        if len(self.values) > self.max_pending:
+            dropped = self.values.pop(0)
+            self.nbytes -= BYTES_PER_FIELD * len(dropped)
+            self.lost += 1
+
+    def write_pending(self):
+        try:
+            self.write(self.values)
+        except PartialWriteError as e:
+            self.values = self.values[e.written:] if e.unwritten is None else list(e.unwritten)
+            self.nbytes = sum(BYTES_PER_FIELD * len(values) for values in self.values)
+            raise
+        self.values = []
+        self.nbytes = 0
+
+
+# Sends FLUSH_TICK through tick() every interval seconds, so age limits are met even when sampling stalls
+class FlushTimer:
+    def __init__(self, tick: Callable[[], None], logger: Logger, interval: float = 1) -> None:
+        self.tick = tick
+        self.logger = logger
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='flush-timer', daemon=True)
+
+    def start(self) -> 'FlushTimer':
+        self.thread.start()
+        return self
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.tick()
+            except Exception as e:
+                self.logger.exception("Flush timer failed: {}".format(e))
+
+    def stop(self, timeout: Optional[float] = None):
+        self.stopped.set()
+        self.thread.join(timeout)
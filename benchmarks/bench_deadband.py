@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# A day of simulated readings every 2 seconds through deadband filters of growing width, reporting the values sent
+# and the line protocol and OpenSenseMap bytes against sending every reading
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from deadband import Deadband, DeadbandFilter  # noqa: E402
+from enviroplus_reader import EnviroPlusReader  # noqa: E402
+from line_protocol import LineProtocolEncoder  # noqa: E402
+from opensensemap_encoder import OpenSenseMapEncoder  # noqa: E402
+from reading_buffer import FIELDS  # noqa: E402
+from simulated_devices import simulated_reader_devices  # noqa: E402
+
+DAY = 86400
+TICK = 2
+START = 1587370000
+
+# Deadbands around the sensors' own noise, scaled by the factor in the first column
+DEADBANDS = {'temperature': {'absolute': 0.1}, 'pressure': {'absolute': 0.05}, 'humidity': {'absolute': 0.5},
+             'oxidising': {'relative': 0.02}, 'reducing': {'relative': 0.02}, 'nh3': {'relative': 0.02},
+             'lux': {'relative': 0.05}, 'P2.5': {'absolute': 1}, 'P10': {'absolute': 1}, 'P1.0': {'absolute': 1}}
+OPENSENSEMAP_FIELDS = [('sensor-{}'.format(i), field) for i, field in enumerate(FIELDS)]
+
+
+class SimulatedClock:
+    def __init__(self) -> None:
+        self.now = START
+
+    def __call__(self):
+        return self.now
+
+
+def make_readings():
+    clock = SimulatedClock()
+    devices = simulated_reader_devices(latency_scale=0)
+    for device in devices.values():
+        if hasattr(device, 'clock'):
+            device.clock = clock
+    # Particles are taken from the PMS5003 signal directly, without its frame stream
+    pm = devices.pop('pms5003').pm
+    reader = EnviroPlusReader(None, create_devices=False, **devices)
+    readings = []
+    for i in range(DAY // TICK):
+        clock.now = START + i * TICK
+        particles = max(0, pm.value(clock.now))
+        latest = {'cpu': reader.read_cpu(), 'weather': reader.read_weather(), 'gas': reader.read_gas(),
+                  'light': reader.read_light(),
+                  'particles': {'P2.5': round(particles), 'P10': round(particles * 1.4),
+                                'P1.0': round(particles * 0.7)}}
+        values = reader.merge(latest)
+        values['ts'] = int(clock.now * 1e9)
+        readings.append(values)
+    return readings
+
+
+def main():
+    readings = make_readings()
+    line_protocol = LineProtocolEncoder()
+    opensensemap = OpenSenseMapEncoder(OPENSENSEMAP_FIELDS)
+    full_lines = len(line_protocol.encode(readings))
+    full_osm = sum(len(piece) for piece in opensensemap.encode(readings))
+    print("{:>6}  {:>9}  {:>11}  {:>13}".format('scale', 'reduction', 'line bytes', 'osem bytes'))
+    print("{:>6}  {:>9}  {:>11}  {:>13}".format('none', '0.000', full_lines, full_osm))
+    for scale in (0.5, 1, 2, 5):
+        deadbands = {field: Deadband(**{kind: width * scale for kind, width in cfg.items()})
+                     for field, cfg in DEADBANDS.items()}
+        deadband_filter = DeadbandFilter('bench', deadbands, heartbeat=300)
+        sent = [record for values in readings for record in deadband_filter.add(values)]
+        for record in sent:
+            for field in line_protocol.fields:
+                record.setdefault(field, float('nan'))
+        print("{:>6}  {:>9.3f}  {:>11}  {:>13}".format(
+            scale, deadband_filter.reduction(), len(line_protocol.encode(sent)),
+            sum(len(piece) for piece in opensensemap.encode(sent))))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# Load test of the gateway: hundreds of simulated stations stream readings over UDP or HTTP, the gateway batches
+# them and encodes line protocol on its process pool, writing to a local stand-in InfluxDB.
+#
+#   python benchmarks/bench_gateway.py --stations 500 --transport udp
+#   python benchmarks/bench_gateway.py --stations 200 --transport http --workers 0
+import argparse
+import logging
+import os
+import random
+import sys
+import time
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import gateway  # noqa: E402
+from batching_sink import FLUSH_TICK, FlushPolicy, ListBatchingSink  # noqa: E402
+from line_protocol import DEFAULT_SCHEMA  # noqa: E402
+from reading_buffer import FIELDS  # noqa: E402
+from sink_dispatcher import SinkDispatcher  # noqa: E402
+from standin_servers import StandInServer  # noqa: E402
+from station_client import HTTP, UDP, StationClient  # noqa: E402
+
+logger = logging.getLogger('bench')
+
+
+class _Response:
+    def __init__(self, status):
+        self.status_code = status
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise OSError("HTTP {}".format(self.status_code))
+
+
+# Just enough of a session for the stations and the InfluxDB writer, on urllib
+class _UrllibSession:
+    def post(self, url, data, headers=None):
+        request = urllib.request.Request(url, data=data, headers=headers or {}, method='POST')
+        with urllib.request.urlopen(request) as resp:
+            return _Response(resp.status)
+
+
+class _StandInInfluxDb:
+    def __init__(self, url):
+        self.url = url + '/write'
+        self.session = _UrllibSession()
+
+    def write_lines(self, payload):
+        self.session.post(self.url, payload).raise_for_status()
+
+
+def station_readings(count, start):
+    readings = []
+    for i in range(count):
+        values = {field: round(random.uniform(0, 1000), 2) for field in FIELDS}
+        values['ts'] = start + i * 2000000000
+        readings.append(values)
+    return readings
+
+
+def run_station(station_id, host, port, transport, readings, batch_size):
+    client = StationClient(station_id, host, logger, transport=transport, port=port, session=_UrllibSession())
+    for i in range(0, len(readings), batch_size):
+        client.write_values(readings[i:i + batch_size])
+        # Stations send a batch every few seconds, spread them a little like a real fleet
+        time.sleep(random.uniform(0, 0.01))
+    client.close()
+    return client.frames_sent, client.bytes_sent
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--stations', type=int, default=300)
+    parser.add_argument('--readings', type=int, default=200, help="readings sent by every station")
+    parser.add_argument('--station-batch', type=int, default=20, help="readings per station upload")
+    parser.add_argument('--transport', choices=(UDP, HTTP), default=UDP)
+    parser.add_argument('--workers', type=int, default=2, help="encoder processes, 0 encodes on the sink worker")
+    parser.add_argument('--max-count', type=int, default=5000, help="readings per InfluxDB write")
+    parser.add_argument('--senders', type=int, default=32, help="threads the stations are simulated on")
+    args = parser.parse_args()
+
+    server = StandInServer().start()
+    pool = None
+    if args.workers:
+        pool = ProcessPoolExecutor(max_workers=args.workers, initializer=gateway._init_encoder_process,
+                                   initargs=(DEFAULT_SCHEMA,))
+    writer = gateway.InfluxDbGatewayWriter(_StandInInfluxDb(server.url), logger, pool=pool)
+    encode_times = []
+
+    def write(readings):
+        start = time.perf_counter()
+        writer.write(readings)
+        encode_times.append(time.perf_counter() - start)
+
+    sink = ListBatchingSink('influxdb', write, logger, FlushPolicy(max_count=args.max_count), max_pending=10 ** 6)
+    dispatcher = SinkDispatcher(logger, max_queue_size=10 ** 6)
+    dispatcher.add_sink('influxdb', sink.send)
+    dispatcher.start()
+
+    def on_readings(station_id, readings):
+        for values in readings:
+            values[gateway.STATION_TAG] = station_id
+            dispatcher.dispatch(values, ('influxdb',))
+
+    receiver = gateway.GatewayReceiver(on_readings, logger, host='127.0.0.1', udp_port=0, http_port=0).start()
+    port = receiver.udp_port if args.transport == UDP else receiver.http_port
+
+    readings = station_readings(args.readings, 1587370000000000000)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.senders) as senders:
+        sent = list(senders.map(lambda i: run_station('raspi-{:08x}'.format(i), '127.0.0.1', port, args.transport,
+                                                      readings, args.station_batch), range(args.stations)))
+    send_time = time.perf_counter() - start
+    expected = args.stations * args.readings
+    deadline = time.monotonic() + 30
+    while receiver.stats()['readings'] < expected and time.monotonic() < deadline:
+        time.sleep(0.05)
+    ingest_time = time.perf_counter() - start
+    dispatcher.dispatch(FLUSH_TICK, ('influxdb',))
+    dispatcher.stop(timeout=30)
+    sink.close()
+    total_time = time.perf_counter() - start
+    receiver.stop()
+    if pool:
+        pool.shutdown()
+    server.stop()
+
+    stats = receiver.stats()
+    influxdb = server.stats()['influxdb']
+    frames = sum(frames for frames, _bytes in sent)
+    nbytes = sum(nbytes for _frames, nbytes in sent)
+    print("stations: {}, transport: {}, encoder processes: {}".format(args.stations, args.transport, args.workers))
+    print("sent:     {} readings in {} frames, {:.1f} bytes per reading, {:.2f}s".format(
+        expected, frames, nbytes / expected, send_time))
+    print("received: {} readings ({:.0f}/s), {} frames lost, {} invalid".format(
+        stats['readings'], stats['readings'] / ingest_time, stats['lost_frames'], stats['invalid_frames']))
+    print("influxdb: {} points in {} writes, {:.0f} bytes per write, encode and write {:.1f}ms mean".format(
+        influxdb['points'], influxdb['requests'], influxdb['bytes'] / max(influxdb['requests'], 1),
+        sum(encode_times) / max(len(encode_times), 1) * 1000))
+    print("total:    {:.2f}s, {:.0f} readings/s end to end".format(total_time, stats['readings'] / total_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# Compares LineProtocolEncoder against the former per-point str.format mapping, for batches of 100 to 100k readings
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from line_protocol import LineProtocolEncoder  # noqa: E402
+from reading_buffer import FIELDS, ReadingBuffer  # noqa: E402
+
+
+# The mapping both InfluxDB clients used before the encoder
+def map_per_point(values):
+    influxdb_messages = []
+    for value in values:
+        influxdb_messages.append("weather,location=acacias temperature={},humidity={},pressure={} {}"
+                                 .format(value['temperature'], value['humidity'], value['pressure'], value['ts']))
+        influxdb_messages.append("particles,location=acacias P25={},P10={},P1={} {}"
+                                 .format(value['P2.5'], value['P10'], value['P1.0'], value['ts']))
+        influxdb_messages.append("gas,location=acacias oxidising={},reducing={},nh3={} {}"
+                                 .format(value['oxidising'], value['reducing'], value['nh3'], value['ts']))
+    return ('\n'.join(influxdb_messages) + '\n').encode()
+
+
+def make_values(i):
+    values = {field: round(random.uniform(0, 1000), 2) for field in FIELDS}
+    values['ts'] = 1587370000000000000 + i * 2000000000
+    return values
+
+
+def best_of(function, repeat=5):
+    return min(timeit.repeat(function, number=1, repeat=repeat))
+
+
+def main():
+    encoder = LineProtocolEncoder()
+    print("{:>8}  {:>12}  {:>12}  {:>12}".format('readings', 'per point', 'encoder', 'encoder/block'))
+    for count in (100, 1000, 10000, 100000):
+        samples = [make_values(i) for i in range(count)]
+        buffer = ReadingBuffer(count)
+        for values in samples:
+            buffer.append(values)
+        block = buffer.block(0)
+        per_point = best_of(lambda: map_per_point(samples))
+        batch = best_of(lambda: encoder.encode(samples))
+        columnar = best_of(lambda: encoder.encode(block))
+        print("{:>8}  {:>10.2f}ms  {:>10.2f}ms  {:>10.2f}ms".format(count, per_point * 1000, batch * 1000,
+                                                                    columnar * 1000))
+
+
+if __name__ == '__main__':
+    main()
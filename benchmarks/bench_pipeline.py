@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# End-to-end benchmarks against simulated sensors and local stand-in servers, runs off the Pi.
+#
+#   python benchmarks/bench_pipeline.py --save results.json
+#   python benchmarks/bench_pipeline.py --baseline results.json   # exits 1 on regressions
+import argparse
+import json
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import simulated_devices  # noqa: E402
+from enviroplus_reader import EnviroPlusReader  # noqa: E402
+from line_protocol import LineProtocolEncoder  # noqa: E402
+from reading_buffer import ReadingBuffer  # noqa: E402
+from sink_dispatcher import SinkDispatcher  # noqa: E402
+from standin_servers import StandInServer  # noqa: E402
+
+HIGHER = 'higher'
+LOWER = 'lower'
+
+logger = logging.getLogger('bench')
+
+
+def simulated_readings(count):
+    devices = simulated_devices.simulated_reader_devices(frame_interval=0.001, latency_scale=0)
+    reader = EnviroPlusReader(logger, **devices)
+    readings = []
+    for i in range(count):
+        values = reader.merge({'cpu': reader.read_cpu(), 'weather': reader.read_weather(), 'gas': reader.read_gas(),
+                               'light': reader.read_light(), 'particles': {'P2.5': 8, 'P10': 11, 'P1.0': 5}})
+        values['ts'] = 1587370000000000000 + i * 2000000000
+        readings.append(values)
+    return readings
+
+
+def bench_encoder(readings):
+    buffer = ReadingBuffer(len(readings))
+    for values in readings:
+        buffer.append(values)
+    encoder = LineProtocolEncoder()
+    block = buffer.block(0)
+    times = []
+    for _ in range(5):
+        start = time.perf_counter()
+        encoder.encode(block)
+        times.append(time.perf_counter() - start)
+    return {'encoder_readings_per_s': (len(readings) / min(times), HIGHER)}
+
+
+# Sampling loop at an accelerated tick, with a dispatcher fanning out to a no-op sink
+def bench_loop(ticks, tick):
+    reader = EnviroPlusReader(logger, **simulated_devices.simulated_reader_devices(frame_interval=tick / 2))
+    periods = {'cpu': tick * 5, 'weather': tick / 2, 'gas': tick * 2.5, 'light': tick, 'particles': tick / 2}
+    scheduler = reader.scheduler(logger, tick=tick, periods=periods)
+    buffer = ReadingBuffer(ticks)
+    dispatcher = SinkDispatcher(logger)
+    dispatcher.add_sink('noop', lambda values: None)
+    dispatcher.start()
+    # Let the PMS5003 stream publish its first frame
+    reader.pms5003_stream.wait_next(0, timeout=5)
+    latencies = []
+    for i, values in enumerate(scheduler.run()):
+        start = time.perf_counter()
+        buffer.append(values)
+        dispatcher.dispatch(values)
+        latencies.append(time.perf_counter() - start)
+        if i + 1 >= ticks:
+            break
+    dispatcher.stop(timeout=5)
+    stats = scheduler.stats()
+    return {
+        'loop_latency_median_ms': (statistics.median(latencies) * 1000, LOWER),
+        'jitter_mean_ms': (stats['jitter_mean'] * 1000, LOWER),
+        'jitter_max_ms': (stats['jitter_max'] * 1000, LOWER),
+        'missed_ticks': (stats['missed_ticks'], LOWER)
+    }
+
+
+# Readings per second a sink drains from a backlog into the stand-in server
+def bench_drain(readings, batch_size):
+    import http_session
+    from influxdb_local_weather_client import InfluxDbWeather
+    from opensensemap_client import OpenSenseMapClient
+
+    server = StandInServer().start()
+    session = http_session.create_session()
+    influxdb = InfluxDbWeather('127.0.0.1', server.port, 'weather', 'user', 'password', logger, session=session)
+    opensensemap = OpenSenseMapClient('box', 't', 'h', 'p', 'pm1', 'pm25', 'pm10', logger, session=session,
+                                      url=server.url)
+    buffer = ReadingBuffer(len(readings))
+    for values in readings:
+        buffer.append(values)
+    results = {}
+    for name, write in (('influxdb', influxdb.write_values), ('opensensemap', opensensemap.write_values)):
+        start = time.perf_counter()
+        for offset in range(0, len(readings), batch_size):
+            write(buffer.block(offset, min(offset + batch_size, len(readings))))
+        results['{}_drain_readings_per_s'.format(name)] = (len(readings) / (time.perf_counter() - start), HIGHER)
+    server.stop()
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], universal_newlines=True,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(metrics, baseline, threshold):
+    regressions = []
+    for name, (value, better) in metrics.items():
+        if name not in baseline['metrics']:
+            continue
+        before = baseline['metrics'][name]['value']
+        change = (value - before) / before if before else 0
+        worse = change < -threshold if better == HIGHER else change > threshold
+        print("{:<34} {:>12.3f} -> {:>12.3f}  {:+.1%}{}".format(name, before, value, change,
+                                                               '  REGRESSION' if worse else ''))
+        if worse:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--readings', type=int, default=10000)
+    parser.add_argument('--ticks', type=int, default=50)
+    parser.add_argument('--tick', type=float, default=0.2, help="accelerated sampling tick in seconds")
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--save', help="write the results to this JSON file")
+    parser.add_argument('--baseline', help="compare against results saved by an earlier run")
+    parser.add_argument('--threshold', type=float, default=0.1, help="relative change reported as a regression")
+    args = parser.parse_args()
+
+    readings = simulated_readings(args.readings)
+    metrics = {}
+    metrics.update(bench_encoder(readings))
+    metrics.update(bench_loop(args.ticks, args.tick))
+    try:
+        metrics.update(bench_drain(readings, args.batch_size))
+    except ImportError as e:
+        print("Skipping drain benchmark, missing dependency: {}".format(e))
+
+    for name, (value, better) in metrics.items():
+        print("{:<34} {:>12.3f}  ({} is better)".format(name, value, better))
+    result = {'commit': git_revision(), 'time': time.time(),
+              'metrics': {name: {'value': value, 'better': better} for name, (value, better) in metrics.items()}}
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(result, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        print("Compared with {}".format(baseline.get('commit')))
+        if compare(metrics, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# Compares memory use and append/iterate time of ReadingBuffer against the list of dicts layout
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from reading_buffer import FIELDS, ReadingBuffer  # noqa: E402
+
+
+def make_values(i):
+    values = {field: round(random.uniform(0, 1000), 2) for field in FIELDS}
+    values['ts'] = 1587370000000000000 + i * 2000000000
+    return values
+
+
+def measure(build):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = build()
+    elapsed = time.perf_counter() - start
+    current, _peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, current, elapsed
+
+
+def main(count=100000):
+    samples = [make_values(i) for i in range(count)]
+
+    def build_list():
+        # Copy every dict, as each sink did with its own values_buffer
+        return [dict(values) for values in samples]
+
+    def build_buffer():
+        buffer = ReadingBuffer(count)
+        for values in samples:
+            buffer.append(values)
+        return buffer
+
+    values_list, list_bytes, list_time = measure(build_list)
+    buffer, buffer_bytes, buffer_time = measure(build_buffer)
+
+    start = time.perf_counter()
+    sum(values['temperature'] for values in values_list)
+    list_scan = time.perf_counter() - start
+    start = time.perf_counter()
+    sum(sum(view) for view in buffer.block(0).column('temperature'))
+    buffer_scan = time.perf_counter() - start
+
+    print("{} readings".format(count))
+    print("list of dicts:  {:>12,} bytes  append {:.3f}s  column scan {:.4f}s".format(list_bytes, list_time, list_scan))
+    print("ReadingBuffer:  {:>12,} bytes  append {:.3f}s  column scan {:.4f}s".format(buffer_bytes, buffer_time,
+                                                                                      buffer_scan))
+    print("memory ratio: {:.1f}x".format(list_bytes / buffer_bytes))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
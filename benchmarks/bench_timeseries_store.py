@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# Write/read throughput and size of TimeSeriesStore for simulated 2 second readings
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from timeseries_store import DEFAULT_PRECISION, TimeSeriesStore  # noqa: E402
+
+NANOS = 1000 * 1000 * 1000
+START = 1587370000 * NANOS
+
+
+# Random walks rounded like EnviroPlusReader does, with a few ms of sampling jitter
+def simulate(count):
+    state = {'temperature': 21.0, 'pressure': 1013.0, 'humidity': 45.0, 'oxidising': 20.0, 'reducing': 300.0,
+             'nh3': 80.0, 'lux': 120.0, 'P2.5': 6, 'P10': 9, 'P1.0': 4}
+    steps = {'temperature': 0.02, 'pressure': 0.01, 'humidity': 0.05, 'oxidising': 0.05, 'reducing': 0.5,
+             'nh3': 0.1, 'lux': 2, 'P2.5': 0.4, 'P10': 0.5, 'P1.0': 0.3}
+    for i in range(count):
+        values = {}
+        for field, value in state.items():
+            state[field] = max(0.0, value + random.gauss(0, steps[field]))
+            values[field] = round(state[field], DEFAULT_PRECISION[field])
+            if DEFAULT_PRECISION[field] == 0:
+                values[field] = int(values[field])
+        values['ts'] = START + i * 2 * NANOS + random.randint(0, 5 * 1000 * 1000)
+        yield values
+
+
+def main(count=43200):
+    path = tempfile.mkdtemp()
+    try:
+        readings = list(simulate(count))
+        store = TimeSeriesStore(path)
+        start = time.perf_counter()
+        for values in readings:
+            store.append(values)
+        store.flush()
+        write_time = time.perf_counter() - start
+        size = store.nbytes()
+
+        start = time.perf_counter()
+        result = store.query(START, START + count * 2 * NANOS)
+        query_time = time.perf_counter() - start
+        assert len(result['ts']) == count
+
+        start = time.perf_counter()
+        store.query(START + count * NANOS, START + count * NANOS + 3600 * NANOS)
+        hour_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        store.downsample(START, START + count * 2 * NANOS, 300)
+        downsample_time = time.perf_counter() - start
+        store.close()
+
+        print("{} readings ({:.1f} days of 2s data)".format(count, count * 2 / 86400))
+        print("size: {:,} bytes, {:.1f} bytes/reading, {:.1f} MB per 30 days".format(
+            size, size / count, size / count * 30 * 43200 / 1e6))
+        print("write: {:,.0f} readings/s".format(count / write_time))
+        print("full range query: {:,.0f} readings/s".format(count / query_time))
+        print("1 hour query: {:.1f} ms".format(hour_time * 1000))
+        print("5 minute downsample of full range: {:.1f} ms".format(downsample_time * 1000))
+    finally:
+        shutil.rmtree(path)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 43200)
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+# Soak test of the full luftdaten-influxdb.py collector against simulated sensors, display and stand-in servers, on a
+# clock running --speedup times faster than real time. Traced allocations and RSS are sampled as it goes, and the run
+# fails when either grows faster than its budget per simulated hour after the warm-up.
+#
+#   python benchmarks/soak.py --hours 72
+#   python benchmarks/soak.py --fail-rate 1 --config soak.yml   # sinks failing all along, extra config merged in
+#   kill -USR1 <pid>                                            # dump the top allocation sites while it runs
+import argparse
+import importlib.util
+import logging
+import os
+import sys
+import tempfile
+
+import yaml
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+import log_setup  # noqa: E402
+import simulated_devices  # noqa: E402
+import startup  # noqa: E402
+from memory_recorder import MemoryRecorder  # noqa: E402
+from standin_servers import StandInServer  # noqa: E402
+
+
+def load_collector_module():
+    spec = importlib.util.spec_from_file_location('luftdaten_influxdb', os.path.join(ROOT, 'luftdaten-influxdb.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def merge(base, extra):
+    for key, value in extra.items():
+        if isinstance(value, dict) and isinstance(base.get(key), dict):
+            merge(base[key], value)
+        else:
+            base[key] = value
+    return base
+
+
+# Every sink and optional component on, pointed at the stand-in server, with time limits scaled to the clock
+def soak_config(server, workdir, speedup):
+    sensor_ids = {'{}_sensor_id'.format(name): 'soak-{}'.format(name)
+                  for name in ('temperature', 'humidity', 'pressure', 'pm_1_0', 'pm_2_5', 'pm_10')}
+    return {
+        'influxdb': {'host': '127.0.0.1', 'port': server.port, 'database': 'weather', 'username': 'soak',
+                     'password': 'soak'},
+        'opensensemap': dict(sensor_ids, sensebox_id='soak', url=server.url),
+        'luftdaten': {'url': server.luftdaten_url},
+        'batching': {'flush_interval': max(0.05, 1 / speedup), 'influxdb': {'max_age': 60 / speedup},
+                     'opensensemap': {'max_age': 60 / speedup}},
+        'circuit_breaker': {'base_delay': 5 / speedup, 'max_delay': 600 / speedup, 'reconnect_jitter': 0},
+        'logging': {'readings': os.path.join(workdir, 'readings.jsonl')},
+        'local_store': {'path': os.path.join(workdir, 'store')},
+        'display': {'mode': 'dashboard'},
+        'api': {'enabled': True, 'port': 0},
+        'metrics': {'enabled': True, 'port': 0},
+    }
+
+
+# Drives the collector's reading loop: readings are stamped with the accelerated clock, memory is sampled every
+# sample_interval simulated hours, and the loop ends after hours
+class Soak:
+    def __init__(self, clock: simulated_devices.AcceleratedClock, recorder: MemoryRecorder, hours: float,
+                 warmup: float, sample_interval: float, snapshot_interval: float) -> None:
+        self.clock = clock
+        self.recorder = recorder
+        self.hours = hours
+        self.warmup = warmup
+        self.sample_interval = sample_interval
+        self.snapshot_interval = snapshot_interval
+        self.readings_count = 0
+
+    def readings(self, readings):
+        next_sample = 0.0
+        next_snapshot = self.warmup + self.snapshot_interval
+        for values in readings:
+            values['ts'] = self.clock.time_ns()
+            self.readings_count += 1
+            yield values
+            hours = self.clock.elapsed() / 3600
+            if hours >= next_sample:
+                _hours, traced, rss = self.recorder.sample(hours)
+                print("{:7.2f}h  {:>9} readings  traced {:8.0f} KiB  RSS {:>8} KiB".format(
+                    hours, self.readings_count, traced / 1024, '-' if rss is None else rss // 1024), flush=True)
+                next_sample += self.sample_interval
+                if self.recorder.baseline is None and hours >= self.warmup:
+                    self.recorder.mark_baseline(hours)
+            if self.recorder.baseline is not None and hours >= next_snapshot:
+                self.recorder.dump()
+                next_snapshot += self.snapshot_interval
+            if hours >= self.hours:
+                return
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Memory soak test of the collector on an accelerated clock")
+    parser.add_argument('--hours', type=float, default=24, help="simulated hours to run")
+    parser.add_argument('--speedup', type=float, default=120, help="simulated seconds per real second")
+    # The API keeps an hour of readings and rolling stats over it, those fill up first
+    parser.add_argument('--warmup', type=float, default=1.5, help="simulated hours before growth is measured")
+    parser.add_argument('--sample-minutes', type=float, default=10, help="simulated minutes between samples")
+    parser.add_argument('--snapshot-hours', type=float, default=6,
+                        help="simulated hours between logged top allocation sites")
+    # The API's rolling stats over a day of history take about 50 KiB/h until the first day is full
+    parser.add_argument('--budget', type=float, default=128, help="traced growth budget in KiB per simulated hour")
+    parser.add_argument('--rss-budget', type=float, default=256, help="RSS growth budget in KiB per simulated hour")
+    parser.add_argument('--frames', type=int, default=5, help="traceback frames kept per allocation")
+    parser.add_argument('--fail-rate', type=float, default=0, help="share of requests the stand-in server fails")
+    parser.add_argument('--latency', type=float, default=0, help="seconds the stand-in server takes per request")
+    parser.add_argument('--config', help="YAML merged over the soak config, e.g. with spool or aggregation")
+    parser.add_argument('--workdir', help="directory for logs and stores, a temporary one by default")
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='luftdaten-soak-')
+    os.makedirs(workdir, exist_ok=True)
+    logger = log_setup.get_logger(os.path.join(workdir, 'luftdaten.log'), console=False, level=logging.INFO)
+    recorder = MemoryRecorder(logger, frames=args.frames,
+                              dump_path=os.path.join(workdir, 'memory-dump.txt')).install_signal()
+    server = StandInServer(latency=args.latency, fail_rate=args.fail_rate).start()
+    clock = simulated_devices.AcceleratedClock(args.speedup)
+    config = soak_config(server, workdir, args.speedup)
+    if args.config:
+        with open(args.config) as f:
+            merge(config, yaml.safe_load(f) or {})
+    print("Soak of {}h at {}x, logs in {}, pid {}".format(args.hours, args.speedup, workdir, os.getpid()))
+
+    devices = simulated_devices.simulated_reader_devices(frame_interval=1 / args.speedup,
+                                                         latency_scale=1 / args.speedup, clock=clock.time)
+    devices['st7735'] = simulated_devices.SimulatedST7735(
+        spi_speed_hz=simulated_devices.ST7735_SPI_HZ * args.speedup)
+    collector_module = load_collector_module()
+    collector = collector_module.Collector(config, logger, startup.StartupTimer(), devices=devices,
+                                           serial_number='soak')
+    # The stand-in server is always reachable
+    collector.network.check = lambda: True
+    collector.network.refresh()
+    if collector.scheduler:
+        collector.scheduler.clock = clock.monotonic
+        collector.scheduler.sleep = clock.sleep
+    soak = Soak(clock, recorder, args.hours, args.warmup, args.sample_minutes / 60, args.snapshot_hours)
+    readings = collector.readings
+    collector.readings = lambda: soak.readings(readings())
+
+    collector.start()
+    try:
+        collector.run()
+    finally:
+        collector.stop()
+        server.stop()
+
+    recorder.sample(clock.elapsed() / 3600)
+    traced_growth, rss_growth = recorder.growth_per_hour()
+    print(recorder.report())
+    print("Stand-in server: {}".format(server.stats()))
+    print("Sink queue depths: {}, dropped: {}".format(collector.dispatcher.queue_depths(),
+                                                      collector.dispatcher.dropped_counts()))
+    if collector.scheduler:
+        print("Sampling: {}".format(collector.scheduler.stats()))
+    failed = []
+    if traced_growth / 1024 > args.budget:
+        failed.append("traced {:.1f} KiB/h over {} KiB/h".format(traced_growth / 1024, args.budget))
+    if rss_growth / 1024 > args.rss_budget:
+        failed.append("RSS {:.1f} KiB/h over {} KiB/h".format(rss_growth / 1024, args.rss_budget))
+    if failed:
+        print("FAILED: growth {}".format(', '.join(failed)))
+        sys.exit(1)
+    print("OK: traced {:+.1f} KiB/h, RSS {:+.1f} KiB/h".format(traced_growth / 1024, rss_growth / 1024))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+import random
+import time
+from logging import Logger
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+# Stops calling a failing sink for an exponentially growing, jittered delay and lets a single probe through
+# once the delay is over
+class CircuitBreaker:
+    def __init__(self, name: str, logger: Logger, failure_threshold: int = 3, base_delay: float = 5,
+                 max_delay: float = 600) -> None:
+        self.name = name
+        self.logger = logger
+        self.failure_threshold = failure_threshold
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.state = CLOSED
+        self.failures = 0
+        self.open_until = 0
+        # Nothing is let through before, set when the network comes back
+        self.resume_at = 0
+        # Totals over the whole run, failures above only counts the current streak
+        self.total_failures = 0
+        self.retries = 0
+
+    def allow(self) -> bool:
+        if time.monotonic() < self.resume_at:
+            return False
+        if self.state == CLOSED:
+            if self.failures:
+                self.retries += 1
+            return True
+        if time.monotonic() >= self.open_until:
+            self.state = HALF_OPEN
+            self.retries += 1
+            return True
+        return False
+
+    def record_success(self):
+        if self.state != CLOSED:
+            self.logger.info("Sink {} recovered after {} failures".format(self.name, self.failures))
+        self.state = CLOSED
+        self.failures = 0
+
+    def record_failure(self):
+        self.failures += 1
+        self.total_failures += 1
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            exponent = min(self.failures - self.failure_threshold, 16)
+            delay = min(self.max_delay, self.base_delay * 2 ** max(exponent, 0))
+            # Jittered, so sinks that failed together do not retry together
+            self.open_until = time.monotonic() + random.uniform(delay / 2, delay)
+            if self.state == CLOSED:
+                self.logger.warning("Sink {} paused after {} failures".format(self.name, self.failures))
+            self.state = OPEN
+
+    def collect_metrics(self):
+        yield 'sink_failures_total', 'counter', {'sink': self.name}, self.total_failures
+        yield 'sink_retries_total', 'counter', {'sink': self.name}, self.retries
+        yield 'sink_open', 'gauge', {'sink': self.name}, int(self.state != CLOSED)
+
+    # After the network came back, let the next call through after a random delay of at most jitter, whatever the
+    # state, so sinks do not all reconnect on the same tick. An open breaker sends its probe then.
+    def reset(self, jitter: float = 0):
+        self.resume_at = time.monotonic() + random.uniform(0, jitter)
+        if self.state == OPEN:
+            self.open_until = self.resume_at
@@ -0,0 +1,88 @@
+from typing import Dict, List, Optional, Sequence
+
+from aggregation import NANOS
+from reading_buffer import FIELDS
+
+
+# A field is significant once it moved more than absolute, or relative times the value last sent, whichever is
+# larger. heartbeat overrides the filter's own.
+class Deadband:
+    __slots__ = ('absolute', 'relative', 'heartbeat')
+
+    def __init__(self, absolute: float = 0.0, relative: float = 0.0, heartbeat: float = None) -> None:
+        self.absolute = absolute
+        self.relative = relative
+        self.heartbeat = heartbeat
+
+    def threshold(self, last: float) -> float:
+        return max(self.absolute, self.relative * abs(last))
+
+
+# Report by exception: a field with a deadband is only sent when it moved past its deadband from the value last sent,
+# or once it was not sent for heartbeat seconds. Fields without a deadband are always sent. Unsent fields are NaN,
+# like fields of a sensor that is not up, and readings left without any field are dropped. The series is the last
+# sent value until the next one, never more than the deadband off and never older than the heartbeat.
+# With a source (a WindowAggregator), the windows it closes are filtered.
+class DeadbandFilter:
+    def __init__(self, name: str, deadbands: Dict[str, Deadband], heartbeat: float = 300,
+                 fields: Sequence[str] = FIELDS, source=None) -> None:
+        self.name = name
+        self.deadbands = deadbands
+        self.heartbeat = int(heartbeat * NANOS)
+        self.heartbeats = {field: self.heartbeat if deadband.heartbeat is None else int(deadband.heartbeat * NANOS)
+                           for field, deadband in deadbands.items()}
+        self.fields = tuple(fields)
+        self.source = source
+        # Last sent (value, ts) per field
+        self.last_sent = {}
+        self.readings = 0
+        self.readings_sent = 0
+        self.values = 0
+        self.values_sent = 0
+
+    def output_fields(self) -> List[str]:
+        return self.source.output_fields() if self.source is not None else list(self.fields)
+
+    # Add a reading, returns what is left to send of it, or of the windows it closed
+    def add(self, values) -> List[dict]:
+        records = [values] if self.source is None else self.source.add(values)
+        return [record for record in map(self._filter, records) if record is not None]
+
+    def _filter(self, values) -> Optional[dict]:
+        ts = values['ts']
+        record = {'ts': ts}
+        sent = 0
+        for field, x in values.items():
+            if field == 'ts' or x is None or x != x:
+                continue
+            self.values += 1
+            deadband = self.deadbands.get(field)
+            if deadband is not None:
+                last = self.last_sent.get(field)
+                if (last is not None and abs(x - last[0]) <= deadband.threshold(last[0])
+                        and ts - last[1] < self.heartbeats[field]):
+                    record[field] = float('nan')
+                    continue
+                self.last_sent[field] = (x, ts)
+            record[field] = x
+            sent += 1
+        self.readings += 1
+        if not sent:
+            return None
+        self.readings_sent += 1
+        self.values_sent += sent
+        return record
+
+    # Share of the field values that were not sent
+    def reduction(self) -> float:
+        return 1 - self.values_sent / self.values if self.values else 0.0
+
+    def stats(self) -> dict:
+        return {'readings': self.readings, 'readings_sent': self.readings_sent, 'values': self.values,
+                'values_sent': self.values_sent, 'reduction': round(self.reduction(), 3)}
+
+    def collect_metrics(self):
+        yield 'deadband_values_total', 'counter', {'sink': self.name, 'result': 'sent'}, self.values_sent
+        yield 'deadband_values_total', 'counter', {'sink': self.name, 'result': 'suppressed'}, \
+            self.values - self.values_sent
+        yield 'deadband_reduction_ratio', 'gauge', {'sink': self.name}, self.reduction()
@@ -1,42 +1,181 @@
 import datetime
+import threading
+from collections import deque
 
-import ST7735
-from PIL import Image, ImageDraw
+from PIL import Image, ImageChops, ImageDraw
+
+from metrics import NULL_REGISTRY
+
+TEXT_COLOUR = (255, 255, 255)
+OK_BACK_COLOUR = (0, 0, 0)  # Black
+ERROR_BACK_COLOUR = (85, 15, 15)  # Red
+SPARKLINE_COLOUR = (60, 160, 255)
+# Above this share of changed pixels a full frame is cheaper than a window
+FULL_FRAME_RATIO = 0.6
+SPI_CHUNK_SIZE = 4096
+
+
+def create_st7735(rotation):
+    import ST7735
+    return ST7735.ST7735(
+        port=0,
+        cs=ST7735.BG_SPI_CS_FRONT,
+        dc=9,
+        backlight=12,
+        rotation=rotation,
+        spi_speed_hz=10000000
+    )
+
+
+class Sparkline:
+    def __init__(self, width: int, height: int) -> None:
+        self.width = width
+        self.height = height
+        self.values = deque(maxlen=width)
+        self.low = self.high = None
+        self.image = Image.new('RGB', (width, height), OK_BACK_COLOUR)
+
+    def _y(self, value):
+        span = (self.high - self.low) or 1
+        return self.height - 1 - int((value - self.low) / span * (self.height - 1))
+
+    # Shift the image one pixel and draw the new column, only a rescale redraws the whole line
+    def add(self, value):
+        self.values.append(value)
+        if self.low is None or not self.low <= value <= self.high:
+            self.low, self.high = min(self.values), max(self.values)
+            self.image = Image.new('RGB', (self.width, self.height), OK_BACK_COLOUR)
+            draw = ImageDraw.Draw(self.image)
+            offset = self.width - len(self.values)
+            for i, v in enumerate(self.values):
+                draw.line((offset + i, self.height - 1, offset + i, self._y(v)), fill=SPARKLINE_COLOUR)
+            return
+        self.image.paste(self.image.crop((1, 0, self.width, self.height)), (0, 0))
+        draw = ImageDraw.Draw(self.image)
+        draw.line((self.width - 1, 0, self.width - 1, self.height - 1), fill=OK_BACK_COLOUR)
+        draw.line((self.width - 1, self.height - 1, self.width - 1, self._y(value)), fill=SPARKLINE_COLOUR)
 
 
 class EnviroplusLCD:
-    def __init__(self, font):
+    def __init__(self, font, mode: str = 'status', dashboard_fields=('temperature', 'humidity', 'P2.5'),
+                 disp=None, metrics=NULL_REGISTRY) -> None:
         # Create LCD instance
-        self.disp = ST7735.ST7735(
-            port=0,
-            cs=ST7735.BG_SPI_CS_FRONT,
-            dc=9,
-            backlight=12,
-            rotation=270,
-            spi_speed_hz=10000000
-        )
+        self.rotation = 270
+        self.disp = disp or create_st7735(self.rotation)
         # Initialize display
         self.disp.begin()
 
         self.WIDTH = self.disp.width
         self.HEIGHT = self.disp.height
         self.font = font
+        self.mode = mode
+        self.lock = threading.Lock()
+        ascent, descent = font.getmetrics()
+        self.line_height = ascent + descent
+        self.backgrounds = {}
+        self.glyphs = {}
+        self.last_frame = None
+        self.status = ('disconnected', 'waiting')
+        self.dashboard_fields = tuple(dashboard_fields)
+        sparkline_height = max(4, self.HEIGHT // len(self.dashboard_fields) - self.line_height)
+        self.display_timer = metrics.histogram('stage_seconds', stage='display', name='lcd')
+        self.sparklines = {field: Sparkline(self.WIDTH, sparkline_height) for field in self.dashboard_fields}
+
+    def _background(self, colour):
+        background = self.backgrounds.get(colour)
+        if background is None:
+            background = self.backgrounds[colour] = Image.new('RGB', (self.WIDTH, self.HEIGHT), colour)
+        return background
+
+    def _glyph(self, char, back_colour):
+        glyph = self.glyphs.get((char, back_colour))
+        if glyph is None:
+            width = max(1, int(round(self.font.getlength(char))) if hasattr(self.font, 'getlength')
+                        else self.font.getsize(char)[0])
+            glyph = Image.new('RGB', (width, self.line_height), back_colour)
+            ImageDraw.Draw(glyph).text((0, 0), char, font=self.font, fill=TEXT_COLOUR)
+            self.glyphs[(char, back_colour)] = glyph
+        return glyph
+
+    # Compose text from cached glyphs instead of rendering it with the font every time
+    def _draw_text(self, img, lines, back_colour, top, centered=True):
+        for i, line in enumerate(lines):
+            glyphs = [self._glyph(char, back_colour) for char in line]
+            x = (self.WIDTH - sum(glyph.width for glyph in glyphs)) // 2 if centered else 0
+            for glyph in glyphs:
+                img.paste(glyph, (x, top + i * self.line_height))
+                x += glyph.width
 
     # Display Last request date, last request status and Wi-Fi status on LCD
     def display_status(self, wifi_status, info_status):
-        text_colour = (255, 255, 255)
-        ok_back_colour = (0, 0, 0)  # Black
-        error_back_colour = (85, 15, 15)  # Red
-        back_colour = ok_back_colour if wifi_status == 'connected' else error_back_colour
-        message = "{:%Y-%m-%d %H:%M:%S}\nLast update: {}\nWi-Fi: {}".format(datetime.datetime.now(), info_status, wifi_status)
-        img = Image.new('RGB', (self.WIDTH, self.HEIGHT), color=(0, 0, 0))
-        draw = ImageDraw.Draw(img)
-        size_x, size_y = draw.textsize(message, self.font)
-        x = (self.WIDTH - size_x) / 2
-        y = (self.HEIGHT / 2) - (size_y / 2)
-        draw.rectangle((0, 0, 160, 80), back_colour)
-        draw.text((x, y), message, font=self.font, fill=text_colour)
-        self.disp.display(img)
+        with self.lock:
+            self.status = (wifi_status, info_status)
+            if self.mode != 'status':
+                return
+            back_colour = OK_BACK_COLOUR if wifi_status == 'connected' else ERROR_BACK_COLOUR
+            lines = ["{:%Y-%m-%d %H:%M:%S}".format(datetime.datetime.now()), "Last update: {}".format(info_status),
+                     "Wi-Fi: {}".format(wifi_status)]
+            img = self._background(back_colour).copy()
+            self._draw_text(img, lines, back_colour, (self.HEIGHT - len(lines) * self.line_height) // 2)
+            self._show(img)
+
+    # Live values with a sparkline per field, the header shows the last upload status
+    def display_dashboard(self, values):
+        with self.lock:
+            if self.mode != 'dashboard':
+                return
+            wifi_status, info_status = self.status
+            img = self._background(OK_BACK_COLOUR).copy()
+            row_height = self.HEIGHT // len(self.dashboard_fields)
+            for i, field in enumerate(self.dashboard_fields):
+                value = values.get(field)
+                if value is None or value != value:
+                    continue
+                sparkline = self.sparklines[field]
+                sparkline.add(value)
+                top = i * row_height
+                label = "{} {} {}".format(field, value, '' if i else '({}/{})'.format(info_status, wifi_status[:3]))
+                self._draw_text(img, [label], OK_BACK_COLOUR, top, centered=False)
+                img.paste(sparkline.image, (0, top + self.line_height))
+            self._show(img)
+
+    def _show(self, img):
+        with self.display_timer.time():
+            self._send_frame(img)
+
+    # Send only the rectangle that changed since the last frame
+    def _send_frame(self, img):
+        if self.last_frame is None:
+            self.disp.display(img)
+            self.last_frame = img
+            return
+        bbox = ImageChops.difference(img, self.last_frame).getbbox()
+        self.last_frame = img
+        if bbox is None:
+            return
+        left, top, right, bottom = bbox
+        if (right - left) * (bottom - top) > FULL_FRAME_RATIO * self.WIDTH * self.HEIGHT:
+            self.disp.display(img)
+            return
+        self._display_window(img.crop(bbox), left, top, right - 1, bottom - 1)
+
+    # Image rectangle to panel window, following the numpy.rot90 the driver applies for the rotation
+    def _panel_window(self, x0, y0, x1, y1):
+        w, h = self.WIDTH, self.HEIGHT
+        quarter_turns = self.rotation // 90 % 4
+        if quarter_turns == 1:
+            return y0, w - 1 - x1, y1, w - 1 - x0
+        if quarter_turns == 2:
+            return w - 1 - x1, h - 1 - y1, w - 1 - x0, h - 1 - y0
+        if quarter_turns == 3:
+            return h - 1 - y1, x0, h - 1 - y0, x1
+        return x0, y0, x1, y1
+
+    def _display_window(self, region, x0, y0, x1, y1):
+        pixelbytes = list(self.disp.image_to_data(region, self.rotation))
+        self.disp.set_window(*self._panel_window(x0, y0, x1, y1))
+        for i in range(0, len(pixelbytes), SPI_CHUNK_SIZE):
+            self.disp.data(pixelbytes[i:i + SPI_CHUNK_SIZE])
 
     def turnoff(self):
         self.disp.set_backlight(0)
@@ -1,65 +1,153 @@
 import time
+from logging import Logger
 from subprocess import PIPE, Popen
 
-from bme280 import BME280
-from enviroplus import gas
-from pms5003 import PMS5003, ReadTimeoutError
+from metrics import NULL_REGISTRY
+from pms5003_stream import PMS5003Stream
+from sampling_scheduler import SamplingScheduler, SensorTask
 
-try:
-    from smbus2 import SMBus
-except ImportError:
-    from smbus import SMBus
+CPU_THERMAL_ZONE = '/sys/class/thermal/thermal_zone0/temp'
 
-try:
-    # Transitional fix for breaking change in LTR559
-    from ltr559 import LTR559
+# Seconds between reads of each sensor, the PMS5003 streams a new frame about every second
+DEFAULT_PERIODS = {'cpu': 10, 'weather': 1, 'gas': 5, 'light': 2, 'particles': 1}
 
-    ltr559 = LTR559()
-except ImportError:
-    import ltr559
 
+# Hardware libraries are only imported for the devices that are not injected, e.g. by the simulation harness
+def create_bme280():
+    from bme280 import BME280
+    try:
+        from smbus2 import SMBus
+    except ImportError:
+        from smbus import SMBus
+    return BME280(i2c_dev=SMBus(1))
 
-class EnviroPlusReader:
-    def __init__(self, comp_factor: float = 1.2) -> None:
-        self.bus = SMBus(1)
 
-        # Create BME280 (temp, humidity and pressure sensor) instance
-        self.bme280 = BME280(i2c_dev=self.bus)
+def create_pms5003():
+    from pms5003 import PMS5003
+    return PMS5003()
+
+
+def create_gas():
+    from enviroplus import gas
+    return gas
+
+
+def create_ltr559():
+    try:
+        # Transitional fix for breaking change in LTR559
+        from ltr559 import LTR559
+
+        return LTR559()
+    except ImportError:
+        import ltr559
+        return ltr559
 
-        # Create PMS5003 dust sensor instance
-        self.pms5003 = PMS5003()
+
+DEVICE_FACTORIES = {'bme280': create_bme280, 'pms5003': create_pms5003, 'gas': create_gas, 'ltr559': create_ltr559}
+# Sensor task reading each device
+DEVICE_TASKS = {'bme280': 'weather', 'pms5003': 'particles', 'gas': 'gas', 'ltr559': 'light'}
+
+
+class EnviroPlusReader:
+    # With create_devices=False the devices that are not given stay unset until attach() is called, so sampling can
+    # start with the BME280 while the others are still coming up
+    def __init__(self, logger: Logger, comp_factor: float = 1.2, bme280=None, pms5003=None, gas=None,
+                 ltr559=None, cpu_temperature=None, create_devices: bool = True) -> None:
+        self.logger = logger
+        self.cpu_temperature = cpu_temperature or self.get_cpu_temperature
         self.comp_factor = comp_factor
+        self.sampling = None
+        self.periods = dict(DEFAULT_PERIODS)
+        self.bme280 = self.pms5003 = self.gas = self.ltr559 = None
+        # Frames are consumed on a background thread, reads only take the latest one
+        self.pms5003_stream = None
+        devices = {'bme280': bme280, 'pms5003': pms5003, 'gas': gas, 'ltr559': ltr559}
+        for name, device in devices.items():
+            if device is None and create_devices:
+                device = DEVICE_FACTORIES[name]()
+            if device is not None:
+                self.attach(name, device)
 
-    def read_values(self):
+    def attach(self, name: str, device):
+        setattr(self, name, device)
+        if name == 'pms5003':
+            self.pms5003_stream = PMS5003Stream(device, self.logger)
+        if self.sampling is not None:
+            self.sampling.add_task(self._task(DEVICE_TASKS[name]))
+
+    def _task(self, name):
+        return SensorTask(name, getattr(self, 'read_' + name), self.periods[name])
+
+    def read_weather(self):
+        return {
+            'raw_temperature': self.bme280.get_temperature(),
+            'pressure': round(self.bme280.get_pressure(), 2),
+            'humidity': round(self.bme280.get_humidity(), 2)
+        }
+
+    def read_gas(self):
+        data = self.gas.read_all()
+        return {
+            'oxidising': round(data.oxidising / 1000, 4),
+            'reducing': round(data.reducing / 1000, 4),
+            'nh3': round(data.nh3 / 1000, 4)
+        }
+
+    def read_light(self):
+        return {'lux': round(self.ltr559.get_lux(), 2)}
+
+    def read_particles(self):
+        pm_values, _age = self.pms5003_stream.latest()
+        return {
+            'P2.5': pm_values.pm_ug_per_m3(2.5),
+            'P10': pm_values.pm_ug_per_m3(10),
+            'P1.0': pm_values.pm_ug_per_m3(1.0)
+        }
+
+    def read_cpu(self):
+        return {'cpu_temperature': self.cpu_temperature()}
+
+    # Merge the latest reading of every sensor into the values dict the sinks expect, only weather is required, the
+    # other sensors are left out until they came up. Without a CPU temperature the raw temperature is sent
+    # uncompensated.
+    def merge(self, latest):
+        weather = latest['weather']
         values = {}
-        cpu_temp = self.get_cpu_temperature()
-        raw_temp = self.bme280.get_temperature()
-        comp_temp = raw_temp - ((cpu_temp - raw_temp) / self.comp_factor)
+        raw_temp = weather['raw_temperature']
+        comp_temp = raw_temp
+        if 'cpu' in latest:
+            comp_temp = raw_temp - ((latest['cpu']['cpu_temperature'] - raw_temp) / self.comp_factor)
         values['temperature'] = round(comp_temp, 2)
-        values['pressure'] = round(self.bme280.get_pressure(), 2)
-        values['humidity'] = round(self.bme280.get_humidity(), 2)
-        data = gas.read_all()
-        values['oxidising'] = round(data.oxidising / 1000, 4)
-        values['reducing'] = round(data.reducing / 1000, 4)
-        values['nh3'] = round(data.nh3 / 1000, 4)
-        values['lux'] = round(ltr559.get_lux(), 2)
-        try:
-            pm_values = self.pms5003.read()
-            values['P2.5'] = pm_values.pm_ug_per_m3(2.5)
-            values['P10'] = pm_values.pm_ug_per_m3(10)
-            values['P1.0'] = pm_values.pm_ug_per_m3(1.0)
-        except ReadTimeoutError:
-            self.pms5003.reset()
-            pm_values = self.pms5003.read()
-            values['P2.5'] = pm_values.pm_ug_per_m3(2.5)
-            values['P10'] = pm_values.pm_ug_per_m3(10)
-            values['P1.0'] = pm_values.pm_ug_per_m3(1.0)
-
+        values['pressure'] = weather['pressure']
+        values['humidity'] = weather['humidity']
+        values.update(latest.get('gas', {}))
+        values.update(latest.get('light', {}))
+        values.update(latest.get('particles', {}))
         values['ts'] = time.time_ns()
         return values
 
+    def read_values(self):
+        return self.merge({'cpu': self.read_cpu(), 'weather': self.read_weather(), 'gas': self.read_gas(),
+                           'light': self.read_light(), 'particles': self.read_particles()})
+
+    # Scheduler reading every sensor at its own period in seconds, missing periods use DEFAULT_PERIODS. Devices
+    # attached later join it with their own task.
+    def scheduler(self, logger: Logger, tick: float = 2, periods: dict = None,
+                  metrics=NULL_REGISTRY) -> SamplingScheduler:
+        self.periods = dict(DEFAULT_PERIODS, **(periods or {}))
+        tasks = [self._task('cpu')] + [self._task(DEVICE_TASKS[name]) for name in DEVICE_FACTORIES
+                                       if getattr(self, name) is not None]
+        self.sampling = SamplingScheduler(tasks, self.merge, logger, tick=tick, metrics=metrics)
+        return self.sampling
+
     @staticmethod
     def get_cpu_temperature():
+        # sysfs is a plain file read, vcgencmd forks a process
+        try:
+            with open(CPU_THERMAL_ZONE) as f:
+                return int(f.read()) / 1000
+        except (OSError, ValueError):
+            pass
         process = Popen(['vcgencmd', 'measure_temp'], stdout=PIPE, universal_newlines=True)
         output, _error = process.communicate()
         return float(output[output.index('=') + 1:output.rindex("'")])
@@ -0,0 +1,363 @@
+#!/usr/bin/env python
+import socket
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logging import Logger
+from typing import Callable, Dict, List
+
+import yaml
+
+import batching_sink
+import circuit_breaker
+import log_setup
+import network_monitor
+import sink_dispatcher
+from line_protocol import DEFAULT_SCHEMA, LineProtocolEncoder
+from reading_buffer import FIELDS
+from station_client import GATEWAY_HTTP_PORT, GATEWAY_UDP_PORT
+from station_protocol import ProtocolError, decode_frame
+
+STATION_TAG = 'station'
+NAN = float('nan')
+UDP_BUFFER_SIZE = 4 * 1024 * 1024
+
+
+class StationStats:
+    def __init__(self) -> None:
+        self.frames = 0
+        self.readings = 0
+        self.lost_frames = 0
+        self.next_sequence = None
+        self.last_seen = 0
+
+    def record(self, sequence, readings):
+        self.frames += 1
+        self.readings += readings
+        self.last_seen = time.time()
+        # A restarted station starts again from 0, only forward gaps count as lost
+        if self.next_sequence is not None and 0 < sequence - self.next_sequence < 1 << 31:
+            self.lost_frames += sequence - self.next_sequence
+        self.next_sequence = (sequence + 1) & 0xFFFFFFFF
+
+
+class _ReadingsHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.path.split('?')[0] != '/readings':
+            status = 404
+        else:
+            status = 204 if self.server.receiver.handle(body, self.client_address) else 400
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+
+# Stations of a fleet connect at the same time, the default backlog of 5 resets them
+class _GatewayHTTPServer(ThreadingHTTPServer):
+    request_queue_size = 128
+    daemon_threads = True
+
+
+# Takes station frames over UDP and HTTP and hands the decoded readings to on_readings(station_id, readings)
+class GatewayReceiver:
+    def __init__(self, on_readings: Callable[[str, List[dict]], None], logger: Logger, host: str = '0.0.0.0',
+                 udp_port: int = GATEWAY_UDP_PORT, http_port: int = GATEWAY_HTTP_PORT) -> None:
+        self.on_readings = on_readings
+        self.logger = logger
+        self.lock = threading.Lock()
+        self.stations = {}
+        self.invalid_frames = 0
+        self.running = True
+        self.udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        # Bursts from hundreds of stations are queued in the kernel rather than dropped
+        self.udp.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, UDP_BUFFER_SIZE)
+        self.udp.bind((host, udp_port))
+        self.httpd = _GatewayHTTPServer((host, http_port), _ReadingsHandler)
+        self.httpd.receiver = self
+        self.threads = [threading.Thread(target=self._receive_udp, name='gateway-udp', daemon=True),
+                        threading.Thread(target=self.httpd.serve_forever, name='gateway-http', daemon=True)]
+
+    @property
+    def udp_port(self) -> int:
+        return self.udp.getsockname()[1]
+
+    @property
+    def http_port(self) -> int:
+        return self.httpd.server_address[1]
+
+    def start(self) -> 'GatewayReceiver':
+        for thread in self.threads:
+            thread.start()
+        return self
+
+    def _receive_udp(self):
+        while self.running:
+            try:
+                data, address = self.udp.recvfrom(65535)
+            except OSError:
+                if self.running:
+                    raise
+                return
+            self.handle(data, address)
+
+    def handle(self, data, address) -> bool:
+        try:
+            station_id, sequence, readings = decode_frame(data)
+        except (ProtocolError, UnicodeDecodeError) as e:
+            with self.lock:
+                self.invalid_frames += 1
+            self.logger.warning("Invalid frame from {}: {}".format(address[0], e))
+            return False
+        with self.lock:
+            stats = self.stations.get(station_id)
+            if stats is None:
+                stats = self.stations[station_id] = StationStats()
+                self.logger.info("New station {} at {}".format(station_id, address[0]))
+            stats.record(sequence, len(readings))
+        self.on_readings(station_id, readings)
+        return True
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                'stations': len(self.stations),
+                'readings': sum(stats.readings for stats in self.stations.values()),
+                'lost_frames': sum(stats.lost_frames for stats in self.stations.values()),
+                'invalid_frames': self.invalid_frames
+            }
+
+    def stop(self):
+        self.running = False
+        self.udp.close()
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+# Line protocol encoders of a worker process, one per station as the station is a tag
+_schema = DEFAULT_SCHEMA
+_encoders = OrderedDict()
+MAX_ENCODERS = 1024
+
+
+def _init_encoder_process(schema):
+    global _schema
+    _schema = schema
+
+
+def station_encoder(station_id: str, schema: dict = None) -> LineProtocolEncoder:
+    encoder = _encoders.get(station_id)
+    if encoder is None:
+        schema = schema or _schema
+        encoder = LineProtocolEncoder(dict(schema, tags=dict(schema.get('tags', {}), **{STATION_TAG: station_id})))
+        _encoders[station_id] = encoder
+        if len(_encoders) > MAX_ENCODERS:
+            _encoders.popitem(last=False)
+    return encoder
+
+
+def encode_station(batch) -> bytes:
+    station_id, readings = batch
+    return station_encoder(station_id).encode(readings)
+
+
+def group_by_station(readings) -> Dict[str, List[dict]]:
+    groups = {}
+    for values in readings:
+        groups.setdefault(values[STATION_TAG], []).append(values)
+    return groups
+
+
+# Multi-station batches for InfluxDB, every station's readings are encoded on the process pool with the station tag
+class InfluxDbGatewayWriter:
+    def __init__(self, influxdb, logger: Logger, schema: dict = None, pool: ProcessPoolExecutor = None) -> None:
+        self.influxdb = influxdb
+        self.logger = logger
+        self.schema = schema or DEFAULT_SCHEMA
+        self.pool = pool
+
+    def encode(self, readings) -> bytes:
+        groups = list(group_by_station(readings).items())
+        if self.pool is None:
+            payloads = [station_encoder(station_id, self.schema).encode(values) for station_id, values in groups]
+        else:
+            payloads = self.pool.map(encode_station, groups)
+        return b'\n'.join(payload for payload in payloads if payload)
+
+    def write(self, readings):
+        payload = self.encode(readings)
+        if payload:
+            self.influxdb.write_lines(payload)
+
+
+# OpenSenseMap has an endpoint per senseBox, readings are written for every station with a box configured. A box
+# failing does not stop the others, only the readings it did not take are left to retry.
+class OpenSenseMapGatewayWriter:
+    def __init__(self, clients: dict, logger: Logger) -> None:
+        self.clients = clients
+        self.logger = logger
+        self.unknown_stations = set()
+
+    def write(self, readings):
+        unwritten = []
+        cause = None
+        for station_id, values in group_by_station(readings).items():
+            client = self.clients.get(station_id)
+            if client is None:
+                if station_id not in self.unknown_stations:
+                    self.unknown_stations.add(station_id)
+                    self.logger.info("No senseBox configured for station {}".format(station_id))
+                continue
+            try:
+                client.write_values(values)
+            except batching_sink.PartialWriteError as e:
+                unwritten += values[e.written:]
+                cause = e.cause
+            except Exception as e:
+                unwritten += values
+                cause = e
+        if unwritten:
+            raise batching_sink.PartialWriteError(cause, written=len(readings) - len(unwritten), unwritten=unwritten)
+
+
+# Receives the readings of a fleet of stations and writes them in large multi-station batches. Stations still push to
+# Luftdaten themselves, under their own sensor id.
+class Gateway:
+    def __init__(self, config: dict, logger: Logger) -> None:
+        self.config = config
+        self.logger = logger
+        gateway_cfg = config.get('gateway', {})
+        self.gateway_cfg = gateway_cfg
+        self.network = network_monitor.NetworkMonitor(logger)
+        self.breaker_cfg = config.get('circuit_breaker', {})
+        self.breakers = []
+        self.network.add_listener(self.on_network_change)
+        self.dispatcher = sink_dispatcher.SinkDispatcher(logger, max_queue_size=gateway_cfg.get('queue_size', 100000))
+        self.sinks = []
+        self.writers = []
+        self.session = None
+        self.pool = None
+        workers = gateway_cfg.get('workers', 2)
+        schema = config.get('influxdb', {}).get('schema', DEFAULT_SCHEMA)
+        if workers:
+            self.pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_encoder_process,
+                                            initargs=(schema,))
+        if 'influxdb' in config or 'opensensemap' in config:
+            import http_session
+            http_cfg = config.get('http', {})
+            self.session = http_session.create_session(connect_timeout=http_cfg.get('connect_timeout', 5),
+                                                       read_timeout=http_cfg.get('read_timeout', 30),
+                                                       pool_connections=http_cfg.get('pool_connections', 4),
+                                                       pool_maxsize=http_cfg.get('pool_maxsize', 4))
+        if 'influxdb' in config:
+            import influxdb_local_weather_client
+            influxdb_cfg = config['influxdb']
+            influxdb = influxdb_local_weather_client.InfluxDbWeather(
+                influxdb_cfg['host'], influxdb_cfg['port'], influxdb_cfg['database'], influxdb_cfg['username'],
+                influxdb_cfg['password'], logger, session=self.session,
+                compression=influxdb_cfg.get('compression', influxdb_local_weather_client.GZIP))
+            self.add_sink('influxdb', InfluxDbGatewayWriter(influxdb, logger, schema, self.pool).write)
+        if 'opensensemap' in config:
+            self.add_sink('opensensemap', OpenSenseMapGatewayWriter(self.opensensemap_clients(), logger).write)
+        self.receiver = GatewayReceiver(self.on_readings, logger, host=gateway_cfg.get('host', '0.0.0.0'),
+                                        udp_port=gateway_cfg.get('udp_port', GATEWAY_UDP_PORT),
+                                        http_port=gateway_cfg.get('http_port', GATEWAY_HTTP_PORT))
+        self.flush_timer = None
+
+    def create_breaker(self, name):
+        breaker = circuit_breaker.CircuitBreaker(name, self.logger,
+                                                 failure_threshold=self.breaker_cfg.get('failure_threshold', 3),
+                                                 base_delay=self.breaker_cfg.get('base_delay', 5),
+                                                 max_delay=self.breaker_cfg.get('max_delay', 600))
+        self.breakers.append(breaker)
+        return breaker
+
+    def on_network_change(self, online):
+        if online:
+            for breaker in self.breakers:
+                breaker.reset(jitter=self.breaker_cfg.get('reconnect_jitter', 10))
+
+    # Gateway batches are far larger than a station's, they are flushed by count or age
+    def add_sink(self, name, write):
+        cfg = self.gateway_cfg.get('batching', {}).get(name, {})
+        policy = batching_sink.FlushPolicy(max_count=cfg.get('max_count', 5000), max_bytes=cfg.get('max_bytes'),
+                                           max_age=cfg.get('max_age', 10))
+        sink = batching_sink.ListBatchingSink(name, write, self.logger, policy,
+                                              max_pending=cfg.get('max_pending', 100000),
+                                              breaker=self.create_breaker(name), network=self.network)
+        self.sinks.append(sink)
+        self.dispatcher.add_sink(name, sink.send)
+
+    # stations: station id -> senseBox and sensor ids, as in the opensensemap section of a station
+    def opensensemap_clients(self):
+        import opensensemap_client
+        opensensemap_cfg = self.config['opensensemap']
+        clients = {}
+        for station_id, box in opensensemap_cfg.get('stations', {}).items():
+            clients[station_id] = opensensemap_client.OpenSenseMapClient(
+                box['sensebox_id'], box['temperature_sensor_id'], box['humidity_sensor_id'],
+                box['pressure_sensor_id'], box['pm_1_0_sensor_id'], box['pm_2_5_sensor_id'], box['pm_10_sensor_id'],
+                self.logger, session=self.session,
+                upload_format=opensensemap_cfg.get('upload_format', opensensemap_client.JSON),
+                max_measurements=opensensemap_cfg.get('max_measurements', opensensemap_client.MAX_MEASUREMENTS),
+                compression=opensensemap_cfg.get('compression'))
+        return clients
+
+    # Fields a station did not send are NaN, as in the reading buffer, so every reading has all of them
+    def on_readings(self, station_id, readings):
+        for values in readings:
+            for field in FIELDS:
+                values.setdefault(field, NAN)
+            values[STATION_TAG] = station_id
+            self.dispatcher.dispatch(values, [sink.name for sink in self.sinks])
+
+    def start(self):
+        self.dispatcher.start()
+        self.flush_timer = batching_sink.FlushTimer(
+            lambda: self.dispatcher.dispatch(batching_sink.FLUSH_TICK, [sink.name for sink in self.sinks]),
+            self.logger).start()
+        self.receiver.start()
+        self.logger.info("Gateway listening on UDP port {} and HTTP port {}".format(self.receiver.udp_port,
+                                                                                   self.receiver.http_port))
+
+    def run(self):
+        update_time = time.time()
+        while True:
+            time.sleep(1)
+            if time.time() - update_time > 120:
+                update_time = time.time()
+                self.logger.info("Gateway: {}, queue depths: {}, dropped: {}".format(
+                    self.receiver.stats(), self.dispatcher.queue_depths(), self.dispatcher.dropped_counts()))
+
+    def stop(self):
+        self.receiver.stop()
+        if self.flush_timer:
+            self.flush_timer.stop()
+        self.dispatcher.stop(timeout=10)
+        for sink in self.sinks:
+            sink.close()
+        if self.pool:
+            self.pool.shutdown()
+
+
+def main():
+    config = yaml.safe_load(open("config.yml"))
+    logger = log_setup.get_logger('/var/log/luftdaten-gateway.log')
+    gateway = Gateway(config, logger)
+    gateway.start()
+    try:
+        gateway.run()
+    except KeyboardInterrupt:
+        gateway.stop()
+        raise
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import NULL_REGISTRY
+
+
+# Adapter applying a default timeout to every request, requests has none by default
+class TimeoutHTTPAdapter(HTTPAdapter):
+    def __init__(self, timeout, *args, metrics=NULL_REGISTRY, **kwargs) -> None:
+        self.timeout = timeout
+        self.metrics = metrics
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        if self.metrics.enabled and isinstance(request.body, (bytes, str)):
+            self.metrics.counter('bytes_sent_total', host=urlsplit(request.url).hostname).inc(len(request.body))
+        return super().send(request, **kwargs)
+
+
+# Keep-alive session with pooled connections, meant to be shared by all HTTP sinks
+def create_session(connect_timeout: float = 5, read_timeout: float = 30, pool_connections: int = 4,
+                   pool_maxsize: int = 4, metrics=NULL_REGISTRY) -> requests.Session:
+    session = requests.Session()
+    adapter = TimeoutHTTPAdapter((connect_timeout, read_timeout), pool_connections=pool_connections,
+                                 pool_maxsize=pool_maxsize, metrics=metrics)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+# Requests sent and connections opened per host, every request above the number of connections reused one
+def connection_stats(session: requests.Session) -> dict:
+    stats = {}
+    for adapter in set(session.adapters.values()):
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools[key]
+            if pool is None:
+                continue
+            host_stats = stats.setdefault(pool.host, {'requests': 0, 'connections': 0, 'reused': 0})
+            host_stats['requests'] += pool.num_requests
+            host_stats['connections'] += pool.num_connections
+            host_stats['reused'] = host_stats['requests'] - host_stats['connections']
+    return stats
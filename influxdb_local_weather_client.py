@@ -1,32 +1,71 @@
+import time
 from logging import Logger
 
+import requests
 from influxdb import InfluxDBClient
 
+from batching_sink import FLUSH_TICK, FlushPolicy, FlushTimer, ListBatchingSink
+from line_protocol import LineProtocolEncoder
+from metrics import NULL_REGISTRY
+from uplink import GZIP, UplinkTraffic, check_encoding, compress
+
 
 class InfluxDbWeather:
     def __init__(self, host: str, port: int, database: str, username: str, password: str, logger: Logger,
-                 buffer_size: int = 100) -> None:
-        self.values_buffer = []
-        self.client = InfluxDBClient(host=host, port=port, database=database, username=username, password=password)
-        self.buffer_size = buffer_size
+                 buffer_size: int = 100, encoder: LineProtocolEncoder = None, session: requests.Session = None,
+                 metrics=NULL_REGISTRY, flush_policy: FlushPolicy = None, compression: str = GZIP,
+                 traffic: UplinkTraffic = None) -> None:
+        self.encoder = encoder or LineProtocolEncoder()
+        # /write takes gzip and deflate bodies, line protocol shrinks to a fraction
+        self.compression = check_encoding(compression)
+        self.traffic = traffic or UplinkTraffic('influxdb')
+        self.database = database
+        adapters = dict(session.adapters) if session is not None else {}
+        self.client = InfluxDBClient(host=host, port=port, database=database, username=username, password=password,
+                                     session=session)
+        # InfluxDBClient mounts a plain HTTPAdapter on the session it is given, put the shared session's timeout
+        # adapters back
+        for prefix, adapter in adapters.items():
+            session.mount(prefix, adapter)
         self.logger = logger
+        # Readings passed to send_to_influxdb are batched until any limit of the flush policy is reached
+        self.batch = ListBatchingSink('influxdb', self._write_batch, logger, flush_policy or FlushPolicy(buffer_size))
+        self.flush_timer = None
+        if self.batch.policy.max_age is not None:
+            self.flush_timer = FlushTimer(lambda: self.batch.send(FLUSH_TICK), logger).start()
+        self.encode_timer = metrics.histogram('stage_seconds', stage='encode', name='influxdb')
+
+    def map_to_influxdb(self, values) -> bytes:
+        with self.encode_timer.time():
+            return self.encoder.encode(values)
 
-    @staticmethod
-    def map_to_influxdb(values):
-        influxdb_messages = []
-        for value in values:
-            influxdb_messages.append("weather,location=acacias temperature={},humidity={},pressure={} {}"
-                                     .format(value['temperature'], value['humidity'], value['pressure'], value['ts']))
-            influxdb_messages.append("particles,location=acacias P25={},P10={},P1={} {}"
-                                     .format(value['P2.5'], value['P10'], value['P1.0'], value['ts']))
-            influxdb_messages.append("gas,location=acacias oxidising={},reducing={},nh3={} {}"
-                                     .format(value['oxidising'], value['reducing'], value['nh3'], value['ts']))
+    def write_values(self, values):
+        self.write_lines(self.map_to_influxdb(values), readings=len(values))
 
-        return influxdb_messages
+    # The batch is already a line protocol payload, post it as is instead of letting write_points join lines
+    def write_lines(self, payload: bytes, readings: int = 0):
+        body = compress(payload, self.compression)
+        headers = {'Content-Type': 'application/octet-stream'}
+        if self.compression:
+            headers['Content-Encoding'] = self.compression
+        start = time.perf_counter()
+        ok = False
+        try:
+            self.client.request('write', 'POST', params={'db': self.database}, data=body,
+                                expected_response_code=204, headers=headers)
+            ok = True
+        finally:
+            self.traffic.record(readings, len(payload), len(body), time.perf_counter() - start, ok=ok)
+
+    def _write_batch(self, values):
+        self.logger.info("Sending data to influxDB")
+        self.write_values(values)
 
     def send_to_influxdb(self, values):
-        self.values_buffer.append(values)
-        if len(self.values_buffer) >= self.buffer_size:
-            self.logger.info("Sending data to influxDB")
-            self.client.write_points(points=self.map_to_influxdb(self.values_buffer), protocol='line')
-            self.values_buffer = []
+        self.batch.send(values)
+
+    # Stop the flush timer and write what is still pending
+    def close(self):
+        if self.flush_timer:
+            self.flush_timer.stop()
+        self.batch.close()
@@ -3,33 +3,46 @@ from logging import Logger
 from influxdb_client import InfluxDBClient
 from influxdb_client.client.write_api import SYNCHRONOUS
 
+from batching_sink import FLUSH_TICK, FlushPolicy, FlushTimer, ListBatchingSink
+from line_protocol import LineProtocolEncoder
+from metrics import NULL_REGISTRY
+
 
 class InfluxDbWeather:
-    def __init__(self, url: str, bucket_id: str, org: str, token: str, logger: Logger, buffer_size: int = 100) -> None:
+    def __init__(self, url: str, bucket_id: str, org: str, token: str, logger: Logger, buffer_size: int = 100,
+                 encoder: LineProtocolEncoder = None, metrics=NULL_REGISTRY, flush_policy: FlushPolicy = None) -> None:
         self.bucket_id = bucket_id
+        self.encoder = encoder or LineProtocolEncoder()
         self.org = org
-        self.values_buffer = []
         self.client = InfluxDBClient(url=url, token=token, org=org, enable_gzip=True)
         self.write_client = self.client.write_api(write_options=SYNCHRONOUS)
-        self.buffer_size = buffer_size
         self.logger = logger
+        # Readings passed to send_to_influxdb are batched until any limit of the flush policy is reached
+        self.batch = ListBatchingSink('influxdb', self._write_batch, logger, flush_policy or FlushPolicy(buffer_size))
+        self.flush_timer = None
+        if self.batch.policy.max_age is not None:
+            self.flush_timer = FlushTimer(lambda: self.batch.send(FLUSH_TICK), logger).start()
+        self.encode_timer = metrics.histogram('stage_seconds', stage='encode', name='influxdb')
+
+    def map_to_influxdb(self, values) -> bytes:
+        with self.encode_timer.time():
+            return self.encoder.encode(values)
 
-    @staticmethod
-    def map_to_influxdb(values):
-        influxdb_messages = []
-        for value in values:
-            influxdb_messages.append("weather,location=acacias temperature={},humidity={},pressure={} {}"
-                                     .format(value['temperature'], value['humidity'], value['pressure'], value['ts']))
-            influxdb_messages.append("particles,location=acacias P25={},P10={},P1={} {}"
-                                     .format(value['P2.5'], value['P10'], value['P1.0'], value['ts']))
-            influxdb_messages.append("gas,location=acacias oxidising={},reducing={},nh3={} {}"
-                                     .format(value['oxidising'], value['reducing'], value['nh3'], value['ts']))
+    def write_values(self, values):
+        self.write_lines(self.map_to_influxdb(values))
 
-        return influxdb_messages
+    def write_lines(self, payload: bytes):
+        self.write_client.write(self.bucket_id, self.org, payload)
+
+    def _write_batch(self, values):
+        self.logger.info("Sending data to influxDB")
+        self.write_values(values)
 
     def send_to_influxdb(self, values):
-        self.values_buffer.append(values)
-        if len(self.values_buffer) >= self.buffer_size:
-            self.logger.info("Sending data to influxDB")
-            self.write_client.write(self.bucket_id, self.org, self.map_to_influxdb(self.values_buffer))
-            self.values_buffer = []
+        self.batch.send(values)
+
+    # Stop the flush timer and write what is still pending
+    def close(self):
+        if self.flush_timer:
+            self.flush_timer.stop()
+        self.batch.close()
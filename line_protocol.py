@@ -0,0 +1,118 @@
+import math
+from itertools import chain
+
+from reading_buffer import ReadingBlock
+
+# Layout the InfluxDB clients always used: measurement -> {field key: reading field}. A field can also be a dict
+# with 'field', 'type' (float or int) and 'precision' (decimals, matching the rounding done by the reader).
+DEFAULT_SCHEMA = {
+    'tags': {'location': 'acacias'},
+    'measurements': {
+        'weather': {'fields': {'temperature': {'field': 'temperature', 'precision': 2},
+                               'humidity': {'field': 'humidity', 'precision': 2},
+                               'pressure': {'field': 'pressure', 'precision': 2}}},
+        'particles': {'fields': {'P25': 'P2.5', 'P10': 'P10', 'P1': 'P1.0'}},
+        'gas': {'fields': {'oxidising': {'field': 'oxidising', 'precision': 4},
+                           'reducing': {'field': 'reducing', 'precision': 4},
+                           'nh3': {'field': 'nh3', 'precision': 4}}},
+    }
+}
+
+FIELD_TYPES = ('float', 'int')
+
+
+def escape_measurement(name):
+    return str(name).replace('\\', '\\\\').replace(',', '\\,').replace(' ', '\\ ')
+
+
+def escape_key(name):
+    return escape_measurement(name).replace('=', '\\=')
+
+
+def _template_escape(text):
+    return text.replace('%', '%%')
+
+
+# One sum per column instead of a check per value. fsum raises on sums past the float range and on inf next to -inf,
+# those columns are checked value by value.
+def _all_finite(column):
+    try:
+        return math.isfinite(math.fsum(column))
+    except (OverflowError, ValueError):
+        return all(math.isfinite(x) for x in column)
+
+
+class _CompiledMeasurement:
+    def __init__(self, name, tags, fields) -> None:
+        prefix = escape_measurement(name) + ''.join(',{}={}'.format(escape_key(key), escape_key(value))
+                                                    for key, value in sorted(tags.items()))
+        self.prefix = prefix + ' '
+        self.fields = []
+        conversions = []
+        for key, field in fields.items():
+            field_type, precision = 'float', None
+            if isinstance(field, dict):
+                field_type = field.get('type', 'float')
+                precision = field.get('precision')
+                field = field['field']
+            if field_type not in FIELD_TYPES:
+                raise ValueError("Unknown field type {} for {}".format(field_type, key))
+            self.fields.append((escape_key(key), field, field_type))
+            if field_type == 'int':
+                conversions.append('%di')
+            else:
+                conversions.append('%r' if precision is None else '%.{}f'.format(int(precision)))
+        self.template = _template_escape(self.prefix) + ','.join(
+            '{}={}'.format(_template_escape(key), conversion)
+            for (key, _field, _field_type), conversion in zip(self.fields, conversions)) + ' %d'
+        self.conversions = conversions
+
+    def encode(self, columns, ts, lines):
+        values = [columns[field] for _key, field, _field_type in self.fields]
+        template = self.template
+        # Line protocol has no NaN or inf, only rows holding one of those need the per field path
+        if all(_all_finite(column) for column in values):
+            lines.extend([template % row for row in zip(*values, ts)])
+            return
+        for row in zip(*values, ts):
+            if all(x - x == 0 for x in row[:-1]):
+                lines.append(template % row)
+            else:
+                self._encode_partial(row, lines)
+
+    def _encode_partial(self, row, lines):
+        fields = ['{}={}'.format(key, conversion % value)
+                  for (key, _field, _field_type), conversion, value in zip(self.fields, self.conversions, row)
+                  if value - value == 0]
+        if fields:
+            lines.append('{}{} {}'.format(self.prefix, ','.join(fields), row[-1]))
+
+
+# Encodes whole batches of readings into a single line protocol payload, following a measurement/tag/field
+# schema that is compiled once
+class LineProtocolEncoder:
+    def __init__(self, schema: dict = None) -> None:
+        schema = schema or DEFAULT_SCHEMA
+        tags = schema.get('tags', {})
+        self.measurements = [
+            _CompiledMeasurement(name, dict(tags, **measurement.get('tags', {})), measurement['fields'])
+            for name, measurement in schema['measurements'].items()]
+        self.fields = sorted({field for measurement in self.measurements for _key, field, _type in measurement.fields})
+
+    def columns(self, values):
+        if isinstance(values, ReadingBlock):
+            return {field: list(chain(*values.column(field))) for field in self.fields + ['ts']}
+        # Readings without a field, before its sensor is up or after a deadband, take the NaN path
+        columns = {field: [value.get(field, math.nan) for value in values] for field in self.fields}
+        columns['ts'] = [value['ts'] for value in values]
+        return columns
+
+    def encode_lines(self, values):
+        columns = self.columns(values)
+        lines = []
+        for measurement in self.measurements:
+            measurement.encode(columns, columns['ts'], lines)
+        return lines
+
+    def encode(self, values) -> bytes:
+        return '\n'.join(self.encode_lines(values)).encode()
@@ -0,0 +1,148 @@
+import atexit
+import json
+import logging
+import math
+import queue
+import sys
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
+
+LOG_FORMAT = '%(asctime)s [%(levelname)s] %(message)s'
+# Memory the records waiting for the writer thread may take, newer records are dropped above it
+DEFAULT_BUFFER_BYTES = 1024 * 1024
+# Estimate of what a record takes besides its message: the LogRecord, its attribute dict and args
+RECORD_OVERHEAD = 512
+READINGS_LOGGER = 'luftdaten.readings'
+READINGS_LOG = '/var/log/luftdaten-readings.jsonl'
+
+
+# Queue bounded by the estimated bytes of the records in it instead of their number, never blocks the caller
+class ByteBoundedQueue:
+    def __init__(self, max_bytes: int = DEFAULT_BUFFER_BYTES) -> None:
+        self.max_bytes = max_bytes
+        self.queue = queue.SimpleQueue()
+        self.lock = threading.Lock()
+        self.nbytes = 0
+        self.dropped = 0
+
+    def put_nowait(self, record):
+        # The listener's stop sentinel is None
+        size = 0 if record is None else RECORD_OVERHEAD + sys.getsizeof(record.msg)
+        with self.lock:
+            if record is not None and self.nbytes + size > self.max_bytes:
+                self.dropped += 1
+                return
+            self.nbytes += size
+        self.queue.put_nowait((size, record))
+
+    def get(self, block: bool = True, timeout: float = None):
+        size, record = self.queue.get(block, timeout)
+        with self.lock:
+            self.nbytes -= size
+        return record
+
+
+# Hands records over as they are, so messages and readings are formatted on the writer thread
+class LazyQueueHandler(QueueHandler):
+    def prepare(self, record):
+        return record
+
+
+# Writes the records on a background thread and tells how many were dropped while the buffer was full. When no
+# record came for idle_interval seconds the handlers are flushed, so the last records before a quiet period are
+# written out.
+class LogWriter(QueueListener):
+    def __init__(self, records: ByteBoundedQueue, *handlers, idle_interval: float = 5) -> None:
+        super().__init__(records, *handlers, respect_handler_level=True)
+        self.idle_interval = idle_interval
+        self.reported = 0
+
+    def dequeue(self, block):
+        while True:
+            try:
+                return self.queue.get(block, self.idle_interval)
+            except queue.Empty:
+                if not block:
+                    raise
+                for handler in self.handlers:
+                    handler.flush()
+
+    def handle(self, record):
+        dropped = self.queue.dropped
+        if dropped > self.reported:
+            super().handle(logging.makeLogRecord({
+                'name': record.name, 'levelno': logging.WARNING, 'levelname': 'WARNING',
+                'msg': "{} log records dropped, the log buffer was full".format(dropped - self.reported)}))
+            self.reported = dropped
+        super().handle(record)
+
+
+# Daily rotated file flushed at most every flush_interval seconds rather than after every record, warnings and errors
+# are flushed right away
+class BufferedFileHandler(TimedRotatingFileHandler):
+    def __init__(self, filename: str, flush_interval: float = 5, **kwargs) -> None:
+        super().__init__(filename, **kwargs)
+        self.flush_interval = flush_interval
+        self.last_flush = time.monotonic()
+
+    def flush(self):
+        now = time.monotonic()
+        if now - self.last_flush >= self.flush_interval:
+            super().flush()
+            self.last_flush = now
+
+    def emit(self, record):
+        super().emit(record)
+        if record.levelno >= logging.WARNING:
+            super().flush()
+            self.last_flush = time.monotonic()
+
+    def close(self):
+        self.last_flush = 0
+        super().close()
+
+
+# One JSON object per reading, NaN written as null
+class JsonLinesFormatter(logging.Formatter):
+    def format(self, record):
+        values = record.msg
+        return json.dumps({field: None if isinstance(value, float) and not math.isfinite(value) else value
+                           for field, value in ((field, values[field]) for field in values.keys())},
+                          separators=(',', ':'))
+
+
+def _start_writer(logger, max_bytes, *handlers):
+    writer = LogWriter(ByteBoundedQueue(max_bytes), *handlers,
+                       idle_interval=min(getattr(handler, 'flush_interval', 5) for handler in handlers))
+    logger.addHandler(LazyQueueHandler(writer.queue))
+    writer.start()
+    # Write out what is still buffered on exit
+    atexit.register(writer.stop)
+    return writer
+
+
+# Create logger, file and console are written on a background thread
+def get_logger(path: str, max_bytes: int = DEFAULT_BUFFER_BYTES, level: int = logging.DEBUG,
+               console: bool = True) -> logging.Logger:
+    formatter = logging.Formatter(LOG_FORMAT)
+    handlers = [BufferedFileHandler(path, when='d', backupCount=7)]
+    if console:
+        handlers.append(logging.StreamHandler())
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    logger = logging.getLogger("luftdaten")
+    logger.setLevel(level)
+    _start_writer(logger, max_bytes, *handlers)
+    return logger
+
+
+# Readings channel, kept apart from the human-readable log: readings_logger.info(values) appends a JSON line
+def get_readings_logger(path: str, max_bytes: int = DEFAULT_BUFFER_BYTES) -> logging.Logger:
+    handler = BufferedFileHandler(path, flush_interval=30, when='d', backupCount=7)
+    handler.setFormatter(JsonLinesFormatter())
+    logger = logging.getLogger(READINGS_LOGGER)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    _start_writer(logger, max_bytes, handler)
+    return logger
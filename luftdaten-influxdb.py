@@ -1,22 +1,31 @@
 #!/usr/bin/env python
 
 import logging
+import threading
 import time
-from logging.handlers import MemoryHandler, TimedRotatingFileHandler
-from subprocess import check_output
 
 import yaml
-from PIL import ImageFont
 
-import enviroplus_lcd
+import aggregation
+import batching_sink
+import circuit_breaker
+import deadband
 import enviroplus_reader
-import influxdb_local_weather_client
-import luftdaten_client
-import opensensemap_client
+import log_setup
+import metrics
+import network_monitor
+import reading_buffer
+import reading_spool
+import recent_readings
+import sink_dispatcher
+import startup
+import timeseries_store
+import uplink
 
-config = yaml.safe_load(open("config.yml"))
+# Hardware, HTTP, InfluxDB and PIL libraries are imported by the components that use them, on the init threads,
+# so sampling starts before they are loaded
 
-print("""luftdaten-influxdb.py - Reads temperature, pressure, humidity,
+BANNER = """luftdaten-influxdb.py - Reads temperature, pressure, humidity,
 PM 1.0, PM2.5, and PM10 from Enviro plus and sends data to InfluxDB and Luftdaten,
 the citizen science air quality project.
 
@@ -28,22 +37,7 @@ Luftdaten map.
 
 Press Ctrl+C to exit!
 
-""")
-
-
-# Create logger
-def get_logger(path):
-    rotating_handler = TimedRotatingFileHandler(path, when='d', backupCount=7)
-    formatter = logging.Formatter('%(asctime)s [%(levelname)s] %(message)s')
-    rotating_handler.setFormatter(formatter)
-    memory_handler = MemoryHandler(capacity=512 * 1024, target=rotating_handler)
-    console_handler = logging.StreamHandler()
-    console_handler.setFormatter(formatter)
-    logger = logging.getLogger("luftdaten")
-    logger.setLevel(logging.DEBUG)
-    logger.addHandler(memory_handler)
-    logger.addHandler(console_handler)
-    return logger
+"""
 
 
 # Get Raspberry Pi serial number to use as ID
@@ -54,83 +48,493 @@ def get_serial_number():
                 return line.split(":")[1].strip()
 
 
-# Check for Wi-Fi connection
-def check_wifi():
-    if check_output(['hostname', '-I']):
-        return True
-    else:
-        return False
+def create_session(http_cfg, registry):
+    import http_session
+    return http_session.create_session(connect_timeout=http_cfg.get('connect_timeout', 5),
+                                       read_timeout=http_cfg.get('read_timeout', 30),
+                                       pool_connections=http_cfg.get('pool_connections', 4),
+                                       pool_maxsize=http_cfg.get('pool_maxsize', 4), metrics=registry)
 
 
-# Raspberry Pi ID to send to Luftdaten
-id = "raspi-" + get_serial_number()
+def create_lcd(display_cfg, registry, disp=None):
+    from PIL import ImageFont
 
-# Logger
-logger = get_logger('/var/log/luftdaten.log')
+    import enviroplus_lcd
 
-# Text settings
-font_size = 16
-font = ImageFont.truetype("fonts/Asap/Asap-Bold.ttf", font_size)
+    # Text settings
+    font_size = 16
+    font = ImageFont.truetype("fonts/Asap/Asap-Bold.ttf", font_size)
+    return enviroplus_lcd.EnviroplusLCD(font, mode=display_cfg.get('mode', 'status'),
+                                        dashboard_fields=display_cfg.get('fields', ('temperature', 'humidity',
+                                                                                     'P2.5')),
+                                        disp=disp, metrics=registry)
 
-# Display Raspberry Pi serial and Wi-Fi status
-logger.info("Raspberry Pi serial: {}".format(get_serial_number()))
-logger.info(
-    "Wi-Fi: {}\n".format('connected' if check_wifi() else 'disconnected'))
 
-time_since_update = 0
-update_time = time.time()
+# Sampling, stores and sinks of the collector. Sampling runs as soon as the BME280 is up, the other devices, the
+# HTTP clients and the display join when their init thread is done. devices given by name (bme280, pms5003, gas,
+# ltr559, cpu_temperature, st7735), e.g. simulated ones, are used instead of the hardware.
+class Collector:
+    def __init__(self, config: dict, logger: logging.Logger, timer: startup.StartupTimer, devices: dict = None,
+                 serial_number: str = None) -> None:
+        self.config = config
+        self.logger = logger
+        self.timer = timer
+        self.init = startup.ParallelInit(logger, timer)
+        self.devices = devices or {}
 
-# Enviroplus measures reader
-reader = enviroplus_reader.EnviroPlusReader()
+        # Raspberry Pi ID to send to Luftdaten
+        self.serial_number = serial_number or get_serial_number()
+        self.id = "raspi-" + self.serial_number
 
-# Luftdaten Client
-luftdaten_client = luftdaten_client.LuftdatenClient(id)
+        # Readings go to their own JSON lines log, written on a background thread like the main log
+        readings_path = config.get('logging', {}).get('readings', log_setup.READINGS_LOG)
+        self.readings_log = None
+        if readings_path:
+            self.readings_log = log_setup.get_readings_logger(
+                readings_path, max_bytes=config.get('logging', {}).get('buffer_bytes', log_setup.DEFAULT_BUFFER_BYTES))
 
-# InfluxDB client
-influxdb_cfg = config['influxdb']
-influxdb_weather = influxdb_local_weather_client.InfluxDbWeather(
-    influxdb_cfg['host'], influxdb_cfg['port'], influxdb_cfg['database'],
-    influxdb_cfg['username'], influxdb_cfg['password'], logger)
-enviroplus_lcd = enviroplus_lcd.EnviroplusLCD(font)
+        # Network state, watched in the background instead of forking hostname for every check
+        self.network = network_monitor.NetworkMonitor(logger)
 
-# OpenSenseMap client
-opensensemap_cfg = config['opensensemap']
-opensensemap_client = opensensemap_client.OpenSenseMapClient(opensensemap_cfg['sensebox_id'],
-                                                             opensensemap_cfg['temperature_sensor_id'],
-                                                             opensensemap_cfg['humidity_sensor_id'],
-                                                             opensensemap_cfg['pressure_sensor_id'],
-                                                             opensensemap_cfg['pm_1_0_sensor_id'],
-                                                             opensensemap_cfg['pm_2_5_sensor_id'],
-                                                             opensensemap_cfg['pm_10_sensor_id'], logger)
+        # Optional self-metrics, stage timings and counters served on a local Prometheus endpoint and written to
+        # InfluxDB
+        self.metrics_cfg = config.get('metrics', {})
+        self.registry = metrics.NULL_REGISTRY
+        if self.metrics_cfg.get('enabled'):
+            self.registry = metrics.MetricsRegistry()
+            metrics_server = metrics.MetricsServer(self.registry, host=self.metrics_cfg.get('host', '127.0.0.1'),
+                                                   port=self.metrics_cfg.get('port', 9101)).start()
+            logger.info("Serving metrics on port {}".format(metrics_server.port))
+        self.metrics_interval = self.metrics_cfg.get('influxdb_interval', 60) if self.registry.enabled else 0
 
-wifi_status = 'connected' if check_wifi() else 'disconnected'
-enviroplus_lcd.display_status(wifi_status, 'waiting')
-# Main loop to read data, display, and send to Luftdaten
-while True:
-    try:
-        time_since_update = time.time() - update_time
-        # Read measures
-        values = reader.read_values()
-        logger.debug(values)
-
-        # Sen measures to influxDb
-        influxdb_weather.send_to_influxdb(values)
-
-        # Send measures to OpenSenseMap
-        opensensemap_client.send_to_opensensemap(values)
-        if time_since_update > 120:
-            wifi_status = 'connected' if check_wifi() else 'disconnected'
-            # Send to Luftdaten
-            resp = luftdaten_client.send_to_luftdaten(values)
-            response = 'ok' if resp else 'failed'
-            update_time = time.time()
-            logger.info("Response: {}".format(response))
-            enviroplus_lcd.display_status(wifi_status, response)
-
-        time.sleep(2)
+        # Components brought up on the init threads
+        self.session = None
+        self.influxdb_weather = None
+        self.luftdaten_client = None
+        self.enviroplus_lcd = None
+
+        # Every sink backs off on its own circuit breaker. Once the network is back, every sink resumes at its own
+        # random moment within reconnect_jitter seconds, so they do not all reconnect at once
+        self.breaker_cfg = config.get('circuit_breaker', {})
+        self.breakers = []
+        self.network.add_listener(self.on_network_change)
+        self.luftdaten_breaker = self.create_breaker('luftdaten')
+
+        # Sink dispatcher, every sink gets its own queue and worker so slow uploads don't stall sampling
+        dispatcher_cfg = config.get('dispatcher', {})
+        self.dispatcher = sink_dispatcher.SinkDispatcher(logger,
+                                                         max_queue_size=dispatcher_cfg.get('queue_size', 1000),
+                                                         overflow_policy=dispatcher_cfg.get(
+                                                             'overflow_policy', sink_dispatcher.DROP_OLDEST),
+                                                         metrics=self.registry)
+        self.registry.add_collector(self.dispatcher.collect_metrics)
+
+        # Optional on-disk spool, buffered readings survive restarts and are replayed until written. Without it a
+        # shared columnar buffer is used, sinks keep a cursor into it instead of their own lists of dicts.
+        self.spool_cfg = config.get('spool')
+        self.buffer_cfg = config.get('buffer', {})
+        self.spools = []
+
+        # A sink writes once its batch reaches max_count readings or max_bytes, or its oldest reading is max_age
+        # seconds old
+        self.batching_cfg = config.get('batching', {})
+        self.batching_sinks = []
+        # Bytes every uplink sends, against its bytes_per_hour budget when it has one
+        self.traffic = {}
+        self.traffic_lock = threading.Lock()
+
+        # Every sink gets raw readings or, with an aggregation entry, windowed aggregates at its own resolution.
+        # A feed is (aggregator or None for raw readings, store or None, sink names). Stores exist from the start,
+        # so readings taken while a sink is still coming up are written once it is there.
+        self.aggregation_cfg = config.get('aggregation', {})
+        self.feeds = []
+        self.sink_stores = {}
+        # With a deadband entry, a sink only gets the fields that changed significantly, and every field at least
+        # once per heartbeat
+        self.deadband_cfg = config.get('deadband', {})
+        self.deadbands = []
+        # As a station of a gateway, readings are only streamed to the gateway, which writes InfluxDB and
+        # OpenSenseMap for the whole fleet
+        self.station_cfg = config.get('station')
+        upload_sinks = ('gateway',) if self.station_cfg else ('influxdb', 'opensensemap')
+        raw_sinks = tuple(name for name in upload_sinks
+                          if name not in self.aggregation_cfg and name not in self.deadband_cfg)
+        if raw_sinks:
+            raw_store = self.create_store('raw', reading_buffer.FIELDS)
+            self.feeds.append((None, raw_store, raw_sinks))
+            for name in raw_sinks:
+                self.sink_stores[name] = (raw_store, 100)
+        for name in upload_sinks:
+            if name not in raw_sinks:
+                aggregator, batch_size = None, 100
+                if name in self.aggregation_cfg:
+                    aggregator = self.create_aggregator(self.aggregation_cfg[name])
+                    batch_size = self.aggregation_cfg[name].get('batch_size', 10)
+                if name in self.deadband_cfg:
+                    aggregator = self.create_deadband(name, self.deadband_cfg[name], aggregator)
+                store = self.create_store(name, aggregator.output_fields())
+                self.feeds.append((aggregator, store, (name,)))
+                self.sink_stores[name] = (store, batch_size)
+
+        # Optional compressed local history of every reading, written on its own worker
+        local_store_cfg = config.get('local_store')
+        self.local_store = None
+        if local_store_cfg:
+            self.local_store = timeseries_store.TimeSeriesStore(local_store_cfg['path'],
+                                                                block_size=local_store_cfg.get('block_size', 900))
+            self.dispatcher.add_sink('local_store', self.local_store.append)
+            self.feeds.append((None, None, ('local_store',)))
+
+        # Optional local API serving the last readings and rolling aggregates, instead of querying InfluxDB
+        api_cfg = config.get('api', {})
+        self.recent = None
+        if api_cfg.get('enabled'):
+            self.recent = recent_readings.RecentReadings(tick=config.get('sampling', {}).get('tick', 2),
+                                                         recent=api_cfg.get('recent', 3600),
+                                                         history=api_cfg.get('history', 86400),
+                                                         history_step=api_cfg.get('history_step', 60))
+            self.dispatcher.add_sink('recent', self.recent.append)
+            self.feeds.append((None, None, ('recent',)))
+            api_server = recent_readings.RecentReadingsServer(self.recent, host=api_cfg.get('host', '127.0.0.1'),
+                                                              port=api_cfg.get('port', 9102)).start()
+            logger.info("Serving recent readings on port {}".format(api_server.port))
+
+        # Live dashboard, fed once the display is up
+        if config.get('display', {}).get('mode') == 'dashboard':
+            self.feeds.append((None, None, ('display',)))
+
+        # Only the latest reading matters for Luftdaten, averaged over its window when aggregated
+        self.luftdaten_aggregated = 'luftdaten' in self.aggregation_cfg
+        if self.luftdaten_aggregated:
+            self.feeds.append((self.create_aggregator(self.aggregation_cfg['luftdaten']), None, ('luftdaten',)))
+
+        # With an acquisition section, sampling runs in acquisition.py and readings are taken from its shared memory
+        # ring, so uploads and the display don't add jitter to sampling and can restart without stopping it
+        self.acquisition = 'acquisition' in config
+        self.acquisition_cfg = config.get('acquisition') or {}
+        self.reader = None
+        self.scheduler = None
+        if not self.acquisition:
+            # Enviroplus measures reader, its devices are attached as they come up and join the scheduler.
+            # Multi-rate sampling, every sensor is read at its own period and a snapshot is taken every tick.
+            self.reader = enviroplus_reader.EnviroPlusReader(logger, create_devices=False,
+                                                             cpu_temperature=self.devices.get('cpu_temperature'))
+            sampling_cfg = config.get('sampling', {})
+            self.scheduler = self.reader.scheduler(logger, tick=sampling_cfg.get('tick', 2),
+                                                   periods=sampling_cfg.get('periods'), metrics=self.registry)
+            self.registry.add_collector(self.scheduler.collect_metrics)
+        self.flush_timer = None
+
+    def check_wifi(self):
+        # Answered from the cached network state
+        return self.network.is_online()
+
+    def create_breaker(self, name):
+        breaker = circuit_breaker.CircuitBreaker(name, self.logger,
+                                                 failure_threshold=self.breaker_cfg.get('failure_threshold', 3),
+                                                 base_delay=self.breaker_cfg.get('base_delay', 5),
+                                                 max_delay=self.breaker_cfg.get('max_delay', 600))
+        self.breakers.append(breaker)
+        self.registry.add_collector(breaker.collect_metrics)
+        return breaker
+
+    def on_network_change(self, online):
+        if online:
+            for breaker in self.breakers:
+                breaker.reset(jitter=self.breaker_cfg.get('reconnect_jitter', 10))
+
+    def create_store(self, name, fields):
+        if self.spool_cfg:
+            path = self.spool_cfg['path'] if name == 'raw' else '{}-{}'.format(self.spool_cfg['path'], name)
+            spool = reading_spool.ReadingSpool(path, segment_size=self.spool_cfg.get('segment_size', 4 * 1024 * 1024),
+                                               fsync_interval=self.spool_cfg.get('fsync_interval', 30))
+            self.spools.append(spool)
+            return spool
+        readings = reading_buffer.ReadingBuffer(self.buffer_cfg.get('capacity', 10000), fields)
+        self.logger.info("Reading buffer {} memory: {}".format(name, readings.memory_footprint()))
+        return readings
+
+    def traffic_for(self, name, request_overhead=None):
+        with self.traffic_lock:
+            traffic = self.traffic.get(name)
+            if traffic is None:
+                overhead = request_overhead or self.config.get('http', {}).get('request_overhead',
+                                                                               uplink.HTTP_REQUEST_OVERHEAD)
+                traffic = self.traffic[name] = uplink.UplinkTraffic(
+                    name, request_overhead=overhead,
+                    bytes_per_hour=self.batching_cfg.get(name, {}).get('bytes_per_hour'))
+                self.registry.add_collector(traffic.collect_metrics)
+            return traffic
+
+    # With a bytes_per_hour budget or adaptive set, flushes are sized from the measured uplink cost and max_count
+    # only caps them
+    def create_flush_policy(self, name, max_count):
+        cfg = self.batching_cfg.get(name, {})
+        if cfg.get('bytes_per_hour') or cfg.get('adaptive'):
+            return batching_sink.AdaptiveFlushPolicy(self.traffic_for(name), bytes_per_hour=cfg.get('bytes_per_hour'),
+                                                     min_count=cfg.get('min_count', 1),
+                                                     max_count=cfg.get('max_count', 5000),
+                                                     max_bytes=cfg.get('max_bytes'), max_age=cfg.get('max_age', 900),
+                                                     max_busy=cfg.get('max_busy', 0.05),
+                                                     max_overhead=cfg.get('max_overhead', 0.1), initial_count=max_count)
+        return batching_sink.FlushPolicy(max_count=cfg.get('max_count', max_count), max_bytes=cfg.get('max_bytes'),
+                                         max_age=cfg.get('max_age', 60))
+
+    # Batching sink for a client that just came up, starting at the oldest reading still in its store
+    def add_batching_sink(self, name, write):
+        store, max_count = self.sink_stores[name]
+        breaker = self.create_breaker(name)
+        policy = self.create_flush_policy(name, max_count)
+        if self.spool_cfg:
+            sink = reading_spool.SpooledSink(store.consumer(name), write, self.logger, policy=policy, breaker=breaker,
+                                             network=self.network)
+        else:
+            sink = reading_buffer.BufferedBlockSink(name, store, write, self.logger, policy=policy, breaker=breaker,
+                                                    network=self.network, cursor=store.oldest())
+        self.registry.add_collector(sink.collect_metrics)
+        self.batching_sinks.append(sink)
+        self.dispatcher.add_sink(name, sink.send)
+
+    def create_aggregator(self, cfg):
+        return aggregation.WindowAggregator(cfg['window'], cfg.get('step'),
+                                            quantiles=cfg.get('quantiles', (0.5, 0.9)))
+
+    def create_deadband(self, name, cfg, source):
+        deadbands = {field: deadband.Deadband(absolute=field_cfg.get('absolute', 0.0),
+                                              relative=field_cfg.get('relative', 0.0),
+                                              heartbeat=field_cfg.get('heartbeat'))
+                     for field, field_cfg in cfg.get('fields', {}).items()}
+        deadband_filter = deadband.DeadbandFilter(name, deadbands, heartbeat=cfg.get('heartbeat', 300), source=source)
+        self.deadbands.append(deadband_filter)
+        self.registry.add_collector(deadband_filter.collect_metrics)
+        return deadband_filter
+
+    def create_influxdb(self):
+        import influxdb_local_weather_client
+        import line_protocol
+
+        influxdb_cfg = self.config['influxdb']
+        return influxdb_local_weather_client.InfluxDbWeather(
+            influxdb_cfg['host'], influxdb_cfg['port'], influxdb_cfg['database'],
+            influxdb_cfg['username'], influxdb_cfg['password'], self.logger,
+            encoder=line_protocol.LineProtocolEncoder(influxdb_cfg.get('schema', line_protocol.DEFAULT_SCHEMA)),
+            session=self.session, metrics=self.registry, compression=influxdb_cfg.get('compression', uplink.GZIP),
+            traffic=self.traffic_for('influxdb'))
+
+    def on_influxdb(self, influxdb_weather):
+        self.influxdb_weather = influxdb_weather
+        self.add_batching_sink('influxdb', influxdb_weather.write_values)
+        # Periodic luftdaten_internal snapshot of the metrics
+        if self.metrics_interval:
+            self.dispatcher.add_sink('metrics', self.write_metrics, max_queue_size=1)
+
+    def create_opensensemap(self):
+        import opensensemap_client
+
+        opensensemap_cfg = self.config['opensensemap']
+        return opensensemap_client.OpenSenseMapClient(opensensemap_cfg['sensebox_id'],
+                                                      opensensemap_cfg['temperature_sensor_id'],
+                                                      opensensemap_cfg['humidity_sensor_id'],
+                                                      opensensemap_cfg['pressure_sensor_id'],
+                                                      opensensemap_cfg['pm_1_0_sensor_id'],
+                                                      opensensemap_cfg['pm_2_5_sensor_id'],
+                                                      opensensemap_cfg['pm_10_sensor_id'], self.logger,
+                                                      session=self.session, metrics=self.registry,
+                                                      url=opensensemap_cfg.get(
+                                                          'url', opensensemap_client.OPENSENSEMAP_URL),
+                                                      upload_format=opensensemap_cfg.get(
+                                                          'upload_format', opensensemap_client.JSON),
+                                                      max_measurements=opensensemap_cfg.get(
+                                                          'max_measurements', opensensemap_client.MAX_MEASUREMENTS),
+                                                      compression=opensensemap_cfg.get('compression'),
+                                                      traffic=self.traffic_for('opensensemap'))
 
+    def on_opensensemap(self, opensensemap_client):
+        self.add_batching_sink('opensensemap', opensensemap_client.write_values)
+
+    def create_station_client(self):
+        import station_client
+
+        transport = self.station_cfg.get('transport', station_client.UDP)
+        return station_client.StationClient(self.id, self.station_cfg['gateway'], self.logger, transport=transport,
+                                            port=self.station_cfg.get('port'), session=self.session,
+                                            traffic=self.traffic_for('gateway', uplink.UDP_DATAGRAM_OVERHEAD
+                                                                     if transport == station_client.UDP else None))
+
+    def on_station_client(self, client):
+        self.add_batching_sink('gateway', client.write_values)
+
+    def create_luftdaten(self):
+        import luftdaten_client
+        luftdaten_cfg = self.config.get('luftdaten', {})
+        return luftdaten_client.LuftdatenClient(self.id, self.session,
+                                                url=luftdaten_cfg.get('url', luftdaten_client.LUFTDATEN_URL),
+                                                compression=luftdaten_cfg.get('compression'),
+                                                traffic=self.traffic_for('luftdaten'))
+
+    def on_luftdaten(self, client):
+        self.luftdaten_client = client
+        self.dispatcher.add_sink('luftdaten', self.send_to_luftdaten, max_queue_size=1)
+
+    def on_lcd(self, lcd):
+        self.enviroplus_lcd = lcd
+        lcd.display_status('connected' if self.check_wifi() else 'disconnected', 'waiting')
+        # Live dashboard, rendered on its own worker so the LCD never delays sampling
+        if lcd.mode == 'dashboard':
+            self.dispatcher.add_sink('display', lcd.display_dashboard, max_queue_size=1)
+
+    def on_session(self, session):
+        self.session = session
+
+    def device_factory(self, name):
+        if name in self.devices:
+            return lambda: self.devices[name]
+        return enviroplus_reader.DEVICE_FACTORIES[name]
+
+    def attach_device(self, name):
+        return lambda device: self.reader.attach(name, device)
+
+    # Send to Luftdaten and show the result on the LCD
+    def send_to_luftdaten(self, values):
+        wifi_status = 'connected' if self.check_wifi() else 'disconnected'
+        if wifi_status != 'connected' or not self.luftdaten_breaker.allow():
+            response = 'skipped'
+        else:
+            try:
+                resp = self.luftdaten_client.send_to_luftdaten(values)
+            except Exception:
+                self.luftdaten_breaker.record_failure()
+                raise
+            # Nothing to send, the sensors are not up yet
+            if resp is None:
+                response = 'skipped'
+            elif resp:
+                self.luftdaten_breaker.record_success()
+                response = 'ok'
+            else:
+                self.luftdaten_breaker.record_failure()
+                response = 'failed'
+        self.logger.info("Response: {}".format(response))
+        if self.enviroplus_lcd:
+            self.enviroplus_lcd.display_status(wifi_status, response)
+
+    # Skipped while offline
+    def write_metrics(self, _values):
+        if self.check_wifi():
+            self.influxdb_weather.write_lines(self.registry.influxdb_lines(tags={'sensor': self.id}))
+
+    def start(self):
+        # Display Raspberry Pi serial and Wi-Fi status
+        self.logger.info("Raspberry Pi serial: {}".format(self.serial_number))
+        self.logger.info("Wi-Fi: {}\n".format('connected' if self.check_wifi() else 'disconnected'))
+
+        # Every other component comes up in parallel while the BME280 is initialised here
+        if self.reader:
+            for name in ('pms5003', 'gas', 'ltr559'):
+                self.init.submit(name, self.device_factory(name), self.attach_device(name))
+        self.init.submit('http', lambda: create_session(self.config.get('http', {}), self.registry),
+                         self.on_session)
+        if self.station_cfg:
+            self.init.submit('gateway', self.create_station_client, self.on_station_client, after='http')
+        else:
+            self.init.submit('influxdb', self.create_influxdb, self.on_influxdb, after='http')
+            self.init.submit('opensensemap', self.create_opensensemap, self.on_opensensemap, after='http')
+        self.init.submit('luftdaten', self.create_luftdaten, self.on_luftdaten, after='http')
+        self.init.submit('display', lambda: create_lcd(self.config.get('display', {}), self.registry,
+                                                       disp=self.devices.get('st7735')), self.on_lcd)
+        if self.reader:
+            with self.timer.phase('bme280'):
+                self.reader.attach('bme280', self.device_factory('bme280')())
+
+        self.dispatcher.start()
+        # Age limits are checked on the sinks' own workers, also while sampling is stalled
+        self.flush_timer = batching_sink.FlushTimer(
+            lambda: self.dispatcher.dispatch(batching_sink.FLUSH_TICK, [sink.name for sink in self.batching_sinks]),
+            self.logger, interval=self.batching_cfg.get('flush_interval', 1)).start()
+        self.init.report_when_done()
+
+    def readings(self):
+        if self.scheduler:
+            return self.scheduler.run()
+        import shared_ring
+        return shared_ring.follow(self.logger, name=self.acquisition_cfg.get('name', shared_ring.DEFAULT_NAME),
+                                  replay=self.acquisition_cfg.get('replay', 0))
+
+    def run(self):
+        update_time = time.time()
+        metrics_time = time.monotonic()
+        first_sample = True
+
+        # Main loop to read data and hand it over to the sinks
+        for values in self.readings():
+            try:
+                if first_sample:
+                    self.logger.info("First sample {:.3f}s after start".format(self.timer.milestone('first sample')))
+                    first_sample = False
+                time_since_update = time.time() - update_time
+                if self.readings_log:
+                    self.readings_log.info(values)
+
+                # Store and send measures, or the windows they closed, to influxDb, OpenSenseMap and Luftdaten
+                for aggregator, store, names in self.feeds:
+                    for record in ([values] if aggregator is None else aggregator.add(values)):
+                        if store is not None:
+                            store.append(record)
+                        self.dispatcher.dispatch(record, names)
+                if self.metrics_interval and time.monotonic() - metrics_time >= self.metrics_interval:
+                    self.dispatcher.dispatch(None, ('metrics',))
+                    metrics_time = time.monotonic()
+                if time_since_update > 120:
+                    # Send to Luftdaten
+                    if not self.luftdaten_aggregated:
+                        self.dispatcher.dispatch(values, ('luftdaten',))
+                    update_time = time.time()
+                    self.logger.info("Sink queue depths: {}, dropped: {}".format(self.dispatcher.queue_depths(),
+                                                                                 self.dispatcher.dropped_counts()))
+                    if self.session is not None:
+                        import http_session
+                        self.logger.info("HTTP connections: {}".format(http_session.connection_stats(self.session)))
+                    if self.scheduler:
+                        self.logger.info("Sampling: {}".format(self.scheduler.stats()))
+                    if self.traffic:
+                        self.logger.info("Uplink: {}".format({name: traffic.stats()
+                                                              for name, traffic in list(self.traffic.items())}))
+                    for deadband_filter in self.deadbands:
+                        self.logger.info("Deadband {}: {}".format(deadband_filter.name, deadband_filter.stats()))
+
+            except Exception as e:
+                self.logger.exception(e)
+
+    def stop(self):
+        if self.flush_timer:
+            self.flush_timer.stop()
+        self.dispatcher.stop(timeout=10)
+        # The workers are stopped, write what every sink still holds
+        for sink in self.batching_sinks:
+            sink.close()
+        for spool in self.spools:
+            spool.close()
+        if self.local_store:
+            self.local_store.close()
+        if self.enviroplus_lcd:
+            self.enviroplus_lcd.turnoff()
+
+
+def main():
+    timer = startup.StartupTimer()
+    config = yaml.safe_load(open("config.yml"))
+    print(BANNER)
+
+    logger = log_setup.get_logger('/var/log/luftdaten.log', max_bytes=config.get('logging', {}).get(
+        'buffer_bytes', log_setup.DEFAULT_BUFFER_BYTES))
+    collector = Collector(config, logger, timer)
+    collector.start()
+    try:
+        collector.run()
     except KeyboardInterrupt:
-        enviroplus_lcd.turnoff()
+        collector.stop()
         raise
-    except Exception as e:
-        logger.exception(e)
+
+
+if __name__ == '__main__':
+    main()
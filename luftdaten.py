@@ -1,23 +1,18 @@
 #!/usr/bin/env python
 
-import datetime
 import logging
 import time
-from logging.handlers import MemoryHandler, TimedRotatingFileHandler
-from subprocess import PIPE, Popen, check_output
+from subprocess import PIPE, Popen
 
-import ST7735
-import requests
-from PIL import Image, ImageDraw, ImageFont
-from bme280 import BME280
-from pms5003 import PMS5003, ReadTimeoutError
+import enviroplus_reader
+import log_setup
+import network_monitor
+import startup
+from pms5003_stream import PMS5003Stream, StaleFrameError
 
-try:
-    from smbus2 import SMBus
-except ImportError:
-    from smbus import SMBus
+# requests, PIL and the display driver are imported on the init threads, so sampling starts before they are loaded
 
-print("""luftdaten.py - Reads temperature, pressure, humidity,
+BANNER = """luftdaten.py - Reads temperature, pressure, humidity,
 PM2.5, and PM10 from Enviro plus and sends data to Luftdaten,
 the citizen science air quality project.
 
@@ -29,64 +24,10 @@ Luftdaten map.
 
 Press Ctrl+C to exit!
 
-""")
-
-bus = SMBus(1)
-
-# Create BME280 (temp, humidity and pressure sensor) instance
-bme280 = BME280(i2c_dev=bus)
-
-# Create LCD instance
-disp = ST7735.ST7735(
-    port=0,
-    cs=ST7735.BG_SPI_CS_FRONT,
-    dc=9,
-    backlight=12,
-    rotation=270,
-    spi_speed_hz=10000000
-)
-
-# Initialize display
-disp.begin()
-
-# Create PMS5003 (air quality sensor) instance
-pms5003 = PMS5003()
-
-
-# Create logger
-def get_logger(path):
-    rotating_handler = TimedRotatingFileHandler(path, when='d', backupCount=7)
-    formatter = logging.Formatter('%(asctime)s [%(levelname)s] %(message)s')
-    rotating_handler.setFormatter(formatter)
-    memory_handler = MemoryHandler(capacity=512 * 1024, target=rotating_handler)
-    console_handler = logging.StreamHandler()
-    console_handler.setFormatter(formatter)
-    logger = logging.getLogger("luftdaten")
-    logger.setLevel(logging.DEBUG)
-    logger.addHandler(memory_handler)
-    logger.addHandler(console_handler)
-    return logger
-
-
-# Read values from BME280 and PMS5003 and return as dict
-def read_values():
-    values = {}
-    cpu_temp = get_cpu_temperature()
-    raw_temp = bme280.get_temperature()
-    comp_temp = raw_temp - ((cpu_temp - raw_temp) / comp_factor)
-    values["temperature"] = "{:.2f}".format(comp_temp)
-    values["pressure"] = "{:.2f}".format(bme280.get_pressure() * 100)
-    values["humidity"] = "{:.2f}".format(bme280.get_humidity())
-    try:
-        pm_values = pms5003.read()
-        values["P2"] = str(pm_values.pm_ug_per_m3(2.5))
-        values["P1"] = str(pm_values.pm_ug_per_m3(10))
-    except ReadTimeoutError:
-        pms5003.reset()
-        pm_values = pms5003.read()
-        values["P2"] = str(pm_values.pm_ug_per_m3(2.5))
-        values["P1"] = str(pm_values.pm_ug_per_m3(10))
-    return values
+"""
+
+# Compensation factor for temperature
+comp_factor = 1.2
 
 
 # Get CPU temperature to use for compensation
@@ -104,64 +45,53 @@ def get_serial_number():
                 return line.split(":")[1].strip()
 
 
-# Check for Wi-Fi connection
-def check_wifi():
-    if check_output(['hostname', '-I']):
-        return True
-    else:
-        return False
+def create_lcd():
+    from PIL import ImageFont
 
+    import enviroplus_lcd
 
-# Display Last request date, last request status and Wi-Fi status on LCD
-def display_status(status=''):
-    wifi_status = "connected" if check_wifi() else "disconnected"
-    text_colour = (255, 255, 255)
-    ok_back_colour = (0, 0, 0)  # Black
-    error_back_colour = (85, 15, 15)  # Red
-    back_colour = ok_back_colour if check_wifi() else error_back_colour
-    message = "{:%Y-%m-%d %H:%M:%S}\nLast update: {}\nWi-Fi: {}".format(datetime.datetime.now(), status, wifi_status)
-    img = Image.new('RGB', (WIDTH, HEIGHT), color=(0, 0, 0))
-    draw = ImageDraw.Draw(img)
-    size_x, size_y = draw.textsize(message, font)
-    x = (WIDTH - size_x) / 2
-    y = (HEIGHT / 2) - (size_y / 2)
-    draw.rectangle((0, 0, 160, 80), back_colour)
-    draw.text((x, y), message, font=font, fill=text_colour)
-    disp.display(img)
-
-
-def send_to_luftdaten(values, id):
-    logger.debug('Sending info to luftdaten')
+    # Text settings
+    font_size = 16
+    font = ImageFont.truetype("fonts/Asap/Asap-Bold.ttf", font_size)
+    return enviroplus_lcd.EnviroplusLCD(font)
+
+
+def create_session():
+    import requests
+    return requests.Session()
+
+
+def send_to_luftdaten(session, values, id):
     pm_values = dict(i for i in values.items() if i[0].startswith("P"))
     temp_values = dict(i for i in values.items() if not i[0].startswith("P"))
 
-    resp_1 = requests.post("https://api.luftdaten.info/v1/push-sensor-data/",
-                           json={
-                               "software_version": "enviro-plus 0.0.1",
-                               "sensordatavalues": [{"value_type": key, "value": val} for
-                                                    key, val in pm_values.items()]
-                           },
-                           headers={
-                               "X-PIN": "1",
-                               "X-Sensor": id,
-                               "Content-Type": "application/json",
-                               "cache-control": "no-cache"
-                           }
-                           )
-
-    resp_2 = requests.post("https://api.luftdaten.info/v1/push-sensor-data/",
-                           json={
-                               "software_version": "enviro-plus 0.0.1",
-                               "sensordatavalues": [{"value_type": key, "value": val} for
-                                                    key, val in temp_values.items()]
-                           },
-                           headers={
-                               "X-PIN": "11",
-                               "X-Sensor": id,
-                               "Content-Type": "application/json",
-                               "cache-control": "no-cache"
-                           }
-                           )
+    resp_1 = session.post("https://api.luftdaten.info/v1/push-sensor-data/",
+                          json={
+                              "software_version": "enviro-plus 0.0.1",
+                              "sensordatavalues": [{"value_type": key, "value": val} for
+                                                   key, val in pm_values.items()]
+                          },
+                          headers={
+                              "X-PIN": "1",
+                              "X-Sensor": id,
+                              "Content-Type": "application/json",
+                              "cache-control": "no-cache"
+                          }
+                          )
+
+    resp_2 = session.post("https://api.luftdaten.info/v1/push-sensor-data/",
+                          json={
+                              "software_version": "enviro-plus 0.0.1",
+                              "sensordatavalues": [{"value_type": key, "value": val} for
+                                                   key, val in temp_values.items()]
+                          },
+                          headers={
+                              "X-PIN": "11",
+                              "X-Sensor": id,
+                              "Content-Type": "application/json",
+                              "cache-control": "no-cache"
+                          }
+                          )
 
     if resp_1.ok and resp_2.ok:
         return True
@@ -169,46 +99,118 @@ def send_to_luftdaten(values, id):
         return False
 
 
-# Compensation factor for temperature
-comp_factor = 1.2
-
-# Raspberry Pi ID to send to Luftdaten
-id = "raspi-" + get_serial_number()
-
-# Logger
-logger = get_logger('/var/log/luftdaten.log')
-
-# Width and height to calculate text position
-WIDTH = disp.width
-HEIGHT = disp.height
-
-# Text settings
-font_size = 16
-font = ImageFont.truetype("fonts/Asap/Asap-Bold.ttf", font_size)
-
-# Display Raspberry Pi serial and Wi-Fi status
-logger.info("Raspberry Pi serial: {}".format(get_serial_number()))
-logger.info("Wi-Fi: {}\n".format("connected" if check_wifi() else "disconnected"))
-
-time_since_update = 0
-update_time = time.time()
-
-display_status('waiting')
-
-# Main loop to read data, display, and send to Luftdaten
-while True:
-    try:
-        time_since_update = time.time() - update_time
-        values = read_values()
-        logger.debug(values)
-        if time_since_update > 145:
-            resp = send_to_luftdaten(values, id)
-            response = "ok" if resp else "failed"
-            update_time = time.time()
-            logger.info("Response: {}".format(response))
-            display_status(response)
-    except KeyboardInterrupt:
-        disp.set_backlight(0)
-        raise
-    except Exception as e:
-        logger.exception(e)
+# Reads the BME280 from the start, the PMS5003, the display and the HTTP session join once their init thread is done
+class LuftdatenCollector:
+    def __init__(self, logger: logging.Logger, timer: startup.StartupTimer,
+                 readings_log: logging.Logger = None) -> None:
+        self.logger = logger
+        self.readings_log = readings_log
+        self.timer = timer
+        self.init = startup.ParallelInit(logger, timer)
+        # Raspberry Pi ID to send to Luftdaten
+        self.serial_number = get_serial_number()
+        self.id = "raspi-" + self.serial_number
+        # Network state, watched in the background instead of forking hostname for every check
+        self.network = network_monitor.NetworkMonitor(logger)
+        self.bme280 = None
+        self.pms_stream = None
+        self.pm_frames = 0
+        self.lcd = None
+        self.session = None
+
+    # Check for Wi-Fi connection, answered from the cached network state
+    def check_wifi(self):
+        return self.network.is_online()
+
+    # Display Last request date, last request status and Wi-Fi status on LCD
+    def display_status(self, status=''):
+        if self.lcd is None:
+            return
+        wifi_status = "connected" if self.check_wifi() else "disconnected"
+        self.lcd.display_status(wifi_status, status)
+
+    def on_pms5003(self, pms5003):
+        # Read PMS5003 frames in the background
+        self.pms_stream = PMS5003Stream(pms5003, self.logger)
+
+    def on_lcd(self, lcd):
+        self.lcd = lcd
+        self.display_status('waiting')
+
+    def on_session(self, session):
+        self.session = session
+
+    # Read values from BME280 and PMS5003 and return as dict, without particles while the PMS5003 is starting
+    def read_values(self):
+        values = {}
+        cpu_temp = get_cpu_temperature()
+        raw_temp = self.bme280.get_temperature()
+        comp_temp = raw_temp - ((cpu_temp - raw_temp) / comp_factor)
+        values["temperature"] = "{:.2f}".format(comp_temp)
+        values["pressure"] = "{:.2f}".format(self.bme280.get_pressure() * 100)
+        values["humidity"] = "{:.2f}".format(self.bme280.get_humidity())
+        if self.pms_stream is None:
+            time.sleep(1)
+            return values
+        # Paced by the sensor frames, which are read on the stream thread
+        try:
+            pm_values, self.pm_frames = self.pms_stream.wait_next(self.pm_frames, timeout=10)
+        except StaleFrameError as e:
+            self.logger.warning(e)
+            return values
+        values["P2"] = str(pm_values.pm_ug_per_m3(2.5))
+        values["P1"] = str(pm_values.pm_ug_per_m3(10))
+        return values
+
+    def start(self):
+        # Display Raspberry Pi serial and Wi-Fi status
+        self.logger.info("Raspberry Pi serial: {}".format(self.serial_number))
+        self.logger.info("Wi-Fi: {}\n".format("connected" if self.check_wifi() else "disconnected"))
+        self.init.submit('pms5003', enviroplus_reader.create_pms5003, self.on_pms5003)
+        self.init.submit('display', create_lcd, self.on_lcd)
+        self.init.submit('http', create_session, self.on_session)
+        # Create BME280 (temp, humidity and pressure sensor) instance
+        with self.timer.phase('bme280'):
+            self.bme280 = enviroplus_reader.create_bme280()
+        self.init.report_when_done()
+
+    def run(self):
+        update_time = time.time()
+        first_sample = True
+        # Main loop to read data, display, and send to Luftdaten
+        while True:
+            try:
+                time_since_update = time.time() - update_time
+                values = self.read_values()
+                if first_sample:
+                    self.logger.info("First sample {:.3f}s after start".format(self.timer.milestone('first sample')))
+                    first_sample = False
+                if self.readings_log:
+                    self.readings_log.info(values)
+                # Both pushes need the particles, until the PMS5003 is up the next reading is tried
+                if time_since_update > 145 and "P2" in values and self.session is not None:
+                    self.logger.debug('Sending info to luftdaten')
+                    resp = send_to_luftdaten(self.session, values, self.id)
+                    response = "ok" if resp else "failed"
+                    update_time = time.time()
+                    self.logger.info("Response: {}".format(response))
+                    self.display_status(response)
+            except KeyboardInterrupt:
+                if self.lcd:
+                    self.lcd.turnoff()
+                raise
+            except Exception as e:
+                self.logger.exception(e)
+
+
+def main():
+    timer = startup.StartupTimer()
+    print(BANNER)
+    logger = log_setup.get_logger('/var/log/luftdaten.log')
+    collector = LuftdatenCollector(logger, timer, log_setup.get_readings_logger(log_setup.READINGS_LOG))
+    collector.start()
+    collector.run()
+
+
+if __name__ == '__main__':
+    main()
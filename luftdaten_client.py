@@ -1,45 +1,71 @@
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
 import requests
 
+from uplink import UplinkTraffic, check_encoding, compress
+
+LUFTDATEN_URL = "https://api.luftdaten.info/v1/push-sensor-data/"
+
 
 class LuftdatenClient:
-    def __init__(self, sensor_id: str) -> None:
+    def __init__(self, sensor_id: str, session: requests.Session = None, url: str = LUFTDATEN_URL,
+                 compression: str = None, traffic: UplinkTraffic = None) -> None:
         self.sensor_id = sensor_id
+        self.url = url
+        self.session = session or requests.Session()
+        self.compression = check_encoding(compression)
+        self.traffic = traffic or UplinkTraffic('luftdaten')
+        # Both X-PIN pushes are sent at the same time over pooled keep-alive connections
+        self.executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='luftdaten')
+
+    # Both pushes carry the same reading, it is counted with the first one
+    def post(self, pin, data, readings=0):
+        payload = json.dumps(data).encode()
+        body = compress(payload, self.compression)
+        headers = {
+            "X-PIN": pin,
+            "X-Sensor": self.sensor_id,
+            "Content-Type": "application/json",
+            "cache-control": "no-cache"
+        }
+        if self.compression:
+            headers["Content-Encoding"] = self.compression
+        start = time.perf_counter()
+        resp = None
+        try:
+            resp = self.session.post(self.url, data=body, headers=headers)
+        finally:
+            self.traffic.record(readings, len(payload), len(body), time.perf_counter() - start,
+                                ok=resp is not None and resp.ok)
+        return resp
+
+    # Fields missing from the reading, or NaN while their sensor is not up, are left out
+    @staticmethod
+    def sensor_values(values, value_types):
+        return [{'value_type': value_type, 'value': str(values[field])} for value_type, field in value_types
+                if values.get(field) is not None and values[field] == values[field]]
+
+    # A push without any value is not sent, None when neither was
+    def send_to_luftdaten(self, values) -> Optional[bool]:
+        pushes = []
+        particles = self.sensor_values(values, (('P1', 'P10'), ('P2', 'P2.5')))
+        if particles:
+            pushes.append(self.executor.submit(self.post, "1", {
+                "software_version": "enviro-plus 0.0.1",
+                "sensordatavalues": particles
+            }, 1))
+
+        weather = self.sensor_values(values, (('temperature', 'temperature'), ('humidity', 'humidity'),
+                                              ('pressure', 'pressure')))
+        if weather:
+            pushes.append(self.executor.submit(self.post, "11", {
+                'software_version': '"enviro-plus 0.0.1',
+                'sensordatavalues': weather
+            }, 0 if particles else 1))
 
-    def send_to_luftdaten(self, values) -> bool:
-        resp_1 = requests.post("https://api.luftdaten.info/v1/push-sensor-data/",
-                               json={
-                                   "software_version": "enviro-plus 0.0.1",
-                                   "sensordatavalues": [
-                                       {'value_type': 'P1', 'value': str(values['P10'])},
-                                       {'value_type': 'P2', 'value': str(values['P2.5'])}
-                                   ]
-                               },
-                               headers={
-                                   "X-PIN": "1",
-                                   "X-Sensor": self.sensor_id,
-                                   "Content-Type": "application/json",
-                                   "cache-control": "no-cache"
-                               }
-                               )
-
-        resp_2 = requests.post("https://api.luftdaten.info/v1/push-sensor-data/",
-                               json={
-                                   'software_version': '"enviro-plus 0.0.1',
-                                   'sensordatavalues': [
-                                       {'value_type': 'temperature', 'value': str(values['temperature'])},
-                                       {'value_type': 'humidity', 'value': str(values['humidity'])},
-                                       {'value_type': 'pressure', 'value': str(values['pressure'])}
-                                   ]
-                               },
-                               headers={
-                                   "X-PIN": "11",
-                                   "X-Sensor": self.sensor_id,
-                                   "Content-Type": "application/json",
-                                   "cache-control": "no-cache"
-                               }
-                               )
-
-        if resp_1.ok and resp_2.ok:
-            return True
-        else:
-            return False
+        if not pushes:
+            return None
+        return all([push.result().ok for push in pushes])
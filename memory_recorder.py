@@ -0,0 +1,142 @@
+import os
+import signal
+import threading
+import time
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager
+from logging import Logger
+from typing import List, Optional, Tuple
+
+# Allocations of the recorder itself and of imports are left out of the snapshots
+SNAPSHOT_FILTERS = (tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, '<frozen importlib*'),
+                    tracemalloc.Filter(False, '<unknown>'))
+
+
+# Resident set size of this process in bytes
+def rss_bytes() -> Optional[int]:
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+# Least squares slope of y over x
+def slope(points: List[Tuple[float, float]]) -> float:
+    if len(points) < 2:
+        return 0.0
+    mean_x = sum(x for x, _y in points) / len(points)
+    mean_y = sum(y for _x, y in points) / len(points)
+    variance = sum((x - mean_x) ** 2 for x, _y in points)
+    if not variance:
+        return 0.0
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / variance
+
+
+# Traced Python allocations and RSS sampled over hours of (possibly simulated) run time. Growth rates are fitted over
+# the samples taken after the baseline, once buffers and caches are warm. Like a flight recorder, the last samples
+# and the allocation sites that grew most since the baseline are dumped on demand or on signal. The RSS taking a
+# snapshot leaves behind is not returned by the allocator, it is subtracted from the samples so growth is the
+# collector's own.
+class MemoryRecorder:
+    def __init__(self, logger: Logger, frames: int = 5, top: int = 25, history: int = 1000,
+                 dump_path: str = None) -> None:
+        self.logger = logger
+        self.top = top
+        self.dump_path = dump_path
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+        # (hours, traced bytes, RSS bytes)
+        self.samples = deque(maxlen=history)
+        self.baseline = None
+        self.baseline_hours = 0.0
+        self.snapshot_rss = 0
+        self.lock = threading.Lock()
+        self.dump_requested = threading.Event()
+
+    def sample(self, hours: float) -> Tuple[float, int, Optional[int]]:
+        traced, _peak = tracemalloc.get_traced_memory()
+        rss = rss_bytes()
+        with self.lock:
+            sample = (hours, traced, None if rss is None else rss - self.snapshot_rss)
+            self.samples.append(sample)
+        return sample
+
+    def snapshot(self) -> tracemalloc.Snapshot:
+        return tracemalloc.take_snapshot().filter_traces(SNAPSHOT_FILTERS)
+
+    @contextmanager
+    def _snapshot_overhead(self):
+        before = rss_bytes()
+        try:
+            yield
+        finally:
+            after = rss_bytes()
+            if before is not None and after is not None:
+                with self.lock:
+                    self.snapshot_rss += max(0, after - before)
+
+    # Growth is measured from here on
+    def mark_baseline(self, hours: float):
+        with self._snapshot_overhead():
+            self.baseline = self.snapshot()
+        self.baseline_hours = hours
+
+    # Bytes per hour fitted over the samples since the baseline, for traced allocations and RSS
+    def growth_per_hour(self) -> Tuple[float, float]:
+        with self.lock:
+            samples = [sample for sample in self.samples if sample[0] >= self.baseline_hours]
+        return (slope([(hours, traced) for hours, traced, _rss in samples]),
+                slope([(hours, rss) for hours, _traced, rss in samples if rss is not None]))
+
+    # Allocation sites that grew most since the baseline, or the largest ones without a baseline
+    def top_sites(self, limit: int = None, key_type: str = 'lineno') -> List[str]:
+        snapshot = self.snapshot()
+        if self.baseline is not None:
+            stats = snapshot.compare_to(self.baseline, key_type)
+            lines = ['{:+.1f} KiB ({:+d} blocks) -> {:.1f} KiB  {}'.format(
+                stat.size_diff / 1024, stat.count_diff, stat.size / 1024, stat.traceback) for stat in stats]
+        else:
+            lines = ['{:.1f} KiB ({} blocks)  {}'.format(stat.size / 1024, stat.count, stat.traceback)
+                     for stat in snapshot.statistics(key_type)]
+        return lines[:limit or self.top]
+
+    def report(self) -> str:
+        with self.lock:
+            samples = list(self.samples)[-10:]
+        traced_growth, rss_growth = self.growth_per_hour()
+        lines = ['Memory at {}'.format(time.strftime('%Y-%m-%d %H:%M:%S')),
+                 'Growth since hour {:.1f}: traced {:+.1f} KiB/h, RSS {:+.1f} KiB/h'.format(
+                     self.baseline_hours, traced_growth / 1024, rss_growth / 1024),
+                 'Last samples (hours, traced KiB, RSS KiB without {:.0f} KiB of snapshots):'.format(
+                     self.snapshot_rss / 1024)]
+        lines += ['  {:.2f} {:.0f} {}'.format(hours, traced / 1024, '-' if rss is None else '{:.0f}'.format(rss / 1024))
+                  for hours, traced, rss in samples]
+        lines.append('Top allocation sites{}:'.format(' since the baseline' if self.baseline is not None else ''))
+        lines += ['  ' + line for line in self.top_sites()]
+        return '\n'.join(lines)
+
+    def dump(self):
+        with self._snapshot_overhead():
+            report = self.report()
+        self.logger.info(report)
+        if self.dump_path:
+            with open(self.dump_path, 'a') as f:
+                f.write(report + '\n\n')
+
+    # kill -USR1 <pid> dumps the report. The snapshot is taken on a thread of its own, not in the signal handler,
+    # which may have interrupted the main thread while it held the logging locks.
+    def install_signal(self, signum: int = signal.SIGUSR1) -> 'MemoryRecorder':
+        signal.signal(signum, lambda _signum, _frame: self.dump_requested.set())
+        threading.Thread(target=self._dump_on_request, name='memory-dump', daemon=True).start()
+        return self
+
+    def _dump_on_request(self):
+        while True:
+            self.dump_requested.wait()
+            self.dump_requested.clear()
+            try:
+                self.dump()
+            except Exception as e:
+                self.logger.warning("Memory dump failed: {}".format(e))
@@ -0,0 +1,236 @@
+import bisect
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Iterable, Optional, Tuple
+
+from line_protocol import escape_key, escape_measurement
+
+HISTOGRAM = 'histogram'
+COUNTER = 'counter'
+GAUGE = 'gauge'
+
+# Upper bounds in seconds, from a fast I2C read to a hanging upload
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+INTERNAL_MEASUREMENT = 'luftdaten_internal'
+
+
+class _Timer:
+    __slots__ = ('histogram', 'start')
+
+    def __init__(self, histogram) -> None:
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+class Histogram:
+    kind = HISTOGRAM
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+            if value > self.max:
+                self.max = value
+
+    # Time a block: with histogram.time(): ...
+    def time(self) -> _Timer:
+        return _Timer(self)
+
+    def cumulative(self):
+        with self.lock:
+            counts = list(self.counts)
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            total += count
+            yield bound, total
+
+
+class Counter:
+    kind = COUNTER
+
+    def __init__(self) -> None:
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount: float = 1):
+        with self.lock:
+            self.value += amount
+
+
+# Stands in for every metric when metrics are disabled, so instrumented code costs a method call and nothing else
+class _NullMetric:
+    __slots__ = ()
+
+    def observe(self, value):
+        pass
+
+    def inc(self, amount=1):
+        pass
+
+    def time(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+NULL_METRIC = _NullMetric()
+
+
+# Stage timings and counters of the running pipeline. Values other components already keep (queue depths, dropped
+# readings, breaker failures) are read through collectors at export time instead of being counted twice.
+class MetricsRegistry:
+    enabled = True
+
+    def __init__(self, prefix: str = 'luftdaten') -> None:
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.metrics = {}
+        self.collectors = []
+
+    def _get(self, factory, metric_name, labels):
+        key = (metric_name, tuple(sorted(labels.items())))
+        metric = self.metrics.get(key)
+        if metric is None:
+            with self.lock:
+                metric = self.metrics.get(key)
+                if metric is None:
+                    metric = self.metrics[key] = factory()
+        return metric
+
+    # Labels are keyword arguments, metric_name leaves 'name' free to be used as a label
+    def histogram(self, metric_name: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS, **labels) -> Histogram:
+        return self._get(lambda: Histogram(buckets), metric_name, labels)
+
+    def counter(self, metric_name: str, **labels) -> Counter:
+        return self._get(Counter, metric_name, labels)
+
+    # collect() returns (name, kind, labels, value) tuples, with kind COUNTER or GAUGE
+    def add_collector(self, collect: Callable[[], Iterable[tuple]]):
+        self.collectors.append(collect)
+
+    def samples(self):
+        with self.lock:
+            metrics = list(self.metrics.items())
+        for (name, labels), metric in metrics:
+            yield name, metric.kind, labels, metric
+        for collect in self.collectors:
+            for name, kind, labels, value in collect():
+                yield name, kind, tuple(sorted(labels.items())), value
+
+    def render_prometheus(self) -> str:
+        lines = []
+        typed = set()
+        for name, kind, labels, value in sorted(self.samples(), key=lambda sample: sample[:3]):
+            name = '{}_{}'.format(self.prefix, name)
+            if name not in typed:
+                lines.append('# TYPE {} {}'.format(name, kind))
+                typed.add(name)
+            if kind != HISTOGRAM:
+                lines.append('{}{} {}'.format(name, _prometheus_labels(labels), getattr(value, 'value', value)))
+                continue
+            for bound, count in value.cumulative():
+                le = '+Inf' if bound == float('inf') else repr(float(bound))
+                lines.append('{}_bucket{} {}'.format(name, _prometheus_labels(labels + (('le', le),)), count))
+            lines.append('{}_sum{} {!r}'.format(name, _prometheus_labels(labels), value.sum))
+            lines.append('{}_count{} {}'.format(name, _prometheus_labels(labels), value.count))
+        return '\n'.join(lines) + '\n'
+
+    # One luftdaten_internal point per metric, tagged with the metric name and its labels
+    def influxdb_lines(self, tags: Optional[dict] = None, ts: Optional[int] = None,
+                       measurement: str = INTERNAL_MEASUREMENT) -> bytes:
+        ts = time.time_ns() if ts is None else ts
+        lines = []
+        for name, kind, labels, value in self.samples():
+            # Line protocol has no empty tag values, and InfluxDB prefers tags sorted by key
+            series_tags = dict(tags or {}, metric=name, **{key: label for key, label in labels if label != ''})
+            series = escape_measurement(measurement) + ''.join(
+                ',{}={}'.format(escape_key(key), escape_key(label)) for key, label in sorted(series_tags.items()))
+            if kind == HISTOGRAM:
+                mean = value.sum / value.count if value.count else 0.0
+                fields = 'count={}i,sum={!r},mean={!r},max={!r}'.format(value.count, value.sum, mean, value.max)
+            else:
+                fields = 'value={!r}'.format(float(getattr(value, 'value', value)))
+            lines.append('{} {} {}'.format(series, fields, ts))
+        return '\n'.join(lines).encode()
+
+
+class _NullRegistry:
+    enabled = False
+
+    def histogram(self, metric_name, buckets=DEFAULT_BUCKETS, **labels):
+        return NULL_METRIC
+
+    def counter(self, metric_name, **labels):
+        return NULL_METRIC
+
+    def add_collector(self, collect):
+        pass
+
+
+NULL_REGISTRY = _NullRegistry()
+
+
+def _prometheus_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"')
+                                                  .replace('\n', '\\n'))
+                          for key, value in labels) + '}'
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.server.registry.render_prometheus().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+# Serves the registry in the Prometheus text format on /metrics
+class MetricsServer:
+    def __init__(self, registry: MetricsRegistry, host: str = '127.0.0.1', port: int = 9101) -> None:
+        self.httpd = ThreadingHTTPServer((host, port), _MetricsHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.registry = registry
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name='metrics-server', daemon=True)
+
+    @property
+    def port(self) -> int:
+        return self.httpd.server_address[1]
+
+    def start(self) -> 'MetricsServer':
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -0,0 +1,86 @@
+import select
+import socket
+import threading
+from logging import Logger
+from typing import Callable
+
+ROUTE_TABLE = '/proc/net/route'
+OPERSTATE = '/sys/class/net/{}/operstate'
+RTF_UP = 0x1
+# Netlink groups for link, IPv4 address and IPv4 route changes
+RTMGRP_LINK = 0x1
+RTMGRP_IPV4_IFADDR = 0x10
+RTMGRP_IPV4_ROUTE = 0x40
+
+
+# Online when some interface that is up carries the default route
+def default_route_up(route_table: str = ROUTE_TABLE, operstate: str = OPERSTATE) -> bool:
+    try:
+        with open(route_table) as f:
+            next(f)
+            for line in f:
+                fields = line.split()
+                if len(fields) > 3 and fields[1] == '00000000' and int(fields[3], 16) & RTF_UP:
+                    try:
+                        with open(operstate.format(fields[0])) as state:
+                            if state.read().strip() in ('up', 'unknown'):
+                                return True
+                    except OSError:
+                        return True
+    except (OSError, StopIteration):
+        pass
+    return False
+
+
+# Cached network state, refreshed on netlink change notifications or, where netlink is missing, by polling
+# the route table. Listeners are called with the new state on every change.
+class NetworkMonitor:
+    def __init__(self, logger: Logger, poll_interval: float = 30, check: Callable[[], bool] = default_route_up) -> None:
+        self.logger = logger
+        self.poll_interval = poll_interval
+        self.check = check
+        self.listeners = []
+        self.online = check()
+        self.changes = 0
+        self.netlink = self._open_netlink()
+        self.thread = threading.Thread(target=self._run, name='network-monitor', daemon=True)
+        self.thread.start()
+
+    def _open_netlink(self):
+        try:
+            sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE)
+            sock.bind((0, RTMGRP_LINK | RTMGRP_IPV4_IFADDR | RTMGRP_IPV4_ROUTE))
+            return sock
+        except (AttributeError, OSError) as e:
+            self.logger.info("Netlink not available, polling network state: {}".format(e))
+            return None
+
+    def is_online(self) -> bool:
+        return self.online
+
+    def add_listener(self, listener: Callable[[bool], None]):
+        self.listeners.append(listener)
+
+    def _run(self):
+        while True:
+            if self.netlink:
+                readable, _, _ = select.select([self.netlink], [], [], self.poll_interval)
+                if readable:
+                    # Only the wake up matters, the state is read back from the route table
+                    self.netlink.recv(65536)
+            else:
+                threading.Event().wait(self.poll_interval)
+            self.refresh()
+
+    def refresh(self):
+        online = self.check()
+        if online == self.online:
+            return
+        self.online = online
+        self.changes += 1
+        self.logger.info("Network {}".format('connected' if online else 'disconnected'))
+        for listener in self.listeners:
+            try:
+                listener(online)
+            except Exception as e:
+                self.logger.warning("Network listener failed: {}".format(e))
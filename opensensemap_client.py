@@ -1,15 +1,26 @@
-from datetime import datetime, timezone
+import time
 from logging import Logger
 
 import requests
 
+from batching_sink import FLUSH_TICK, FlushPolicy, FlushTimer, ListBatchingSink, PartialWriteError
+from metrics import NULL_REGISTRY
+from opensensemap_encoder import JSON, MAX_MEASUREMENTS, OpenSenseMapEncoder
+from uplink import BodyStream, UplinkTraffic, check_encoding
+
+OPENSENSEMAP_URL = "https://api.opensensemap.org"
+
 
 class OpenSenseMapClient:
     def __init__(self, sensebox_id: str, temperature_sensor_id: str, humidity_sensor_id: str,
         pressure_sensor_id: str, pm_1_0_sensor_id: str, pm_2_5_sensor_id: str, pm_10_sensor_id: str,
-        logger: Logger, buffer_size: int = 100) -> None:
+        logger: Logger, buffer_size: int = 100, session: requests.Session = None,
+        url: str = OPENSENSEMAP_URL, metrics=NULL_REGISTRY, flush_policy: FlushPolicy = None,
+        upload_format: str = JSON, max_measurements: int = MAX_MEASUREMENTS, compression: str = None,
+        traffic: UplinkTraffic = None) -> None:
         self.logger = logger
-        self.buffer_size = buffer_size
+        self.url = url
+        self.session = session or requests.Session()
         self.pm_10_sensor_id = pm_10_sensor_id
         self.pm_2_5_sensor_id = pm_2_5_sensor_id
         self.pm_1_0_sensor_id = pm_1_0_sensor_id
@@ -17,39 +28,78 @@ class OpenSenseMapClient:
         self.humidity_sensor_id = humidity_sensor_id
         self.temperature_sensor_id = temperature_sensor_id
         self.sensebox_id = sensebox_id
-        self.values_buffer = []
+        self.sensor_fields = ((temperature_sensor_id, 'temperature'), (humidity_sensor_id, 'humidity'),
+                              (pressure_sensor_id, 'pressure'), (pm_1_0_sensor_id, 'P1.0'),
+                              (pm_2_5_sensor_id, 'P2.5'), (pm_10_sensor_id, 'P10'))
+        # Bulk uploads are streamed from the readings, in requests of at most max_measurements measurements
+        self.encoder = OpenSenseMapEncoder(self.sensor_fields, upload_format)
+        self.max_measurements = max_measurements
+        # Bodies are compressed as they are streamed, with the encoding the API takes
+        self.compression = check_encoding(compression)
+        self.traffic = traffic or UplinkTraffic('opensensemap')
+        # Readings passed to send_to_opensensemap are batched until any limit of the flush policy is reached
+        self.batch = ListBatchingSink('opensensemap', self._write_batch, logger,
+                                      flush_policy or FlushPolicy(buffer_size))
+        self.flush_timer = None
+        if self.batch.policy.max_age is not None:
+            self.flush_timer = FlushTimer(lambda: self.batch.send(FLUSH_TICK), logger).start()
+        self.encode_timer = metrics.histogram('stage_seconds', stage='encode', name='opensensemap')
 
-    @staticmethod
-    def ts_to_rfc3339(ts_in_nanos):
-        ts_in_seconds = ts_in_nanos / (1000 * 1000 * 1000)
-        ts = datetime.utcfromtimestamp(ts_in_seconds).astimezone(timezone.utc).isoformat()
-        ts = ts.replace('+00:00', 'Z')
+    # Chunks are posted one after the other, a backlog takes no more memory than a single chunk. A failed chunk
+    # raises PartialWriteError with the readings of the chunks before it, so they are not uploaded again.
+    def write_values(self, values):
+        written = 0
+        for chunk in self.encoder.chunks(values, self.max_measurements):
+            try:
+                self.write_chunk(chunk)
+            except Exception as e:
+                if not written:
+                    raise
+                raise PartialWriteError(e, written=written) from e
+            written += len(chunk)
 
-        return ts
+    def write_chunk(self, values):
+        body = BodyStream(self.encode(values), self.compression)
+        headers = {"Content-Type": self.encoder.content_type}
+        if self.compression:
+            headers["Content-Encoding"] = self.compression
+        start = time.perf_counter()
+        try:
+            resp = self.session.post("{}/boxes/{}/data".format(self.url, self.sensebox_id), data=body,
+                                     headers=headers)
+        except Exception:
+            self.traffic.record(len(values), body.raw_bytes, body.sent_bytes, time.perf_counter() - start, ok=False)
+            raise
+        self.traffic.record(len(values), body.raw_bytes, body.sent_bytes, time.perf_counter() - start,
+                            ok=resp.status_code < 500)
 
-    def map_values(self, values):
-        opensensemap_messages = []
-        for value in values:
-            ts = self.ts_to_rfc3339(value["ts"])
-            opensensemap_messages.append({"sensor": self.temperature_sensor_id, "value": value['temperature'], "createdAt": ts})
-            opensensemap_messages.append({"sensor": self.humidity_sensor_id, "value": value['humidity'], "createdAt": ts})
-            opensensemap_messages.append({"sensor": self.pressure_sensor_id, "value": value['pressure'], "createdAt": ts})
-            opensensemap_messages.append({"sensor": self.pm_1_0_sensor_id, "value": value['P1.0'], "createdAt": ts})
-            opensensemap_messages.append({"sensor": self.pm_2_5_sensor_id, "value": value['P2.5'], "createdAt": ts})
-            opensensemap_messages.append({"sensor": self.pm_10_sensor_id, "value": value['P10'], "createdAt": ts})
+        self.logger.info("Sent data to OpenSenseMap, ok: {}-{}".format(resp.status_code, resp.text))
+        # Server errors are worth retrying, rejected data is not
+        if resp.status_code >= 500:
+            resp.raise_for_status()
 
-        return opensensemap_messages
+    # The body is generated while it is sent, only the time spent encoding is observed
+    def encode(self, values):
+        pieces = self.encoder.encode(values)
+        elapsed = 0
+        while True:
+            start = time.perf_counter()
+            piece = next(pieces, None)
+            elapsed += time.perf_counter() - start
+            if piece is None:
+                break
+            yield piece
+        self.encode_timer.observe(elapsed)
+
+    def _write_batch(self, values):
+        self.logger.info("Sending data to OpenSenseMap")
+        self.write_values(values)
 
     def send_to_opensensemap(self, values):
-        self.values_buffer.append(values)
-        if len(self.values_buffer) >= self.buffer_size:
-            self.logger.info("Sending data to OpenSenseMap")
-            resp = requests.post("https://api.opensensemap.org/boxes/{}/data".format(self.sensebox_id),
-                                 json=self.map_values(self.values_buffer),
-                                 headers={
-                                     "Content-Type": "application/json",
-                                     "Connection": "close"
-                                 })
-
-            self.values_buffer = []
-            self.logger.info("Sent data to OpenSenseMap, ok: {}-{}".format(resp.status_code, resp.text))
+        self.batch.send(values)
+
+    # Stop the flush timer and write what is still pending
+    def close(self):
+        if self.flush_timer:
+            self.flush_timer.stop()
+        self.batch.close()
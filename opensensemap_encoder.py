@@ -0,0 +1,94 @@
+import time
+from itertools import islice
+from typing import Iterable, Iterator, List, Sequence, Tuple
+
+JSON = 'json'
+CSV = 'csv'
+FORMATS = (JSON, CSV)
+CONTENT_TYPES = {JSON: 'application/json', CSV: 'text/csv'}
+# Most measurements the bulk upload takes in one request
+MAX_MEASUREMENTS = 2500
+# Readings are yielded in pieces of about this size, every piece is a chunk of the HTTP body
+PIECE_SIZE = 16 * 1024
+
+
+# RFC 3339 timestamps with milliseconds, from ts in nanoseconds. Readings are seconds apart, so the date and hour
+# are formatted once per hour and only minutes, seconds and milliseconds per reading.
+class TimestampFormatter:
+    def __init__(self) -> None:
+        self.hour = None
+        self.prefix = ''
+
+    def __call__(self, ts_in_nanos: int) -> str:
+        millis = ts_in_nanos // 1000000
+        seconds, millis = divmod(millis, 1000)
+        hour, seconds = divmod(seconds, 3600)
+        if hour != self.hour:
+            self.prefix = time.strftime('%Y-%m-%dT%H:', time.gmtime(hour * 3600))
+            self.hour = hour
+        minutes, seconds = divmod(seconds, 60)
+        return '%s%02d:%02d.%03dZ' % (self.prefix, minutes, seconds, millis)
+
+
+# Encodes readings as an OpenSenseMap bulk upload body, yielding it reading by reading instead of building the
+# measurements in memory. sensor_fields are (sensor id, reading field) pairs.
+class OpenSenseMapEncoder:
+    def __init__(self, sensor_fields: Sequence[Tuple[str, str]], upload_format: str = JSON) -> None:
+        if upload_format not in FORMATS:
+            raise ValueError("Unknown OpenSenseMap upload format: {}".format(upload_format))
+        self.format = upload_format
+        self.content_type = CONTENT_TYPES[upload_format]
+        self.fields = [field for _sensor_id, field in sensor_fields]
+        if upload_format == JSON:
+            self.templates = ['{"sensor":"%s","value":%%r,"createdAt":"%%s"}' % sensor_id
+                              for sensor_id, _field in sensor_fields]
+            self.separator = ','
+        else:
+            self.templates = ['%s,%%r,%%s' % sensor_id for sensor_id, _field in sensor_fields]
+            self.separator = '\n'
+        self.timestamp = TimestampFormatter()
+
+    def _measurements(self, values) -> List[str]:
+        created_at = self.timestamp(values['ts'])
+        measurements = []
+        for template, field in zip(self.templates, self.fields):
+            # Sensors that were not up yet have no value, or NaN when read out of the reading buffer
+            value = values.get(field)
+            if value is not None and value == value:
+                measurements.append(template % (value, created_at))
+        return measurements
+
+    def encode(self, readings: Iterable, piece_size: int = PIECE_SIZE) -> Iterator[bytes]:
+        piece = ['['] if self.format == JSON else []
+        size = 0
+        first = True
+        for values in readings:
+            measurements = self._measurements(values)
+            if not measurements:
+                continue
+            text = self.separator.join(measurements)
+            if self.format == CSV:
+                text += '\n'
+            elif not first:
+                text = ',' + text
+            first = False
+            piece.append(text)
+            size += len(text)
+            if size >= piece_size:
+                yield ''.join(piece).encode()
+                piece = []
+                size = 0
+        if self.format == JSON:
+            piece.append(']')
+        if piece:
+            yield ''.join(piece).encode()
+
+    # Groups of readings holding at most max_measurements measurements, each sent as its own request
+    def chunks(self, readings: Iterable, max_measurements: int = MAX_MEASUREMENTS) -> Iterator[list]:
+        per_chunk = max(1, max_measurements // max(1, len(self.fields)))
+        readings = iter(readings)
+        while True:
+            chunk = list(islice(readings, per_chunk))
+            if not chunk:
+                return
+            yield chunk
@@ -0,0 +1,92 @@
+import threading
+import time
+from logging import Logger
+
+try:
+    from pms5003 import ChecksumMismatchError, ReadTimeoutError, SerialTimeoutError
+except ImportError:
+    # Off the Pi, e.g. with the simulated sensor
+    class ChecksumMismatchError(RuntimeError):
+        pass
+
+    class ReadTimeoutError(RuntimeError):
+        pass
+
+    class SerialTimeoutError(RuntimeError):
+        pass
+
+
+class StaleFrameError(Exception):
+    pass
+
+
+# Keeps consuming PMS5003 frames on a background thread and publishes the latest valid one, so readers never
+# block on the serial port
+class PMS5003Stream:
+    def __init__(self, pms5003, logger: Logger, max_age: float = 10) -> None:
+        self.pms5003 = pms5003
+        self.logger = logger
+        self.max_age = max_age
+        self.condition = threading.Condition()
+        self.frame = None
+        self.frame_time = 0
+        self.frames = 0
+        self.resets = 0
+        self.errors = 0
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name='pms5003', daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while self.running:
+            try:
+                frame = self.pms5003.read()
+            except ReadTimeoutError:
+                # No frame at all, the sensor needs a reset
+                self.resets += 1
+                self.logger.warning("PMS5003 read timeout, resetting sensor")
+                self._reset()
+                continue
+            except (ChecksumMismatchError, SerialTimeoutError) as e:
+                # Corrupt or partial frame, the next read resyncs on the start of frame bytes
+                self.errors += 1
+                self.logger.debug("PMS5003 bad frame: {}".format(e))
+                continue
+            except Exception as e:
+                self.errors += 1
+                self.logger.warning("PMS5003 read failed: {}".format(e))
+                time.sleep(1)
+                continue
+            with self.condition:
+                self.frame = frame
+                self.frame_time = time.monotonic()
+                self.frames += 1
+                self.condition.notify_all()
+
+    def _reset(self):
+        try:
+            self.pms5003.reset()
+        except Exception as e:
+            self.logger.warning("PMS5003 reset failed: {}".format(e))
+            time.sleep(1)
+
+    def age(self) -> float:
+        return time.monotonic() - self.frame_time if self.frame else float('inf')
+
+    # Latest frame and its age in seconds, without waiting
+    def latest(self):
+        with self.condition:
+            if self.frame is None or self.age() > self.max_age:
+                raise StaleFrameError("No PMS5003 frame in the last {}s".format(self.max_age))
+            return self.frame, self.age()
+
+    # Wait for a frame newer than the given number of frames, for callers paced by the sensor itself
+    def wait_next(self, frames_seen: int, timeout: float = None):
+        with self.condition:
+            self.condition.wait_for(lambda: self.frames > frames_seen, timeout)
+            if self.frames <= frames_seen:
+                raise StaleFrameError("No new PMS5003 frame in {}s".format(timeout))
+            return self.frame, self.frames
+
+    def stop(self):
+        self.running = False
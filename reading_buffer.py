@@ -0,0 +1,153 @@
+from array import array
+from logging import Logger
+from typing import Callable, Dict, Iterator, Sequence, Tuple
+
+from batching_sink import BYTES_PER_FIELD, BatchingSink, FlushPolicy, PartialWriteError
+from circuit_breaker import CircuitBreaker
+from network_monitor import NetworkMonitor
+
+# Fields produced by EnviroPlusReader.read_values, besides the ts
+FIELDS = ('temperature', 'pressure', 'humidity', 'oxidising', 'reducing', 'nh3', 'lux', 'P2.5', 'P10', 'P1.0')
+
+
+# Read-only view of one reading stored in a ReadingBuffer, usable wherever a values dict is expected
+class Reading:
+    __slots__ = ('buffer', 'index')
+
+    def __init__(self, buffer: 'ReadingBuffer', index: int) -> None:
+        self.buffer = buffer
+        self.index = index
+
+    def __getitem__(self, field):
+        if field == 'ts':
+            return self.buffer.ts[self.index]
+        return self.buffer.columns[field][self.index]
+
+    def get(self, field, default=None):
+        try:
+            return self[field]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return self.buffer.fields + ('ts',)
+
+    def to_dict(self) -> dict:
+        return {field: self[field] for field in self.keys()}
+
+    def __repr__(self):
+        return repr(self.to_dict())
+
+
+# Sequence of consecutive readings in a ReadingBuffer, backed by memoryviews of the columns
+class ReadingBlock:
+    def __init__(self, buffer: 'ReadingBuffer', start: int, stop: int) -> None:
+        self.buffer = buffer
+        self.start = start
+        self.stop = stop
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def __iter__(self) -> Iterator[Reading]:
+        capacity = self.buffer.capacity
+        for sequence in range(self.start, self.stop):
+            yield Reading(self.buffer, sequence % capacity)
+
+    def __getitem__(self, i) -> Reading:
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return Reading(self.buffer, (self.start + i) % self.buffer.capacity)
+
+    # Zero-copy views of a column, two views when the block wraps around the end of the ring
+    def column(self, field: str) -> Tuple[memoryview, ...]:
+        data = self.buffer.ts if field == 'ts' else self.buffer.columns[field]
+        capacity = self.buffer.capacity
+        begin, end = self.start % capacity, self.stop % capacity or capacity
+        view = memoryview(data)
+        if not len(self):
+            return ()
+        if begin < end:
+            return view[begin:end],
+        return view[begin:], view[:end]
+
+
+# Fixed schema columnar ring buffer of readings: one typed array per field plus an int64 ts column. Readings are
+# addressed by an ever increasing sequence number, so every sink can keep its own cursor into the shared buffer.
+class ReadingBuffer:
+    def __init__(self, capacity: int = 10000, fields: Sequence[str] = FIELDS) -> None:
+        self.capacity = capacity
+        self.fields = tuple(fields)
+        self.columns = {field: array('d', bytes(8 * capacity)) for field in self.fields}
+        self.ts = array('q', bytes(8 * capacity))
+        self.sequence = 0
+
+    def append(self, values) -> int:
+        index = self.sequence % self.capacity
+        for field, column in self.columns.items():
+            column[index] = values.get(field, float('nan'))
+        self.ts[index] = values['ts']
+        # Publish the reading only once every column has been written
+        self.sequence += 1
+        return self.sequence - 1
+
+    def __len__(self):
+        return min(self.sequence, self.capacity)
+
+    def oldest(self) -> int:
+        return max(0, self.sequence - self.capacity)
+
+    def block(self, start: int, stop: int = None) -> ReadingBlock:
+        return ReadingBlock(self, max(start, self.oldest()), self.sequence if stop is None else stop)
+
+    def latest(self) -> Reading:
+        return Reading(self, (self.sequence - 1) % self.capacity) if self.sequence else None
+
+    def nbytes(self) -> int:
+        return sum(column.buffer_info()[1] * column.itemsize for column in self.columns.values()) \
+               + self.ts.buffer_info()[1] * self.ts.itemsize
+
+    def memory_footprint(self) -> Dict[str, int]:
+        return {'capacity': self.capacity, 'readings': len(self), 'bytes': self.nbytes()}
+
+
+# Sink that writes batches straight out of the shared ReadingBuffer, keeping its own cursor instead of a list
+class BufferedBlockSink(BatchingSink):
+    def __init__(self, name: str, buffer: ReadingBuffer, write: Callable, logger: Logger, policy: FlushPolicy = None,
+                 breaker: CircuitBreaker = None, network: NetworkMonitor = None, cursor: int = None) -> None:
+        super().__init__(name, write, logger, policy, breaker=breaker, network=network)
+        self.buffer = buffer
+        self.record_bytes = BYTES_PER_FIELD * (len(buffer.fields) + 1)
+        # First sequence to write, by default the readings appended from now on
+        self.cursor = buffer.sequence if cursor is None else cursor
+        self.lost = 0
+
+    # The reading is already in the buffer, values is only the notification
+    def send(self, values):
+        if self.cursor < self.buffer.oldest():
+            self.lost += self.buffer.oldest() - self.cursor
+            self.logger.warning("Sink {} fell behind, {} readings overwritten".format(self.name, self.lost))
+            self.cursor = self.buffer.oldest()
+        super().send(values)
+
+    def pending_count(self) -> int:
+        return self.buffer.sequence - self.cursor
+
+    def pending_bytes(self) -> int:
+        return self.pending_count() * self.record_bytes
+
+    def write_pending(self):
+        block = self.buffer.block(self.cursor)
+        try:
+            self.write(block)
+        except PartialWriteError as e:
+            self.cursor = block.start + e.written
+            raise
+        self.cursor = block.stop
+
+    def collect_metrics(self):
+        yield from super().collect_metrics()
+        yield 'dropped_readings_total', 'counter', {'sink': self.name, 'reason': 'overwritten'}, self.lost
+        yield 'sink_backlog', 'gauge', {'sink': self.name}, self.pending_count()
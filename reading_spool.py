@@ -0,0 +1,195 @@
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from logging import Logger
+from typing import Callable, List, Tuple
+
+from batching_sink import BatchingSink, FlushPolicy, PartialWriteError
+from circuit_breaker import CircuitBreaker
+from network_monitor import NetworkMonitor
+
+# Record header: payload length and crc32 of the payload
+HEADER = struct.Struct('<II')
+SEGMENT_SUFFIX = '.seg'
+OFFSET_SUFFIX = '.offset'
+
+
+# Append-only, segment based spool of readings on disk. Every consumer keeps its own acknowledged offset, so
+# readings survive restarts and are replayed until the consumer confirms they were written.
+class ReadingSpool:
+    def __init__(self, path: str, segment_size: int = 4 * 1024 * 1024, fsync_interval: float = 30) -> None:
+        self.path = path
+        self.segment_size = segment_size
+        self.fsync_interval = fsync_interval
+        self.lock = threading.Lock()
+        self.consumers = {}
+        os.makedirs(path, exist_ok=True)
+        self.segments = sorted(int(name[:-len(SEGMENT_SUFFIX)]) for name in os.listdir(path)
+                               if name.endswith(SEGMENT_SUFFIX))
+        if not self.segments:
+            self.segments = [0]
+        self.end_offset = self.segments[-1] + self._recover(self.segments[-1])
+        self.active = open(self._segment_path(self.segments[-1]), 'ab')
+        self.last_fsync = time.monotonic()
+
+    def _segment_path(self, base):
+        return os.path.join(self.path, '{:020d}{}'.format(base, SEGMENT_SUFFIX))
+
+    # Find the end of the last complete record and drop anything torn by a crash after it
+    def _recover(self, base):
+        path = self._segment_path(base)
+        if not os.path.exists(path):
+            return 0
+        with open(path, 'rb') as f:
+            data = f.read()
+        position = 0
+        while position + HEADER.size <= len(data):
+            length, crc = HEADER.unpack_from(data, position)
+            payload = data[position + HEADER.size:position + HEADER.size + length]
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                break
+            position += HEADER.size + length
+        if position < len(data):
+            with open(path, 'r+b') as f:
+                f.truncate(position)
+        return position
+
+    def append(self, values):
+        payload = json.dumps(values, separators=(',', ':')).encode()
+        record = HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+        with self.lock:
+            if self.end_offset - self.segments[-1] + len(record) > self.segment_size \
+                    and self.end_offset > self.segments[-1]:
+                self._roll()
+            self.active.write(record)
+            self.active.flush()
+            self.end_offset += len(record)
+            # Few fsyncs to spare the SD card, a crash loses at most fsync_interval seconds of readings
+            if time.monotonic() - self.last_fsync >= self.fsync_interval:
+                self._fsync()
+
+    def _roll(self):
+        self._fsync()
+        self.active.close()
+        self.segments.append(self.end_offset)
+        self.active = open(self._segment_path(self.end_offset), 'ab')
+
+    def _fsync(self):
+        os.fsync(self.active.fileno())
+        self.last_fsync = time.monotonic()
+
+    def consumer(self, name: str) -> 'SpoolConsumer':
+        consumer = SpoolConsumer(self, name)
+        with self.lock:
+            self.consumers[name] = consumer
+        return consumer
+
+    # Read up to max_records records starting at offset, returns the records and the offset after the last one
+    def read(self, offset: int, max_records: int) -> Tuple[List[dict], int]:
+        with self.lock:
+            segments = list(self.segments)
+            end_offset = self.end_offset
+        offset = max(offset, segments[0])
+        records = []
+        while offset < end_offset and len(records) < max_records:
+            base = max(b for b in segments if b <= offset)
+            next_base = min((b for b in segments if b > base), default=end_offset)
+            offset = self._read_segment(base, offset, min(next_base, end_offset), max_records, records)
+        return records, offset
+
+    def _read_segment(self, base, offset, end, max_records, records):
+        if end <= base:
+            return end
+        with open(self._segment_path(base), 'rb') as f, \
+                mmap.mmap(f.fileno(), end - base, access=mmap.ACCESS_READ) as data:
+            position = offset - base
+            while position < end - base and len(records) < max_records:
+                length, _crc = HEADER.unpack_from(data, position)
+                start = position + HEADER.size
+                records.append(json.loads(data[start:start + length]))
+                position = start + length
+        return base + position
+
+    # Remove whole segments every consumer has already acknowledged
+    def compact(self):
+        with self.lock:
+            if not self.consumers:
+                return
+            acked = min(consumer.offset for consumer in self.consumers.values())
+            while len(self.segments) > 1 and self.segments[1] <= acked:
+                os.remove(self._segment_path(self.segments.pop(0)))
+
+    def close(self):
+        with self.lock:
+            self._fsync()
+            self.active.close()
+
+
+class SpoolConsumer:
+    def __init__(self, spool: ReadingSpool, name: str) -> None:
+        self.spool = spool
+        self.name = name
+        self.offset_path = os.path.join(spool.path, name + OFFSET_SUFFIX)
+        self.offset = 0
+        if os.path.exists(self.offset_path):
+            with open(self.offset_path) as f:
+                self.offset = min(int(f.read().strip() or 0), spool.end_offset)
+
+    def pending(self) -> int:
+        return self.spool.end_offset - self.offset
+
+    def read(self, max_records: int) -> Tuple[List[dict], int]:
+        return self.spool.read(self.offset, max_records)
+
+    # Offsets are not fsynced, after a crash the consumer may replay a few already written readings
+    def ack(self, offset: int):
+        self.offset = offset
+        tmp_path = self.offset_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(str(offset))
+        os.replace(tmp_path, self.offset_path)
+        self.spool.compact()
+
+
+# Sink that drains the spool into a batch writer, only acknowledging readings once the write succeeded
+class SpooledSink(BatchingSink):
+    def __init__(self, consumer: SpoolConsumer, write: Callable, logger: Logger, policy: FlushPolicy = None,
+                 replay_batch_size: int = 5000, breaker: CircuitBreaker = None, network: NetworkMonitor = None) -> None:
+        super().__init__(consumer.name, write, logger, policy, breaker=breaker, network=network)
+        self.consumer = consumer
+        self.replay_batch_size = replay_batch_size
+        # A backlog left over from a previous run is replayed on the first reading
+        self.pending_records = self.policy.max_count if consumer.pending() else 0
+
+    # The reading is already in the spool, values is only the notification
+    def receive(self, values):
+        self.pending_records += 1
+
+    def pending_count(self) -> int:
+        return self.pending_records
+
+    def pending_bytes(self) -> int:
+        return self.consumer.pending()
+
+    def write_pending(self):
+        while True:
+            records, offset = self.consumer.read(self.replay_batch_size)
+            if not records:
+                break
+            try:
+                self.write(records)
+            except PartialWriteError as e:
+                # Acknowledge the readings that were written, up to the offset after them
+                if e.written:
+                    self.consumer.ack(self.consumer.read(e.written)[1])
+                raise
+            self.consumer.ack(offset)
+        self.pending_records = 0
+
+    def collect_metrics(self):
+        yield from super().collect_metrics()
+        yield 'sink_backlog_bytes', 'gauge', {'sink': self.name}, self.consumer.pending()
@@ -0,0 +1,218 @@
+import json
+import math
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional, Sequence, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from aggregation import NANOS, WindowAggregator
+from reading_buffer import FIELDS, ReadingBuffer
+
+# Responses cached per reading, other URLs are rendered on every request
+MAX_CACHED = 32
+
+
+# Count, mean, min and max per field over the last window seconds, updated as entries come in and fall out of the
+# window: running sums for the mean and monotonic queues for min and max
+class RollingStats:
+    def __init__(self, window: float, fields: Sequence[str] = FIELDS) -> None:
+        self.window = int(window * NANOS)
+        self.fields = tuple(fields)
+        self.entries = deque()
+        self.totals = [0.0] * len(self.fields)
+        self.counts = [0] * len(self.fields)
+        self.minima = [deque() for _ in self.fields]
+        self.maxima = [deque() for _ in self.fields]
+
+    # stats has (total, count, min, max) or None for every field
+    def add(self, ts: int, stats: List[Optional[Tuple[float, int, float, float]]]):
+        self.entries.append((ts, stats))
+        for i, field_stats in enumerate(stats):
+            if field_stats is None:
+                continue
+            total, count, low, high = field_stats
+            self.totals[i] += total
+            self.counts[i] += count
+            minima, maxima = self.minima[i], self.maxima[i]
+            while minima and minima[-1][1] >= low:
+                minima.pop()
+            minima.append((ts, low))
+            while maxima and maxima[-1][1] <= high:
+                maxima.pop()
+            maxima.append((ts, high))
+        self._evict(ts - self.window)
+
+    def _evict(self, start):
+        while self.entries and self.entries[0][0] <= start:
+            _ts, stats = self.entries.popleft()
+            for i, field_stats in enumerate(stats):
+                if field_stats is not None:
+                    self.totals[i] -= field_stats[0]
+                    self.counts[i] -= field_stats[1]
+        for queue in self.minima + self.maxima:
+            while queue and queue[0][0] <= start:
+                queue.popleft()
+
+    def as_dict(self) -> dict:
+        return {field: {'count': count, 'mean': round(total / count, 4), 'min': minima[0][1], 'max': maxima[0][1]}
+                if count else None
+                for field, total, count, minima, maxima in zip(self.fields, self.totals, self.counts, self.minima,
+                                                               self.maxima)}
+
+
+def _finite(value):
+    return value if math.isfinite(value) else None
+
+
+# First sequence number of buffer with a ts after start, readings are appended in time order
+def _first_after(buffer: ReadingBuffer, start: int) -> int:
+    low, high = buffer.oldest(), buffer.sequence
+    while low < high:
+        middle = (low + high) // 2
+        if buffer.ts[middle % buffer.capacity] <= start:
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+
+# The last hour of readings at full resolution and the last day downsampled, in preallocated ring buffers, with
+# rolling aggregates over both. Responses are rendered once per new reading and served from cache until the next.
+class RecentReadings:
+    def __init__(self, fields: Sequence[str] = FIELDS, tick: float = 2, recent: float = 3600,
+                 history: float = 86400, history_step: float = 60) -> None:
+        self.fields = tuple(fields)
+        self.recent_seconds = recent
+        self.history_seconds = history
+        self.recent = ReadingBuffer(int(math.ceil(recent / tick)) + 1, self.fields)
+        # Fields missing from part of a window are weighted by the readings that had them
+        self.downsampler = WindowAggregator(history_step, fields=self.fields, quantiles=(), counts=True)
+        self.history = ReadingBuffer(int(math.ceil(history / history_step)) + 1, self.downsampler.output_fields())
+        self.rolling = {'recent': RollingStats(recent, self.fields), 'history': RollingStats(history, self.fields)}
+        self.lock = threading.Lock()
+        self.version = 0
+        # ETags of an earlier run must not match
+        self.run_id = '{:x}'.format(time.time_ns())
+        self.cache = {}
+
+    def append(self, values):
+        with self.lock:
+            self.recent.append(values)
+            stats = []
+            for field in self.fields:
+                x = values.get(field)
+                stats.append((x, 1, x, x) if x is not None and x == x else None)
+            self.rolling['recent'].add(values['ts'], stats)
+            for window in self.downsampler.add(values):
+                self.history.append(window)
+                self.rolling['history'].add(window['ts'], [
+                    (window[field] * window[field + '_count'], window[field + '_count'], window[field + '_min'],
+                     window[field + '_max']) if window[field + '_count'] else None for field in self.fields])
+            self.version += 1
+            self.cache = {}
+
+    def latest(self) -> Optional[dict]:
+        reading = self.recent.latest()
+        if reading is None:
+            return None
+        return {field: reading['ts'] if field == 'ts' else _finite(reading[field]) for field in reading.keys()}
+
+    # Columns of the readings in the last seconds, fields limited to the given ones
+    def _columns(self, buffer, seconds, fields):
+        if not buffer.sequence:
+            return {'ts': []}
+        start = buffer.ts[(buffer.sequence - 1) % buffer.capacity] - int(seconds * NANOS)
+        block = buffer.block(_first_after(buffer, start))
+        columns = {'ts': [ts for view in block.column('ts') for ts in view]}
+        for field in fields:
+            columns[field] = [_finite(x) for view in block.column(field) for x in view]
+        return columns
+
+    def render(self, path: str, query: dict) -> Optional[bytes]:
+        fields = query['fields'][0].split(',') if 'fields' in query else None
+        if path == '/latest':
+            body = self.latest()
+        elif path == '/recent':
+            seconds = min(float(query.get('seconds', [self.recent_seconds])[0]), self.recent_seconds)
+            body = self._columns(self.recent, seconds, self._check_fields(fields or self.fields, self.recent))
+        elif path == '/history':
+            seconds = min(float(query.get('seconds', [self.history_seconds])[0]), self.history_seconds)
+            body = self._columns(self.history, seconds, self._check_fields(fields or self.fields, self.history))
+        elif path == '/aggregates':
+            body = {'{}s'.format(int(rolling.window // NANOS)): rolling.as_dict()
+                    for rolling in self.rolling.values()}
+        else:
+            return None
+        return json.dumps(body, separators=(',', ':')).encode()
+
+    @staticmethod
+    def _check_fields(fields, buffer):
+        unknown = [field for field in fields if field not in buffer.columns]
+        if unknown:
+            raise ValueError("Unknown fields: {}".format(', '.join(unknown)))
+        return fields
+
+    # Body and ETag of a request, rendered once per version
+    def response(self, url: str) -> Tuple[Optional[bytes], str]:
+        with self.lock:
+            etag = '"{}-{}"'.format(self.run_id, self.version)
+            cached = self.cache.get(url)
+            if cached is not None:
+                return cached, etag
+            parts = urlsplit(url)
+            body = self.render(parts.path, parse_qs(parts.query))
+            if body is not None and len(self.cache) < MAX_CACHED:
+                self.cache[url] = body
+        return body, etag
+
+
+class _RecentReadingsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        try:
+            body, etag = self.server.recent.response(self.path)
+        except ValueError as e:
+            self.send_error(400, str(e))
+            return
+        if body is None:
+            self.send_error(404)
+            return
+        # Polls of an unchanged resource get a bodiless 304
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.wfile.write(body)
+
+
+# Serves /latest, /recent, /history and /aggregates as JSON. recent and history take seconds and fields
+# (comma separated) query parameters.
+class RecentReadingsServer:
+    def __init__(self, recent: RecentReadings, host: str = '127.0.0.1', port: int = 9102) -> None:
+        self.httpd = ThreadingHTTPServer((host, port), _RecentReadingsHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.recent = recent
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name='recent-readings', daemon=True)
+
+    @property
+    def port(self) -> int:
+        return self.httpd.server_address[1]
+
+    def start(self) -> 'RecentReadingsServer':
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -0,0 +1,117 @@
+import time
+from logging import Logger
+from typing import Callable, Dict, Iterator, List
+
+from metrics import NULL_REGISTRY
+
+
+class SensorTask:
+    def __init__(self, name: str, read: Callable[[], dict], period: float) -> None:
+        self.name = name
+        self.read = read
+        self.period = period
+        self.deadline = 0
+        self.runs = 0
+        self.missed = 0
+
+
+# Reads every sensor at its own cadence against monotonic deadlines and emits merged snapshots on a drift-free tick
+class SamplingScheduler:
+    def __init__(self, tasks: List[SensorTask], merge: Callable[[Dict[str, dict]], dict], logger: Logger,
+                 tick: float = 2, clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], None] = time.sleep, metrics=NULL_REGISTRY) -> None:
+        self.tasks = list(tasks)
+        self.metrics = metrics
+        self.read_timers = {task.name: metrics.histogram('stage_seconds', stage='read', name=task.name)
+                            for task in tasks}
+        # Tasks of devices that came up after sampling started, picked up by the loop on its next pass
+        self.added_tasks = []
+        self.merge = merge
+        self.logger = logger
+        self.tick = tick
+        self.clock = clock
+        self.sleep = sleep
+        self.latest = {}
+        self.ticks = 0
+        self.missed_ticks = 0
+        self.jitter_total = 0
+        self.jitter_max = 0
+
+    def _advance(self, deadline, period, now):
+        # Deadlines are multiples of the period from the start, a late run skips the slots it overran
+        deadline += period
+        missed = 0
+        if deadline <= now:
+            missed = int((now - deadline) // period) + 1
+            deadline += missed * period
+        return deadline, missed
+
+    # Safe to call from other threads while run() is going
+    def add_task(self, task: SensorTask):
+        self.read_timers[task.name] = self.metrics.histogram('stage_seconds', stage='read', name=task.name)
+        self.added_tasks.append(task)
+
+    def _take_added_tasks(self, now):
+        while self.added_tasks:
+            task = self.added_tasks.pop(0)
+            task.deadline = now
+            self.tasks.append(task)
+            self.logger.info("Sampling {} every {}s".format(task.name, task.period))
+
+    def _run_due_tasks(self, now):
+        for task in self.tasks:
+            if task.deadline <= now:
+                try:
+                    with self.read_timers[task.name].time():
+                        self.latest[task.name] = task.read()
+                    task.runs += 1
+                except Exception as e:
+                    # A failed sensor must not keep reporting its last values with new timestamps
+                    self.latest.pop(task.name, None)
+                    self.logger.warning("Reading {} failed: {}".format(task.name, e))
+                task.deadline, missed = self._advance(task.deadline, task.period, self.clock())
+                task.missed += missed
+
+    def run(self) -> Iterator[dict]:
+        start = self.clock()
+        for task in self.tasks:
+            task.deadline = start
+        tick_deadline = start
+        while True:
+            now = self.clock()
+            self._take_added_tasks(now)
+            self._run_due_tasks(now)
+            if tick_deadline <= now:
+                jitter = now - tick_deadline
+                self.ticks += 1
+                self.jitter_total += jitter
+                self.jitter_max = max(self.jitter_max, jitter)
+                tick_deadline, missed = self._advance(tick_deadline, self.tick, self.clock())
+                self.missed_ticks += missed
+                if missed:
+                    self.logger.warning("Sampling fell behind, {} ticks missed".format(missed))
+                try:
+                    snapshot = self.merge(self.latest)
+                except Exception as e:
+                    self.logger.warning("Snapshot skipped, missing readings: {}".format(e))
+                else:
+                    yield snapshot
+            next_deadline = min([tick_deadline] + [task.deadline for task in self.tasks])
+            delay = next_deadline - self.clock()
+            if delay > 0:
+                self.sleep(delay)
+
+    def stats(self) -> dict:
+        return {
+            'ticks': self.ticks,
+            'missed_ticks': self.missed_ticks,
+            'jitter_mean': self.jitter_total / self.ticks if self.ticks else 0,
+            'jitter_max': self.jitter_max,
+            'tasks': {task.name: {'period': task.period, 'runs': task.runs, 'missed': task.missed}
+                      for task in list(self.tasks)}
+        }
+
+    def collect_metrics(self):
+        yield 'missed_ticks_total', 'counter', {}, self.missed_ticks
+        for task in list(self.tasks):
+            yield 'missed_reads_total', 'counter', {'sensor': task.name}, task.missed
@@ -0,0 +1,185 @@
+import struct
+import time
+from logging import Logger
+from multiprocessing import shared_memory
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+from reading_buffer import FIELDS
+
+DEFAULT_NAME = 'luftdaten'
+# Header: magic, layout version, capacity, field count, generation (ns when the ring was created), then the number
+# of readings published so far and the comma separated field names
+MAGIC = b'LDRB'
+VERSION = 1
+HEADER = struct.Struct('<4sIIIq')
+PUBLISHED = struct.Struct('<Q')
+FIELD_NAMES_SIZE = 512
+DATA_OFFSET = HEADER.size + PUBLISHED.size + FIELD_NAMES_SIZE
+# Every slot starts with its own sequence counter: odd while the writer is filling it, 2 * (sequence + 1) once the
+# reading with that sequence number is complete
+COUNTER = struct.Struct('<Q')
+
+
+class RingError(Exception):
+    pass
+
+
+# Counter, ts and one float per field
+def _record(fields):
+    return struct.Struct('<Qq{}d'.format(len(fields)))
+
+
+def _data(fields):
+    return struct.Struct('<q{}d'.format(len(fields)))
+
+
+# Readers that attach must not unlink the segment when they exit, only the acquisition process owns it
+def _attach(name):
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Before Python 3.13 every attached segment is tracked, and unlinked by the tracker on exit
+        segment = shared_memory.SharedMemory(name=name)
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(segment._name, 'shared_memory')
+        return segment
+
+
+# Fixed-size reading records in a shared memory ring, written by the acquisition process only
+class SharedRingWriter:
+    def __init__(self, name: str = DEFAULT_NAME, capacity: int = 3600, fields: Sequence[str] = FIELDS) -> None:
+        self.fields = tuple(fields)
+        names = ','.join(self.fields).encode()
+        if len(names) > FIELD_NAMES_SIZE:
+            raise RingError("Field names take more than {} bytes".format(FIELD_NAMES_SIZE))
+        self.record = _record(self.fields)
+        self.data = _data(self.fields)
+        self.capacity = capacity
+        # A ring left behind by an acquisition process that died is replaced, readers notice the new generation
+        try:
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+        except FileNotFoundError:
+            pass
+        self.segment = shared_memory.SharedMemory(name=name, create=True,
+                                                  size=DATA_OFFSET + capacity * self.record.size)
+        self.buffer = self.segment.buf
+        self.generation = time.time_ns()
+        HEADER.pack_into(self.buffer, 0, MAGIC, VERSION, capacity, len(self.fields), self.generation)
+        PUBLISHED.pack_into(self.buffer, HEADER.size, 0)
+        self.buffer[HEADER.size + PUBLISHED.size:HEADER.size + PUBLISHED.size + len(names)] = names
+        self.sequence = 0
+
+    @property
+    def name(self) -> str:
+        return self.segment.name
+
+    def append(self, values):
+        offset = DATA_OFFSET + (self.sequence % self.capacity) * self.record.size
+        # Seqlock: readers that see an odd or changed counter retry or skip the slot
+        COUNTER.pack_into(self.buffer, offset, 2 * self.sequence + 1)
+        self.data.pack_into(self.buffer, offset + COUNTER.size, values['ts'],
+                            *[values.get(field, float('nan')) for field in self.fields])
+        COUNTER.pack_into(self.buffer, offset, 2 * (self.sequence + 1))
+        self.sequence += 1
+        PUBLISHED.pack_into(self.buffer, HEADER.size, self.sequence)
+
+    def close(self):
+        self.buffer = None
+        self.segment.close()
+        self.segment.unlink()
+
+
+# Reads the ring in place, every reader keeps its own cursor. Readings overwritten before they were read are
+# counted as lost.
+class SharedRingReader:
+    def __init__(self, name: str = DEFAULT_NAME) -> None:
+        self.segment = _attach(name)
+        self.buffer = self.segment.buf
+        magic, version, self.capacity, field_count, self.generation = HEADER.unpack_from(self.buffer, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise RingError("{} is not a reading ring of version {}".format(name, VERSION))
+        names = bytes(self.buffer[HEADER.size + PUBLISHED.size:DATA_OFFSET]).rstrip(b'\0').decode()
+        self.fields = tuple(names.split(','))[:field_count]
+        self.record = _record(self.fields)
+        self.lost = 0
+
+    def published(self) -> int:
+        return PUBLISHED.unpack_from(self.buffer, HEADER.size)[0]
+
+    def oldest(self) -> int:
+        return max(0, self.published() - self.capacity)
+
+    def _read_slot(self, sequence) -> Optional[Tuple]:
+        offset = DATA_OFFSET + (sequence % self.capacity) * self.record.size
+        record = self.record.unpack_from(self.buffer, offset)
+        # The counter is read again after the data, a writer that came by in between changed it
+        if record[0] != 2 * (sequence + 1) or COUNTER.unpack_from(self.buffer, offset)[0] != record[0]:
+            return None
+        return record
+
+    # Readings from cursor on, as values dicts with NaN for the fields that were not read, and the next cursor
+    def read(self, cursor: int, max_records: int = 1000) -> Tuple[List[dict], int]:
+        published = self.published()
+        oldest = max(0, published - self.capacity)
+        if cursor < oldest:
+            self.lost += oldest - cursor
+            cursor = oldest
+        readings = []
+        fields = self.fields
+        while cursor < published and len(readings) < max_records:
+            record = self._read_slot(cursor)
+            cursor += 1
+            if record is None:
+                self.lost += 1
+                continue
+            values = dict(zip(fields, record[2:]))
+            values['ts'] = record[1]
+            readings.append(values)
+        return readings, cursor
+
+    def close(self):
+        self.buffer = None
+        self.segment.close()
+
+
+# Readings as they are published, attaching once the acquisition process is up and again after it restarted.
+# replay readings already in the ring are returned first.
+def follow(logger: Logger, name: str = DEFAULT_NAME, poll_interval: float = 0.1, stale_after: float = 10,
+           replay: int = 0) -> Iterator[dict]:
+    reader = None
+    cursor = 0
+    idle_since = time.monotonic()
+    while True:
+        if reader is None:
+            try:
+                reader = SharedRingReader(name)
+            except (FileNotFoundError, RingError) as e:
+                logger.debug("Waiting for the acquisition process: {}".format(e))
+                time.sleep(1)
+                continue
+            cursor = max(reader.oldest(), reader.published() - replay)
+            idle_since = time.monotonic()
+            logger.info("Reading from shared memory ring {}, generation {}".format(name, reader.generation))
+        readings, cursor = reader.read(cursor)
+        if readings:
+            idle_since = time.monotonic()
+            yield from readings
+            continue
+        # Nothing new for a while, the acquisition process may have been restarted with a new ring
+        if time.monotonic() - idle_since > stale_after:
+            try:
+                current = SharedRingReader(name)
+            except (FileNotFoundError, RingError):
+                current = None
+            if current is not None and current.generation != reader.generation:
+                logger.warning("Acquisition process restarted, reading its new ring")
+                reader.close()
+                reader = current
+                cursor = 0
+            elif current is not None:
+                current.close()
+            idle_since = time.monotonic()
+        time.sleep(poll_interval)
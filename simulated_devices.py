@@ -0,0 +1,195 @@
+import math
+import random
+import threading
+import time
+
+from pms5003_stream import ReadTimeoutError
+
+# Typical time each real device takes to answer, in seconds
+BME280_LATENCY = 0.004
+GAS_LATENCY = 0.012
+LTR559_LATENCY = 0.006
+PMS5003_FRAME_INTERVAL = 1.0
+ST7735_SPI_HZ = 10000000
+
+
+# Time running speedup times faster than the real one from when it was created, for soak runs of days in minutes.
+# Sensor signals, sampling deadlines and reading timestamps all follow it.
+class AcceleratedClock:
+    def __init__(self, speedup: float = 1) -> None:
+        self.speedup = speedup
+        self.real_start = time.monotonic()
+        self.wall_start = time.time()
+
+    def elapsed(self) -> float:
+        return (time.monotonic() - self.real_start) * self.speedup
+
+    def monotonic(self) -> float:
+        return self.real_start + self.elapsed()
+
+    def time(self) -> float:
+        return self.wall_start + self.elapsed()
+
+    def time_ns(self) -> int:
+        return int(self.time() * 1e9)
+
+    def sleep(self, seconds: float):
+        time.sleep(seconds / self.speedup)
+
+
+# Slowly varying signal with noise, so compression and deadband filters see realistic data
+class Signal:
+    def __init__(self, base: float, amplitude: float, period: float, noise: float, seed: int = 0) -> None:
+        self.base = base
+        self.amplitude = amplitude
+        self.period = period
+        self.noise = noise
+        self.random = random.Random(seed)
+
+    def value(self, t: float) -> float:
+        return self.base + self.amplitude * math.sin(2 * math.pi * t / self.period) + self.random.gauss(0, self.noise)
+
+
+class SimulatedBME280:
+    def __init__(self, latency: float = BME280_LATENCY, clock=time.time, seed: int = 1) -> None:
+        self.latency = latency
+        self.clock = clock
+        self.temperature = Signal(21, 4, 86400, 0.05, seed)
+        self.pressure = Signal(1013, 3, 43200, 0.02, seed + 1)
+        self.humidity = Signal(45, 10, 86400, 0.2, seed + 2)
+
+    def _read(self, signal):
+        if self.latency:
+            time.sleep(self.latency)
+        return signal.value(self.clock())
+
+    def get_temperature(self):
+        return self._read(self.temperature)
+
+    def get_pressure(self):
+        return self._read(self.pressure)
+
+    def get_humidity(self):
+        return self._read(self.humidity)
+
+
+class SimulatedGasData:
+    def __init__(self, oxidising: float, reducing: float, nh3: float) -> None:
+        self.oxidising = oxidising
+        self.reducing = reducing
+        self.nh3 = nh3
+
+
+# Stands in for the enviroplus.gas module, resistances are in ohms
+class SimulatedGas:
+    def __init__(self, latency: float = GAS_LATENCY, clock=time.time, seed: int = 4) -> None:
+        self.latency = latency
+        self.clock = clock
+        self.oxidising = Signal(20000, 5000, 3600, 200, seed)
+        self.reducing = Signal(300000, 50000, 7200, 2000, seed + 1)
+        self.nh3 = Signal(80000, 10000, 5400, 500, seed + 2)
+
+    def read_all(self):
+        if self.latency:
+            time.sleep(self.latency)
+        t = self.clock()
+        return SimulatedGasData(self.oxidising.value(t), self.reducing.value(t), self.nh3.value(t))
+
+
+class SimulatedLTR559:
+    def __init__(self, latency: float = LTR559_LATENCY, clock=time.time, seed: int = 7) -> None:
+        self.latency = latency
+        self.clock = clock
+        self.lux = Signal(300, 300, 86400, 5, seed)
+
+    def get_lux(self):
+        if self.latency:
+            time.sleep(self.latency)
+        return max(0.0, self.lux.value(self.clock()))
+
+
+class SimulatedPMFrame:
+    def __init__(self, values) -> None:
+        self.values = values
+
+    def pm_ug_per_m3(self, size):
+        return self.values[size]
+
+
+# Streams a frame every frame_interval seconds and times out on a share of the reads, like a sensor losing sync
+class SimulatedPMS5003:
+    def __init__(self, frame_interval: float = PMS5003_FRAME_INTERVAL, timeout_rate: float = 0.0,
+                 clock=time.time, seed: int = 8) -> None:
+        self.frame_interval = frame_interval
+        self.timeout_rate = timeout_rate
+        self.clock = clock
+        self.random = random.Random(seed)
+        self.pm = Signal(8, 4, 3600, 1, seed)
+        self.next_frame = time.monotonic()
+        self.resets = 0
+
+    def read(self):
+        delay = self.next_frame - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        self.next_frame = max(self.next_frame + self.frame_interval, time.monotonic())
+        if self.random.random() < self.timeout_rate:
+            raise ReadTimeoutError("Simulated PMS5003 read timeout")
+        pm25 = max(0, int(round(self.pm.value(self.clock()))))
+        return SimulatedPMFrame({1.0: int(pm25 * 0.7), 2.5: pm25, 10: int(pm25 * 1.4)})
+
+    def reset(self):
+        self.resets += 1
+        time.sleep(0.1)
+
+
+# ST7735 with the driver API EnviroplusLCD uses, sleeping for the SPI transfer time of every write
+class SimulatedST7735:
+    def __init__(self, width: int = 160, height: int = 80, spi_speed_hz: int = ST7735_SPI_HZ) -> None:
+        self.width = width
+        self.height = height
+        self.spi_speed_hz = spi_speed_hz
+        self.lock = threading.Lock()
+        self.frames = 0
+        self.windows = 0
+        self.bytes_sent = 0
+        self.backlight = 1
+
+    def begin(self):
+        pass
+
+    def _transfer(self, count):
+        self.bytes_sent += count
+        time.sleep(count * 8 / self.spi_speed_hz)
+
+    def display(self, image):
+        self.frames += 1
+        self._transfer(image.width * image.height * 2)
+
+    def image_to_data(self, image, rotation=0):
+        return bytes(image.width * image.height * 2)
+
+    def set_window(self, x0=0, y0=0, x1=None, y1=None):
+        self.windows += 1
+
+    def data(self, data):
+        self._transfer(len(data))
+
+    def set_backlight(self, value):
+        self.backlight = value
+
+
+def simulated_cpu_temperature():
+    return 45.0
+
+
+# Keyword arguments for EnviroPlusReader with every device simulated, latency_scale=0 answers instantly
+def simulated_reader_devices(pms_timeout_rate: float = 0.0, frame_interval: float = PMS5003_FRAME_INTERVAL,
+                             latency_scale: float = 1.0, clock=time.time):
+    return {
+        'bme280': SimulatedBME280(latency=BME280_LATENCY * latency_scale, clock=clock),
+        'pms5003': SimulatedPMS5003(frame_interval=frame_interval, timeout_rate=pms_timeout_rate, clock=clock),
+        'gas': SimulatedGas(latency=GAS_LATENCY * latency_scale, clock=clock),
+        'ltr559': SimulatedLTR559(latency=LTR559_LATENCY * latency_scale, clock=clock),
+        'cpu_temperature': simulated_cpu_temperature
+    }
@@ -0,0 +1,119 @@
+import queue
+import threading
+from logging import Logger
+from typing import Callable, Dict, Iterable, Optional
+
+from metrics import NULL_REGISTRY
+
+DROP_OLDEST = 'drop-oldest'
+BLOCK = 'block'
+OVERFLOW_POLICIES = (DROP_OLDEST, BLOCK)
+
+_STOP = object()
+
+
+class SinkWorker:
+    def __init__(self, name: str, send: Callable, logger: Logger, max_queue_size: int = 1000,
+                 overflow_policy: str = DROP_OLDEST, metrics=NULL_REGISTRY) -> None:
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError("Unknown overflow policy: {}".format(overflow_policy))
+        self.name = name
+        self.send = send
+        self.logger = logger
+        self.overflow_policy = overflow_policy
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.dropped = 0
+        self.send_timer = metrics.histogram('stage_seconds', stage='sink', name=name)
+        self.thread = threading.Thread(target=self._run, name="sink-{}".format(name), daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    # Enqueue values without waiting for the sink, applying the overflow policy when the queue is full
+    def put(self, values):
+        if self.overflow_policy == BLOCK:
+            self.queue.put(values)
+            return
+        while True:
+            try:
+                self.queue.put_nowait(values)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                    self.queue.task_done()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def depth(self) -> int:
+        return self.queue.qsize()
+
+    def stop(self, timeout: Optional[float] = None):
+        self.queue.put(_STOP)
+        self.thread.join(timeout)
+
+    def _run(self):
+        while True:
+            values = self.queue.get()
+            try:
+                if values is _STOP:
+                    return
+                with self.send_timer.time():
+                    self.send(values)
+            except Exception as e:
+                self.logger.exception("Sink {} failed: {}".format(self.name, e))
+            finally:
+                self.queue.task_done()
+
+
+# Fans readings out to every registered sink, each one with its own bounded queue and worker thread,
+# so a slow or hanging endpoint never stalls the sampling loop
+class SinkDispatcher:
+    def __init__(self, logger: Logger, max_queue_size: int = 1000, overflow_policy: str = DROP_OLDEST,
+                 metrics=NULL_REGISTRY) -> None:
+        self.logger = logger
+        self.metrics = metrics
+        self.max_queue_size = max_queue_size
+        self.overflow_policy = overflow_policy
+        self.workers = {}
+        self.started = False
+
+    def add_sink(self, name: str, send: Callable, max_queue_size: Optional[int] = None,
+                 overflow_policy: Optional[str] = None) -> SinkWorker:
+        worker = SinkWorker(name, send, self.logger,
+                            max_queue_size=max_queue_size or self.max_queue_size,
+                            overflow_policy=overflow_policy or self.overflow_policy, metrics=self.metrics)
+        # Sinks that come up after the dispatcher started run straight away
+        if self.started:
+            worker.start()
+        self.workers[name] = worker
+        return worker
+
+    def start(self):
+        self.started = True
+        for worker in list(self.workers.values()):
+            worker.start()
+
+    # Enqueue values for all sinks, or only for the given sink names. Sinks that are still starting up are skipped.
+    def dispatch(self, values, names: Optional[Iterable[str]] = None):
+        for name in (list(self.workers) if names is None else names):
+            worker = self.workers.get(name)
+            if worker is not None:
+                worker.put(values)
+
+    def queue_depths(self) -> Dict[str, int]:
+        return {name: worker.depth() for name, worker in list(self.workers.items())}
+
+    def dropped_counts(self) -> Dict[str, int]:
+        return {name: worker.dropped for name, worker in list(self.workers.items())}
+
+    # Queue depths and dropped readings for the metrics registry
+    def collect_metrics(self):
+        for name, worker in list(self.workers.items()):
+            yield 'sink_queue_depth', 'gauge', {'sink': name}, worker.depth()
+            yield 'dropped_readings_total', 'counter', {'sink': name, 'reason': 'queue-full'}, worker.dropped
+
+    def stop(self, timeout: Optional[float] = None):
+        for worker in list(self.workers.values()):
+            worker.stop(timeout)
@@ -0,0 +1,121 @@
+import gzip
+import random
+import re
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+OPENSENSEMAP_PATH = re.compile(r'^/boxes/[^/]+/data$')
+
+
+class EndpointStats:
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.bytes = 0
+        self.points = 0
+
+    def record(self, size, points):
+        with self.lock:
+            self.requests += 1
+            self.bytes += size
+            self.points += points
+
+    def as_dict(self) -> dict:
+        return {'requests': self.requests, 'bytes': self.bytes, 'points': self.points}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    # Streamed bodies come with chunked transfer encoding instead of a length
+    def _read(self):
+        if self.headers.get('Transfer-Encoding', '').lower() != 'chunked':
+            return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        chunks = []
+        while True:
+            size = int(self.rfile.readline().split(b';')[0], 16)
+            chunk = self.rfile.read(size + 2)[:size]
+            if not size:
+                return b''.join(chunks)
+            chunks.append(chunk)
+
+    def _body(self):
+        body = self._read()
+        self.raw_size = len(body)
+        encoding = self.headers.get('Content-Encoding', '')
+        if encoding == 'gzip':
+            body = gzip.decompress(body)
+        elif encoding == 'deflate':
+            body = zlib.decompress(body)
+        return body
+
+    def _reply(self, status, body=b''):
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        server = self.server
+        path = self.path.split('?')[0]
+        body = self._body()
+        size = self.raw_size
+        if server.latency:
+            time.sleep(server.latency)
+        if server.fail_rate and server.random() < server.fail_rate:
+            self._reply(503)
+            return
+        if path == '/v1/push-sensor-data/':
+            server.stats['luftdaten'].record(size, 1)
+            self._reply(200, b'[]')
+        elif OPENSENSEMAP_PATH.match(path):
+            # Every value object or CSV line is one measurement
+            points = body.count(b'"sensor"') or body.count(b'\n') + (not body.endswith(b'\n'))
+            server.stats['opensensemap'].record(size, points)
+            self._reply(201, b'Measurements saved in box')
+        elif path in ('/write', '/api/v2/write'):
+            server.stats['influxdb'].record(size, len([line for line in body.split(b'\n') if line]))
+            self._reply(204)
+        else:
+            self._reply(404)
+
+
+# Local stand-ins for the Luftdaten push API, OpenSenseMap bulk upload and InfluxDB line protocol write endpoints,
+# counting requests, bytes and points. latency and fail_rate emulate slow or flaky uplinks.
+class StandInServer:
+    def __init__(self, port: int = 0, latency: float = 0, fail_rate: float = 0, seed: int = 0) -> None:
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', port), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.latency = latency
+        self.httpd.fail_rate = fail_rate
+        self.httpd.random = random.Random(seed).random
+        self.httpd.stats = {name: EndpointStats() for name in ('luftdaten', 'opensensemap', 'influxdb')}
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name='standin-server', daemon=True)
+
+    @property
+    def port(self) -> int:
+        return self.httpd.server_address[1]
+
+    @property
+    def url(self) -> str:
+        return 'http://127.0.0.1:{}'.format(self.port)
+
+    @property
+    def luftdaten_url(self) -> str:
+        return self.url + '/v1/push-sensor-data/'
+
+    def stats(self) -> dict:
+        return {name: stats.as_dict() for name, stats in self.httpd.stats.items()}
+
+    def start(self) -> 'StandInServer':
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
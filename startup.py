@@ -0,0 +1,106 @@
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from logging import Logger
+from typing import Callable, Optional
+
+
+# Seconds since the process was started, including the interpreter start before the script ran
+def process_age() -> Optional[float]:
+    try:
+        with open('/proc/self/stat') as f:
+            # The command name may hold spaces, the fields after it are space separated
+            start_ticks = int(f.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+    return uptime - start_ticks / os.sysconf('SC_CLK_TCK')
+
+
+# Time spent in every startup phase, and when milestones like the first sample were reached
+class StartupTimer:
+    def __init__(self, start: float = None) -> None:
+        self.start = time.perf_counter() if start is None else start
+        self.lock = threading.Lock()
+        self.phases = {}
+        self.milestones = {}
+        # What the process had already spent before the timer was created, i.e. interpreter start
+        age = process_age()
+        self.before_start = None if age is None else max(0.0, age - (time.perf_counter() - self.start))
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.phases[name] = time.perf_counter() - start
+
+    def record(self, name: str, seconds: float):
+        with self.lock:
+            self.phases[name] = seconds
+
+    # Seconds from the start to now, kept under name
+    def milestone(self, name: str) -> float:
+        elapsed = time.perf_counter() - self.start
+        with self.lock:
+            self.milestones.setdefault(name, elapsed)
+        return elapsed
+
+    def report(self) -> str:
+        with self.lock:
+            phases = ', '.join('{} {:.3f}s'.format(name, seconds) for name, seconds in self.phases.items())
+            milestones = ', '.join('{} after {:.3f}s'.format(name, seconds)
+                                   for name, seconds in self.milestones.items())
+        before = '' if self.before_start is None else 'interpreter and imports {:.3f}s, '.format(self.before_start)
+        return "Startup: {}{}; {}".format(before, phases, milestones)
+
+
+# Brings components up on worker threads, each one handed to its ready callback as soon as it is created. A failed
+# component is logged and left out, the others carry on.
+class ParallelInit:
+    def __init__(self, logger: Logger, timer: StartupTimer, max_workers: int = 8) -> None:
+        self.logger = logger
+        self.timer = timer
+        # Components may wait for the ones they depend on, so there is a worker for each of them
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='init')
+        self.futures = {}
+
+    def submit(self, name: str, create: Callable, ready: Callable = None, after: Optional[str] = None) -> Future:
+        dependency = self.futures.get(after) if after else None
+
+        def run():
+            if dependency is not None:
+                dependency.result()
+            with self.timer.phase(name):
+                component = create()
+            if ready is not None:
+                ready(component)
+            return component
+
+        future = self.futures[name] = self.executor.submit(run)
+        future.add_done_callback(lambda f: self._done(name, f))
+        return future
+
+    def _done(self, name, future):
+        error = future.exception()
+        if error is not None:
+            self.logger.error("{} failed to start: {}".format(name, error))
+
+    # Wait for every component in the background and log the startup report once all are up
+    def report_when_done(self):
+        def wait():
+            for future in list(self.futures.values()):
+                try:
+                    future.result()
+                except Exception:
+                    pass
+            self.timer.milestone('all components')
+            self.logger.info(self.timer.report())
+            self.executor.shutdown(wait=False)
+
+        threading.Thread(target=wait, name='init-report', daemon=True).start()
@@ -0,0 +1,66 @@
+import socket
+import time
+from logging import Logger
+
+from batching_sink import PartialWriteError
+from station_protocol import MAX_DATAGRAM, encode_frames, frame_readings
+from uplink import HTTP_REQUEST_OVERHEAD, UDP_DATAGRAM_OVERHEAD, UplinkTraffic
+
+UDP = 'udp'
+HTTP = 'http'
+TRANSPORTS = (UDP, HTTP)
+GATEWAY_UDP_PORT = 7711
+GATEWAY_HTTP_PORT = 7712
+# Over HTTP a whole batch goes in one request
+HTTP_MAX_FRAME = 1024 * 1024
+
+
+# Streams readings to a gateway in the binary station protocol, instead of writing to InfluxDB and OpenSenseMap
+class StationClient:
+    def __init__(self, station_id: str, host: str, logger: Logger, transport: str = UDP, port: int = None,
+                 session=None, traffic: UplinkTraffic = None) -> None:
+        if transport not in TRANSPORTS:
+            raise ValueError("Unknown gateway transport: {}".format(transport))
+        self.station_id = station_id
+        self.logger = logger
+        self.transport = transport
+        self.sequence = 0
+        self.frames_sent = 0
+        self.bytes_sent = 0
+        self.traffic = traffic or UplinkTraffic('gateway', request_overhead=UDP_DATAGRAM_OVERHEAD
+                                                if transport == UDP else HTTP_REQUEST_OVERHEAD)
+        if transport == UDP:
+            self.address = (host, port or GATEWAY_UDP_PORT)
+            self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        else:
+            self.url = 'http://{}:{}/readings'.format(host, port or GATEWAY_HTTP_PORT)
+            self.session = session
+
+    # UDP is fire and forget, readings lost on the way show up as sequence gaps on the gateway. A frame failing to
+    # send raises PartialWriteError with the readings of the frames before it, so they are not sent twice.
+    def write_values(self, values):
+        frames = encode_frames(self.station_id, self.sequence, values,
+                               max_size=MAX_DATAGRAM if self.transport == UDP else HTTP_MAX_FRAME)
+        written = 0
+        for frame in frames:
+            start = time.perf_counter()
+            try:
+                if self.transport == UDP:
+                    self.socket.sendto(frame, self.address)
+                else:
+                    resp = self.session.post(self.url, data=frame,
+                                             headers={'Content-Type': 'application/octet-stream'})
+                    resp.raise_for_status()
+            except Exception as e:
+                if not written:
+                    raise
+                raise PartialWriteError(e, written=written) from e
+            self.traffic.record(frame_readings(frame), len(frame), len(frame), time.perf_counter() - start)
+            written += frame_readings(frame)
+            self.sequence += 1
+            self.frames_sent += 1
+            self.bytes_sent += len(frame)
+
+    def close(self):
+        if self.transport == UDP:
+            self.socket.close()
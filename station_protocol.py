@@ -0,0 +1,90 @@
+import struct
+from typing import Iterable, List, Sequence, Tuple
+
+from reading_buffer import FIELDS
+
+# Frame: magic, version, station id length, readings, sequence number, then the station id. Every reading is its
+# timestamp in nanoseconds, a bitmask of the fields present and those fields as float32, in FIELDS order.
+MAGIC = b'LD'
+VERSION = 1
+HEADER = struct.Struct('<2sBBHI')
+READING_HEADER = struct.Struct('<qH')
+FIELD_VALUE = struct.Struct('<f')
+# Fits a UDP datagram in an Ethernet frame without IP fragmentation
+MAX_DATAGRAM = 1400
+MAX_STATION_ID = 255
+
+
+class ProtocolError(ValueError):
+    pass
+
+
+def _encode_reading(values, fields):
+    mask = 0
+    present = []
+    for i, field in enumerate(fields):
+        value = values.get(field)
+        # Missing sensors and NaN are left out, the mask tells which fields follow
+        if value is not None and value == value:
+            mask |= 1 << i
+            present.append(value)
+    return READING_HEADER.pack(values['ts'], mask) + struct.pack('<{}f'.format(len(present)), *present)
+
+
+def _frame(station, sequence, body):
+    return HEADER.pack(MAGIC, VERSION, len(station), len(body), sequence & 0xFFFFFFFF) + station + b''.join(body)
+
+
+# Number of readings in a frame, from its header
+def frame_readings(frame: bytes) -> int:
+    return HEADER.unpack_from(frame)[3]
+
+
+# Split readings into frames of at most max_size bytes, numbered from sequence on
+def encode_frames(station_id: str, sequence: int, readings: Iterable, max_size: int = MAX_DATAGRAM,
+                  fields: Sequence[str] = FIELDS) -> List[bytes]:
+    station = station_id.encode()
+    if len(station) > MAX_STATION_ID:
+        raise ProtocolError("Station id longer than {} bytes: {}".format(MAX_STATION_ID, station_id))
+    frames = []
+    body = []
+    size = HEADER.size + len(station)
+    for values in readings:
+        reading = _encode_reading(values, fields)
+        if body and (size + len(reading) > max_size or len(body) == 0xFFFF):
+            frames.append(_frame(station, sequence, body))
+            sequence += 1
+            body = []
+            size = HEADER.size + len(station)
+        body.append(reading)
+        size += len(reading)
+    if body:
+        frames.append(_frame(station, sequence, body))
+    return frames
+
+
+# Returns the station id, the frame sequence number and the readings as dicts
+def decode_frame(data: bytes, fields: Sequence[str] = FIELDS) -> Tuple[str, int, List[dict]]:
+    if len(data) < HEADER.size:
+        raise ProtocolError("Frame too short: {} bytes".format(len(data)))
+    magic, version, station_length, count, sequence = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ProtocolError("Unknown frame {!r} version {}".format(magic, version))
+    position = HEADER.size + station_length
+    station_id = bytes(data[HEADER.size:position]).decode()
+    readings = []
+    try:
+        for _ in range(count):
+            ts, mask = READING_HEADER.unpack_from(data, position)
+            position += READING_HEADER.size
+            values = {'ts': ts}
+            for i, field in enumerate(fields):
+                if mask & (1 << i):
+                    values[field] = round(FIELD_VALUE.unpack_from(data, position)[0], 4)
+                    position += FIELD_VALUE.size
+            readings.append(values)
+    except struct.error as e:
+        raise ProtocolError("Truncated frame from {}: {}".format(station_id, e))
+    if position != len(data):
+        raise ProtocolError("{} trailing bytes in frame from {}".format(len(data) - position, station_id))
+    return station_id, sequence, readings
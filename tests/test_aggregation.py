@@ -0,0 +1,81 @@
+import math
+import os
+import random
+import statistics
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from aggregation import NANOS, P2Quantile, WindowAggregator  # noqa: E402
+
+
+def test_p2_estimates_follow_exact_quantiles():
+    rng = random.Random(42)
+    samples = {'gauss': [rng.gauss(20, 5) for _ in range(5000)],
+               'skewed': [rng.expovariate(0.1) for _ in range(5000)]}
+    for name, sample in samples.items():
+        exact = statistics.quantiles(sample, n=100, method='inclusive')
+        spread = statistics.pstdev(sample)
+        for p in (0.1, 0.5, 0.9, 0.99):
+            quantile = P2Quantile(p)
+            for x in sample:
+                quantile.add(x)
+            assert abs(quantile.value() - exact[int(p * 100) - 1]) < 0.05 * spread, (name, p)
+
+
+def test_p2_with_few_values_picks_from_them():
+    quantile = P2Quantile(0.5)
+    assert math.isnan(quantile.value())
+    for x in (3.0, 1.0, 2.0):
+        quantile.add(x)
+    assert quantile.value() == 2.0
+
+
+def readings(seconds, step=10, field='t'):
+    return [{field: float(s), 'ts': s * NANOS} for s in range(0, seconds + 1, step)]
+
+
+def test_tumbling_window_closes_on_its_end():
+    aggregator = WindowAggregator(60, fields=('t',), quantiles=(0.5,))
+    closed = [window for values in readings(59) for window in aggregator.add(values)]
+    assert closed == []
+    # A reading exactly at the end of a window belongs to the next one
+    window, = aggregator.add({'t': 60.0, 'ts': 60 * NANOS})
+    assert window['ts'] == 60 * NANOS
+    assert (window['count'], window['t'], window['t_min'], window['t_max']) == (6, 25.0, 0.0, 50.0)
+    assert window['t_p50'] in (20.0, 30.0)
+    window, = aggregator.flush()
+    assert (window['ts'], window['count'], window['t']) == (120 * NANOS, 1, 60.0)
+
+
+def test_sliding_windows_overlap_by_step():
+    aggregator = WindowAggregator(60, 20, fields=('t',), quantiles=())
+    closed = [window for values in readings(120) for window in aggregator.add(values)]
+    assert [window['ts'] // NANOS for window in closed] == [20, 40, 60, 80, 100, 120]
+    full = closed[2:]
+    assert [window['count'] for window in full] == [6, 6, 6, 6]
+    assert [(window['t_min'], window['t_max']) for window in full] == [(0, 50), (20, 70), (40, 90), (60, 110)]
+
+
+def test_late_readings_are_counted_and_skipped():
+    aggregator = WindowAggregator(60, fields=('t',), quantiles=())
+    for values in readings(60):
+        aggregator.add(values)
+    assert aggregator.add({'t': 1000.0, 'ts': 30 * NANOS}) == []
+    assert aggregator.late == 1
+    window, = aggregator.flush()
+    assert window['t_max'] == 60.0
+
+
+def test_missing_and_nan_fields_are_left_out():
+    aggregator = WindowAggregator(60, fields=('t', 'pm'), quantiles=(), counts=True)
+    aggregator.add({'t': 1.0, 'ts': 0})
+    aggregator.add({'t': 2.0, 'pm': float('nan'), 'ts': 10 * NANOS})
+    aggregator.add({'t': 3.0, 'pm': 5.0, 'ts': 20 * NANOS})
+    window, = aggregator.flush()
+    assert (window['count'], window['t_count'], window['pm_count']) == (3, 3, 1)
+    assert (window['t'], window['pm']) == (2.0, 5.0)
+    empty = WindowAggregator(60, fields=('t', 'pm'), quantiles=())
+    empty.add({'t': 1.0, 'ts': 0})
+    window, = empty.flush()
+    assert math.isnan(window['pm']) and math.isnan(window['pm_min'])
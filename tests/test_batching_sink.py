@@ -0,0 +1,94 @@
+import logging
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from batching_sink import AdaptiveFlushPolicy, FlushPolicy, ListBatchingSink, PartialWriteError  # noqa: E402
+from reading_buffer import BufferedBlockSink, ReadingBuffer  # noqa: E402
+from reading_spool import ReadingSpool, SpooledSink  # noqa: E402
+from uplink import UplinkTraffic  # noqa: E402
+
+LOGGER = logging.getLogger('test')
+READINGS = [{'temperature': float(i), 'ts': i} for i in range(10)]
+
+
+# Writes the first `fail_after` readings of a batch once, then fails, like chunked uploads failing halfway
+class FlakyWriter:
+    def __init__(self, fail_after: int) -> None:
+        self.fail_after = fail_after
+        self.written = []
+
+    def __call__(self, readings):
+        readings = [dict(values) for values in readings]
+        if self.fail_after is not None:
+            self.written += readings[:self.fail_after]
+            written, self.fail_after = self.fail_after, None
+            raise PartialWriteError(IOError('server error'), written=written)
+        self.written += readings
+
+
+def written_ts(writer):
+    return [values['ts'] for values in writer.written]
+
+
+def test_list_sink_retries_unwritten_readings():
+    writer = FlakyWriter(4)
+    sink = ListBatchingSink('test', writer, LOGGER, FlushPolicy(max_count=len(READINGS)))
+    for values in READINGS:
+        sink.send(values)
+    assert sink.pending_count() == 6
+    sink.close()
+    assert written_ts(writer) == list(range(10))
+
+
+def test_block_sink_retries_unwritten_readings():
+    writer = FlakyWriter(4)
+    buffer = ReadingBuffer(capacity=100, fields=('temperature',))
+    sink = BufferedBlockSink('test', buffer, writer, LOGGER, FlushPolicy(max_count=len(READINGS)))
+    for values in READINGS:
+        buffer.append(values)
+        sink.send(values)
+    assert sink.pending_count() == 6
+    sink.close()
+    assert written_ts(writer) == list(range(10))
+
+
+def test_spooled_sink_acknowledges_written_readings(tmp_path):
+    writer = FlakyWriter(4)
+    spool = ReadingSpool(str(tmp_path))
+    sink = SpooledSink(spool.consumer('test'), writer, LOGGER, FlushPolicy(max_count=len(READINGS)))
+    for values in READINGS:
+        spool.append(values)
+        sink.send(values)
+    assert len(spool.consumer('test').read(100)[0]) == 6
+    sink.close()
+    assert written_ts(writer) == list(range(10))
+    spool.close()
+
+
+def test_adaptive_policy_keeps_initial_count_until_measured():
+    traffic = UplinkTraffic('test')
+    policy = AdaptiveFlushPolicy(traffic, initial_count=100)
+    # 1800 readings an hour
+    assert policy.reason(10, 0, 18) is None
+    assert policy.max_count == 100
+
+
+def test_adaptive_policy_follows_measured_traffic():
+    traffic = UplinkTraffic('test', request_overhead=500)
+    # 15 bytes per reading after compression
+    traffic.record(30, 3000, 450, 0.15)
+    policy = AdaptiveFlushPolicy(traffic, initial_count=100)
+    policy.reason(10, 0, 18)
+    # The overhead stays under a tenth of the readings' bytes
+    assert policy.max_count == 334
+
+    policy = AdaptiveFlushPolicy(traffic, bytes_per_hour=40000, initial_count=100)
+    policy.reason(10, 0, 18)
+    assert policy.max_count == 70
+    assert policy.reason(70, 0, 140) == 'count'
+
+    policy = AdaptiveFlushPolicy(traffic, bytes_per_hour=20000, max_count=1000, initial_count=100)
+    policy.reason(10, 0, 18)
+    assert policy.over_budget and policy.max_count == 1000
@@ -0,0 +1,29 @@
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from circuit_breaker import CLOSED, OPEN, CircuitBreaker  # noqa: E402
+
+LOGGER = logging.getLogger('test')
+
+
+def test_reset_holds_back_closed_breakers_until_their_resume_time():
+    breakers = [CircuitBreaker(str(i), LOGGER) for i in range(20)]
+    for breaker in breakers:
+        breaker.reset(jitter=60)
+    assert not any(breaker.allow() for breaker in breakers)
+    resume_times = {breaker.resume_at for breaker in breakers}
+    assert len(resume_times) == len(breakers)
+    assert all(time.monotonic() < resume_at <= time.monotonic() + 60 for resume_at in resume_times)
+    assert all(breaker.state == CLOSED for breaker in breakers)
+
+
+def test_reset_shortens_backoff_of_open_breakers():
+    breaker = CircuitBreaker('test', LOGGER, failure_threshold=1, base_delay=600)
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    breaker.reset(jitter=0)
+    assert breaker.allow()
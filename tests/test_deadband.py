@@ -0,0 +1,74 @@
+import math
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from aggregation import NANOS, WindowAggregator  # noqa: E402
+from deadband import Deadband, DeadbandFilter  # noqa: E402
+
+NAN = float('nan')
+
+
+def sent(records, field):
+    return [record[field] for record in records if not math.isnan(record.get(field, NAN))]
+
+
+def run(deadband_filter, values, field='pressure', step=2):
+    records = []
+    for i, x in enumerate(values):
+        records += deadband_filter.add({field: x, 'ts': i * step * NANOS})
+    return records
+
+
+def test_values_on_the_threshold_are_suppressed():
+    deadband_filter = DeadbandFilter('test', {'pressure': Deadband(absolute=0.5)})
+    records = run(deadband_filter, [1000.0, 1000.5, 999.5, 1000.5001, 1000.0001, 1000.0])
+    # 1000.5001 moved past the deadband from 1000.0, 1000.0 only 0.5001 back from it
+    assert sent(records, 'pressure') == [1000.0, 1000.5001, 1000.0]
+
+
+def test_larger_of_absolute_and_relative_applies():
+    deadband = Deadband(absolute=1.0, relative=0.1)
+    assert deadband.threshold(5.0) == 1.0
+    assert deadband.threshold(-50.0) == 5.0
+    deadband_filter = DeadbandFilter('test', {'lux': deadband})
+    records = run(deadband_filter, [5.0, 5.9, 6.1, 100.0, 109.0, 112.0], field='lux')
+    assert sent(records, 'lux') == [5.0, 6.1, 100.0, 112.0]
+
+
+def test_heartbeat_sends_unchanged_values():
+    deadband_filter = DeadbandFilter('test', {'pressure': Deadband(absolute=1.0),
+                                              'humidity': Deadband(absolute=1.0, heartbeat=20)}, heartbeat=60)
+    records = []
+    for i in range(61):
+        records += deadband_filter.add({'pressure': 1000.0, 'humidity': 40.0, 'ts': i * 2 * NANOS})
+    # Sent at 0s, then once heartbeat seconds went by without sending
+    assert [record['ts'] // NANOS for record in records if record['pressure'] == 1000.0] == [0, 60, 120]
+    assert [record['ts'] // NANOS for record in records if record['humidity'] == 40.0] == [0, 20, 40, 60, 80, 100,
+                                                                                            120]
+    # Readings where nothing is sent are dropped
+    assert len(records) == 7
+
+
+def test_nan_and_missing_values_are_skipped():
+    deadband_filter = DeadbandFilter('test', {'pressure': Deadband(absolute=0.5)})
+    records = run(deadband_filter, [1000.0, NAN, NAN, 1000.2, 1000.6])
+    assert sent(records, 'pressure') == [1000.0, 1000.6]
+    assert (deadband_filter.values, deadband_filter.values_sent) == (3, 2)
+    # A reading holding only NaN is dropped, fields without a deadband are always sent
+    assert deadband_filter.add({'pressure': NAN, 'ts': 100 * NANOS}) == []
+    record, = deadband_filter.add({'pressure': 1000.6, 'temperature': 21.0, 'ts': 102 * NANOS})
+    assert math.isnan(record['pressure']) and record['temperature'] == 21.0
+    assert deadband_filter.reduction() == 1 - 3 / 5
+
+
+def test_windows_of_the_source_are_filtered():
+    deadband_filter = DeadbandFilter('test', {'pressure': Deadband(absolute=1.0)},
+                                     source=WindowAggregator(10, fields=('pressure',), quantiles=()))
+    records = run(deadband_filter, [1000.0] * 20 + [1005.0] * 10)
+    # count, min and max have no deadband and are sent with every window
+    assert [record['ts'] // NANOS for record in records] == [10, 20, 30, 40, 50]
+    assert [record['ts'] // NANOS for record in records if not math.isnan(record['pressure'])] == [10, 50]
+    assert sent(records, 'pressure') == [1000.0, 1005.0]
+    assert deadband_filter.output_fields() == ['count', 'pressure', 'pressure_min', 'pressure_max']
@@ -0,0 +1,57 @@
+import logging
+import math
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from batching_sink import FlushPolicy  # noqa: E402
+from line_protocol import LineProtocolEncoder  # noqa: E402
+from reading_spool import ReadingSpool, SpooledSink  # noqa: E402
+
+LOGGER = logging.getLogger('test')
+
+
+# Readings before the PMS5003 and gas sensor are up, as the reader merges them, and one after a deadband
+PARTIAL_READINGS = [
+    {'temperature': 21.5, 'humidity': 40.25, 'pressure': 1013.5, 'ts': 1000000000},
+    {'temperature': 21.5, 'humidity': 40.25, 'pressure': 1013.5, 'oxidising': 1.5, 'reducing': 2.5, 'nh3': 0.5,
+     'ts': 2000000000},
+    {'P1.0': 3.0, 'ts': 3000000000},
+]
+
+
+def test_encode_partial_readings():
+    lines = LineProtocolEncoder().encode(PARTIAL_READINGS).decode().split('\n')
+    assert lines == [
+        'weather,location=acacias temperature=21.50,humidity=40.25,pressure=1013.50 1000000000',
+        'weather,location=acacias temperature=21.50,humidity=40.25,pressure=1013.50 2000000000',
+        'particles,location=acacias P1=3.0 3000000000',
+        'gas,location=acacias oxidising=1.5000,reducing=2.5000,nh3=0.5000 2000000000',
+    ]
+
+
+def test_spool_replays_partial_readings(tmp_path):
+    spool = ReadingSpool(str(tmp_path))
+    for values in PARTIAL_READINGS:
+        spool.append(values)
+    payloads = []
+    encoder = LineProtocolEncoder()
+    sink = SpooledSink(spool.consumer('influxdb'), lambda records: payloads.append(encoder.encode(records)), LOGGER,
+                       FlushPolicy(max_count=len(PARTIAL_READINGS)))
+    for values in PARTIAL_READINGS:
+        sink.send(values)
+    assert len(payloads) == 1
+    assert sink.consumer.pending() == 0
+    assert payloads[0].count(b'\n') == 3
+    spool.close()
+
+
+def test_non_finite_columns_take_row_path():
+    readings = [{'temperature': 1e308, 'humidity': 1e308, 'pressure': 1e308, 'ts': 1},
+                {'temperature': 1e308, 'humidity': math.inf, 'pressure': -math.inf, 'ts': 2},
+                {'temperature': 1e308, 'humidity': -math.inf, 'pressure': math.inf, 'ts': 3}]
+    lines = LineProtocolEncoder().encode_lines(readings)
+    assert lines[0].startswith('weather,location=acacias temperature=')
+    assert [line.rsplit(' ', 1)[1] for line in lines] == ['1', '2', '3']
+    assert 'humidity' not in lines[1] and 'pressure' not in lines[2]
@@ -0,0 +1,35 @@
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from log_setup import BufferedFileHandler, ByteBoundedQueue, LazyQueueHandler, LogWriter  # noqa: E402
+
+
+def test_last_records_are_flushed_when_the_log_goes_quiet(tmp_path):
+    path = str(tmp_path / 'test.log')
+    handler = BufferedFileHandler(path, flush_interval=0.2, when='d')
+    writer = LogWriter(ByteBoundedQueue(), handler, idle_interval=0.2)
+    logger = logging.getLogger('test.quiet')
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    logger.addHandler(LazyQueueHandler(writer.queue))
+    writer.start()
+    try:
+        # The warning is flushed right away, the info records after it are only buffered
+        logger.warning('warning')
+        logger.info('info 1')
+        logger.info('info 2')
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            with open(path) as f:
+                if f.read().count('\n') == 3:
+                    break
+            time.sleep(0.05)
+        with open(path) as f:
+            assert f.read().count('\n') == 3
+    finally:
+        writer.stop()
+        handler.close()
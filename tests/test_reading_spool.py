@@ -0,0 +1,84 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from reading_spool import SEGMENT_SUFFIX, ReadingSpool  # noqa: E402
+
+READINGS = [{'temperature': 20.0 + i, 'ts': i} for i in range(100)]
+
+
+def segments(path):
+    return sorted(name for name in os.listdir(path) if name.endswith(SEGMENT_SUFFIX))
+
+
+def test_segments_roll_over_and_are_compacted_once_acknowledged(tmp_path):
+    spool = ReadingSpool(str(tmp_path), segment_size=512)
+    consumer = spool.consumer('influxdb')
+    for values in READINGS:
+        spool.append(values)
+    assert len(segments(tmp_path)) > 5
+    records, offset = consumer.read(1000)
+    assert records == READINGS
+    consumer.ack(offset)
+    # Only the active segment is left
+    assert len(segments(tmp_path)) == 1
+    spool.close()
+
+
+def test_compaction_waits_for_the_slowest_consumer(tmp_path):
+    spool = ReadingSpool(str(tmp_path), segment_size=512)
+    fast, slow = spool.consumer('influxdb'), spool.consumer('opensensemap')
+    for values in READINGS:
+        spool.append(values)
+    fast.ack(fast.read(1000)[1])
+    assert slow.read(1000)[0] == READINGS
+    spool.close()
+
+
+def test_consumer_offsets_persist_across_reopen(tmp_path):
+    spool = ReadingSpool(str(tmp_path), segment_size=512)
+    influxdb, opensensemap = spool.consumer('influxdb'), spool.consumer('opensensemap')
+    for values in READINGS:
+        spool.append(values)
+    influxdb.ack(influxdb.read(30)[1])
+    opensensemap.ack(opensensemap.read(70)[1])
+    spool.close()
+
+    spool = ReadingSpool(str(tmp_path), segment_size=512)
+    assert spool.consumer('influxdb').read(1000)[0] == READINGS[30:]
+    assert spool.consumer('opensensemap').read(1000)[0] == READINGS[70:]
+    spool.close()
+
+
+def test_truncated_tail_record_is_dropped_on_reopen(tmp_path):
+    spool = ReadingSpool(str(tmp_path))
+    for values in READINGS[:10]:
+        spool.append(values)
+    spool.close()
+    # A crash in the middle of the last write
+    path = os.path.join(str(tmp_path), segments(tmp_path)[-1])
+    with open(path, 'r+b') as f:
+        f.truncate(os.path.getsize(path) - 5)
+
+    spool = ReadingSpool(str(tmp_path))
+    consumer = spool.consumer('influxdb')
+    assert consumer.read(1000)[0] == READINGS[:9]
+    spool.append(READINGS[10])
+    assert consumer.read(1000)[0] == READINGS[:9] + [READINGS[10]]
+    spool.close()
+
+
+def test_corrupted_tail_record_is_dropped_on_reopen(tmp_path):
+    spool = ReadingSpool(str(tmp_path))
+    for values in READINGS[:10]:
+        spool.append(values)
+    spool.close()
+    path = os.path.join(str(tmp_path), segments(tmp_path)[-1])
+    with open(path, 'r+b') as f:
+        f.seek(os.path.getsize(path) - 3)
+        f.write(b'xxx')
+
+    spool = ReadingSpool(str(tmp_path))
+    assert spool.consumer('influxdb').read(1000)[0] == READINGS[:9]
+    spool.close()
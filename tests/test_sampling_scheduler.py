@@ -0,0 +1,53 @@
+import logging
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from enviroplus_reader import EnviroPlusReader  # noqa: E402
+from sampling_scheduler import SamplingScheduler, SensorTask  # noqa: E402
+
+LOGGER = logging.getLogger('test')
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def failing():
+    raise OSError('sensor gone')
+
+
+def snapshots(tasks, count):
+    clock = FakeClock()
+    reader = EnviroPlusReader(LOGGER, create_devices=False, cpu_temperature=failing)
+    scheduler = SamplingScheduler(tasks, reader.merge, LOGGER, tick=2, clock=clock, sleep=clock.sleep)
+    run = scheduler.run()
+    return [next(run) for _ in range(count)]
+
+
+def weather():
+    return {'raw_temperature': 20.0, 'pressure': 1013.0, 'humidity': 40.0}
+
+
+def test_snapshots_go_on_without_cpu_temperature():
+    values = snapshots([SensorTask('cpu', failing, 10), SensorTask('weather', weather, 1)], 5)
+    assert [snapshot['temperature'] for snapshot in values] == [20.0] * 5
+
+
+def test_failed_sensor_values_are_not_repeated():
+    reads = iter([{'P2.5': 5.0}])
+
+    def particles():
+        return next(reads)
+
+    values = snapshots([SensorTask('weather', weather, 1), SensorTask('particles', particles, 1)], 3)
+    assert values[0]['P2.5'] == 5.0
+    assert 'P2.5' not in values[1] and 'P2.5' not in values[2]
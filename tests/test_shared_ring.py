@@ -0,0 +1,75 @@
+import multiprocessing
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from shared_ring import COUNTER, DATA_OFFSET, SharedRingReader, SharedRingWriter  # noqa: E402
+
+FIELDS = tuple('f{}'.format(i) for i in range(16))
+
+
+def ring_name(test):
+    return 'luftdaten-test-{}-{}'.format(test, os.getpid())
+
+
+# Every field of reading n holds n, a record mixing two readings has fields that differ
+def reading(n):
+    values = {field: float(n) for field in FIELDS}
+    values['ts'] = n
+    return values
+
+
+def write_readings(writer, count, ready):
+    ready.set()
+    for n in range(count):
+        writer.append(reading(n))
+
+
+def test_reader_never_returns_torn_records():
+    writer = SharedRingWriter(ring_name('torn'), capacity=16, fields=FIELDS)
+    reader = SharedRingReader(writer.name)
+    # The writer is handed over as is, which needs a forked process
+    context = multiprocessing.get_context('fork')
+    ready = context.Event()
+    count = 200000
+    process = context.Process(target=write_readings, args=(writer, count, ready))
+    process.start()
+    try:
+        assert ready.wait(10)
+        cursor = last = -1
+        returned = 0
+        deadline = time.monotonic() + 30
+        while process.is_alive() or cursor < reader.published():
+            assert time.monotonic() < deadline
+            readings, cursor = reader.read(max(cursor, 0), max_records=8)
+            for values in readings:
+                assert all(values[field] == values['ts'] for field in FIELDS), values
+                assert values['ts'] > last
+                last = values['ts']
+            returned += len(readings)
+        process.join(10)
+        # The small ring laps a reader that is behind, those readings are counted as lost, never returned torn
+        assert returned + reader.lost == count
+        assert returned > 0
+    finally:
+        process.join(10)
+        reader.close()
+        writer.close()
+
+
+def test_slot_being_written_is_skipped():
+    writer = SharedRingWriter(ring_name('odd'), capacity=4, fields=FIELDS)
+    reader = SharedRingReader(writer.name)
+    try:
+        for n in range(3):
+            writer.append(reading(n))
+        # The writer stopped in the middle of reading 1
+        COUNTER.pack_into(writer.buffer, DATA_OFFSET + writer.record.size, 3)
+        readings, cursor = reader.read(0)
+        assert [values['ts'] for values in readings] == [0, 2]
+        assert (cursor, reader.lost) == (3, 1)
+    finally:
+        reader.close()
+        writer.close()
@@ -0,0 +1,78 @@
+import logging
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from sink_dispatcher import SinkDispatcher  # noqa: E402
+
+LOGGER = logging.getLogger('test')
+
+
+# Sink holding its worker until released, so readings pile up in its queue
+class GatedSink:
+    def __init__(self) -> None:
+        self.gate = threading.Event()
+        self.started = threading.Event()
+        self.received = []
+
+    def __call__(self, values):
+        self.started.set()
+        self.gate.wait(5)
+        self.received.append(values)
+
+
+def test_full_queue_drops_oldest_and_counts_them():
+    dispatcher = SinkDispatcher(LOGGER, max_queue_size=5)
+    slow, fast = GatedSink(), []
+    dispatcher.add_sink('slow', slow)
+    dispatcher.add_sink('fast', fast.append, max_queue_size=100)
+    dispatcher.start()
+    dispatcher.dispatch(0)
+    # The slow sink's worker holds reading 0, its queue takes 5 more
+    assert slow.started.wait(5)
+    for i in range(1, 21):
+        dispatcher.dispatch(i)
+    assert dispatcher.dropped_counts() == {'slow': 15, 'fast': 0}
+    assert dispatcher.queue_depths()['slow'] == 5
+    slow.gate.set()
+    dispatcher.stop(5)
+    assert slow.received == [0, 16, 17, 18, 19, 20]
+    assert fast == list(range(21))
+    assert ('dropped_readings_total', 'counter', {'sink': 'slow', 'reason': 'queue-full'}, 15) in list(
+        dispatcher.collect_metrics())
+
+
+def test_stop_drains_every_worker():
+    dispatcher = SinkDispatcher(LOGGER, max_queue_size=1000)
+    sinks = {name: GatedSink() for name in ('influxdb', 'opensensemap', 'luftdaten')}
+    for name, sink in sinks.items():
+        dispatcher.add_sink(name, sink)
+    dispatcher.start()
+    for i in range(50):
+        dispatcher.dispatch(i)
+    for sink in sinks.values():
+        sink.gate.set()
+    dispatcher.stop(5)
+    for name, sink in sinks.items():
+        assert sink.received == list(range(50)), name
+        assert not dispatcher.workers[name].thread.is_alive()
+    assert dispatcher.dropped_counts() == dict.fromkeys(sinks, 0)
+
+
+def test_failing_sink_does_not_stop_its_worker():
+    received = []
+
+    def send(values):
+        if values == 1:
+            raise IOError('endpoint down')
+        received.append(values)
+
+    dispatcher = SinkDispatcher(LOGGER)
+    dispatcher.add_sink('flaky', send)
+    dispatcher.start()
+    for i in range(3):
+        dispatcher.dispatch(i)
+    dispatcher.stop(5)
+    assert received == [0, 2]
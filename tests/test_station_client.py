@@ -0,0 +1,40 @@
+import logging
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from batching_sink import FlushPolicy, ListBatchingSink  # noqa: E402
+from station_client import StationClient  # noqa: E402
+from station_protocol import decode_frame  # noqa: E402
+
+LOGGER = logging.getLogger('test')
+
+
+# Socket whose second sendto fails once, like a route going away in the middle of a batch
+class FlakySocket:
+    def __init__(self) -> None:
+        self.calls = 0
+        self.frames = []
+
+    def sendto(self, frame, _address):
+        self.calls += 1
+        if self.calls == 2:
+            raise OSError('Network is unreachable')
+        self.frames.append(frame)
+
+    def close(self):
+        pass
+
+
+def test_frames_sent_before_a_failure_are_not_sent_again():
+    client = StationClient('test', '127.0.0.1', LOGGER)
+    client.socket.close()
+    client.socket = FlakySocket()
+    readings = [{'temperature': float(i), 'ts': i} for i in range(300)]
+    sink = ListBatchingSink('gateway', client.write_values, LOGGER, FlushPolicy(max_count=len(readings)))
+    for values in readings:
+        sink.send(values)
+    sink.close()
+    sent = [values['ts'] for frame in client.socket.frames for values in decode_frame(frame)[2]]
+    assert sent == list(range(300))
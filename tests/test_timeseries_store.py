@@ -0,0 +1,83 @@
+import os
+import random
+import struct
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from timeseries_store import (TimeSeriesStore, decode_floats, decode_timestamps, encode_floats,  # noqa: E402
+                              encode_timestamps)
+
+NANOS = 1000 * 1000 * 1000
+# Not a whole number of milliseconds, like time.time_ns()
+BASE = 1587370000 * NANOS + 123456
+
+
+def test_query_bounds_include_start_and_exclude_end(tmp_path):
+    store = TimeSeriesStore(str(tmp_path), fields=('temperature',), block_size=50, precision={})
+    for i in range(120):
+        store.append({'temperature': i, 'ts': BASE + 2 * i * NANOS})
+    # Blocks of 50 readings on disk, the last 20 still pending
+    columns = store.query(BASE, BASE + 200 * NANOS)
+    assert columns['temperature'] == [float(i) for i in range(100)]
+    columns = store.query(BASE + 200 * NANOS, BASE + 240 * NANOS)
+    assert columns['temperature'] == [float(i) for i in range(100, 120)]
+    assert all(isinstance(x, float) for x in columns['temperature'])
+    store.close()
+
+
+def timestamps_round_trip(ts):
+    assert decode_timestamps(encode_timestamps(ts), len(ts)) == ts
+
+
+def test_timestamps_round_trip_every_delta_of_delta_width():
+    timestamps_round_trip([1587370000000])
+    timestamps_round_trip([1587370000000 + 2000 * i for i in range(100)])
+    for dod in (1, -63, 64, 65, -255, 256, 257, -2047, 2048, 2049, -(1 << 31) + 1, 1 << 31, (1 << 31) + 1,
+                -(1 << 31), 1 << 40, -(1 << 40)):
+        timestamps_round_trip([1587370000000, 1587370002000, 1587370004000 + dod, 1587370006000 + dod])
+
+
+def test_timestamps_round_trip_large_gaps_and_negative_values():
+    timestamps_round_trip([0, 1 << 50, -(1 << 50), 5, 5, 5])
+    timestamps_round_trip([-1587370000000, 0, 1587370000000 + 86400000 * 365])
+    rng = random.Random(7)
+    ts = [1587370000000]
+    for _ in range(1000):
+        # Mostly regular, with jitter and an outage of up to a month now and then
+        ts.append(ts[-1] + 2000 + rng.randint(-50, 50) + (rng.randint(0, 30 * 86400000) if rng.random() < 0.01
+                                                          else 0))
+    timestamps_round_trip(ts)
+
+
+def float_bits(values):
+    return [struct.pack('<d', x) for x in values]
+
+
+def floats_round_trip(values):
+    assert float_bits(decode_floats(encode_floats(values), len(values))) == float_bits(values)
+
+
+def test_floats_round_trip_special_values():
+    nan, inf = float('nan'), float('inf')
+    floats_round_trip([nan])
+    floats_round_trip([nan, nan, 21.5, nan, 21.5, 21.75])
+    floats_round_trip([inf, -inf, 0.0, -0.0, inf, 5e-324, -1.7976931348623157e308, nan])
+    floats_round_trip([1.0, 1.0, 1.0, 2.0, 2.0 ** 52, 2.0 ** -52, -0.0])
+    rng = random.Random(3)
+    floats_round_trip([round(rng.gauss(1013, 5), 2) for _ in range(1000)])
+    floats_round_trip([struct.unpack('<d', rng.getrandbits(64).to_bytes(8, 'little'))[0] for _ in range(1000)])
+
+
+def test_store_keeps_nan_and_inf(tmp_path):
+    store = TimeSeriesStore(str(tmp_path), fields=('temperature', 'lux'), block_size=4,
+                            precision={'temperature': 2})
+    values = [21.5, float('nan'), float('inf'), -float('inf'), 22.25, float('nan')]
+    for i, x in enumerate(values):
+        store.append({'temperature': x, 'lux': x, 'ts': BASE + i * 3600 * NANOS})
+    columns = store.query(BASE, BASE + len(values) * 3600 * NANOS)
+    for field in ('temperature', 'lux'):
+        assert [repr(x) for x in columns[field]] == [repr(x) for x in values]
+    # NaN is skipped by downsampling
+    assert store.downsample(BASE, BASE + 2 * 3600 * NANOS, 7200)['temperature'] == [21.5]
+    store.close()
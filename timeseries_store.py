@@ -0,0 +1,317 @@
+import bisect
+import json
+import os
+import struct
+import threading
+from array import array
+from typing import Dict, List, Sequence
+
+from reading_buffer import FIELDS
+
+BLOCK_HEADER = struct.Struct('<qqI')
+INDEX_ENTRY = struct.Struct('<qqQI')
+COLUMN_LENGTH = struct.Struct('<I')
+# Timestamps are stored in milliseconds, sub-millisecond precision is not kept
+TS_UNIT = 1000 * 1000
+# Decimals EnviroPlusReader rounds every field to. Values are stored scaled to integers, which XOR compresses far
+# better than decimal fractions.
+DEFAULT_PRECISION = {'temperature': 2, 'pressure': 2, 'humidity': 2, 'oxidising': 4, 'reducing': 4, 'nh3': 4,
+                     'lux': 2, 'P2.5': 0, 'P10': 0, 'P1.0': 0}
+MASK_64 = (1 << 64) - 1
+
+
+class BitWriter:
+    def __init__(self) -> None:
+        self.data = bytearray()
+        self.acc = 0
+        self.bits = 0
+
+    def write(self, value, n):
+        self.acc = (self.acc << n) | value
+        self.bits += n
+        if self.bits >= 64:
+            extra = self.bits - 64
+            self.data += (self.acc >> extra).to_bytes(8, 'big')
+            self.acc &= (1 << extra) - 1
+            self.bits = extra
+
+    def getvalue(self) -> bytes:
+        if not self.bits:
+            return bytes(self.data)
+        padding = -self.bits % 8
+        return bytes(self.data) + (self.acc << padding).to_bytes((self.bits + padding) // 8, 'big')
+
+
+class BitReader:
+    def __init__(self, data: bytes) -> None:
+        self.data = data
+        self.position = 0
+
+    def read(self, n):
+        byte, offset = divmod(self.position, 8)
+        chunk = int.from_bytes(self.data[byte:byte + 9].ljust(9, b'\0'), 'big')
+        self.position += n
+        return (chunk >> (72 - offset - n)) & ((1 << n) - 1)
+
+
+# Delta-of-delta timestamp encoding from the Gorilla paper, with a 64 bit escape for gaps beyond 32 bits
+def encode_timestamps(ts: Sequence[int]) -> bytes:
+    writer = BitWriter()
+    writer.write(ts[0] & MASK_64, 64)
+    previous, previous_delta = ts[0], 0
+    for t in ts[1:]:
+        delta = t - previous
+        dod = delta - previous_delta
+        if dod == 0:
+            writer.write(0, 1)
+        elif -63 <= dod <= 64:
+            writer.write(0b10, 2)
+            writer.write(dod + 63, 7)
+        elif -255 <= dod <= 256:
+            writer.write(0b110, 3)
+            writer.write(dod + 255, 9)
+        elif -2047 <= dod <= 2048:
+            writer.write(0b1110, 4)
+            writer.write(dod + 2047, 12)
+        elif -(1 << 31) < dod <= (1 << 31):
+            writer.write(0b11110, 5)
+            writer.write(dod + (1 << 31) - 1, 32)
+        else:
+            writer.write(0b11111, 5)
+            writer.write(dod & MASK_64, 64)
+        previous, previous_delta = t, delta
+    return writer.getvalue()
+
+
+def _signed(value):
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def decode_timestamps(data: bytes, count: int) -> List[int]:
+    reader = BitReader(data)
+    ts = [_signed(reader.read(64))]
+    delta = 0
+    for _ in range(count - 1):
+        if not reader.read(1):
+            dod = 0
+        elif not reader.read(1):
+            dod = reader.read(7) - 63
+        elif not reader.read(1):
+            dod = reader.read(9) - 255
+        elif not reader.read(1):
+            dod = reader.read(12) - 2047
+        elif not reader.read(1):
+            dod = reader.read(32) - (1 << 31) + 1
+        else:
+            dod = _signed(reader.read(64))
+        delta += dod
+        ts.append(ts[-1] + delta)
+    return ts
+
+
+# XOR float compression from the Gorilla paper
+def encode_floats(values: Sequence[float]) -> bytes:
+    bits = array('Q')
+    bits.frombytes(array('d', values).tobytes())
+    writer = BitWriter()
+    writer.write(bits[0], 64)
+    previous = bits[0]
+    leading, trailing = 65, 0
+    for value in bits[1:]:
+        xor = value ^ previous
+        previous = value
+        if not xor:
+            writer.write(0, 1)
+            continue
+        new_leading = min(64 - xor.bit_length(), 31)
+        new_trailing = (xor & -xor).bit_length() - 1
+        if new_leading >= leading and new_trailing >= trailing:
+            writer.write(0b10, 2)
+            writer.write(xor >> trailing, 64 - leading - trailing)
+        else:
+            leading, trailing = new_leading, new_trailing
+            meaningful = 64 - leading - trailing
+            writer.write(0b11, 2)
+            writer.write(leading, 5)
+            writer.write(meaningful & 63, 6)
+            writer.write(xor >> trailing, meaningful)
+    return writer.getvalue()
+
+
+def decode_floats(data: bytes, count: int) -> array:
+    reader = BitReader(data)
+    bits = array('Q', [reader.read(64)])
+    previous = bits[0]
+    leading = trailing = 0
+    for _ in range(count - 1):
+        if reader.read(1):
+            if reader.read(1):
+                leading = reader.read(5)
+                meaningful = reader.read(6) or 64
+                trailing = 64 - leading - meaningful
+            previous ^= reader.read(64 - leading - trailing) << trailing
+        bits.append(previous)
+    return array('d', bits.tobytes())
+
+
+# Embedded append-only time series store. Readings are compressed in blocks of up to block_size points, every block
+# is indexed by its time range so range and downsampled queries only decode the blocks they need.
+class TimeSeriesStore:
+    def __init__(self, path: str, fields: Sequence[str] = FIELDS, block_size: int = 900,
+                 precision: Dict[str, int] = None) -> None:
+        self.path = path
+        self.lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+        meta_path = os.path.join(path, 'meta.json')
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+        else:
+            precision = DEFAULT_PRECISION if precision is None else precision
+            meta = {'fields': list(fields), 'block_size': block_size,
+                    'precision': {field: precision[field] for field in fields if field in precision}}
+            with open(meta_path, 'w') as f:
+                json.dump(meta, f)
+        self.fields = tuple(meta['fields'])
+        self.block_size = meta['block_size']
+        self.precision = meta['precision']
+        self.pending_ts = []
+        self.pending = {field: [] for field in self.fields}
+        self.index = self._load_index()
+        self.data = open(os.path.join(path, 'data'), 'ab')
+        self.index_file = open(os.path.join(path, 'index'), 'ab')
+
+    # Drop index entries for blocks a crash left incomplete in the data file
+    def _load_index(self):
+        index = []
+        data_size = os.path.getsize(os.path.join(self.path, 'data')) if os.path.exists(
+            os.path.join(self.path, 'data')) else 0
+        index_path = os.path.join(self.path, 'index')
+        if os.path.exists(index_path):
+            with open(index_path, 'rb') as f:
+                raw = f.read()
+            for position in range(0, len(raw) - INDEX_ENTRY.size + 1, INDEX_ENTRY.size):
+                entry = INDEX_ENTRY.unpack_from(raw, position)
+                if entry[2] + entry[3] > data_size:
+                    break
+                index.append(entry)
+            with open(index_path, 'r+b') as f:
+                f.truncate(len(index) * INDEX_ENTRY.size)
+        self.index_ends = [entry[1] for entry in index]
+        return index
+
+    def append(self, values):
+        with self.lock:
+            self.pending_ts.append(values['ts'] // TS_UNIT)
+            for field in self.fields:
+                value = values.get(field)
+                self.pending[field].append(float('nan') if value is None else float(value))
+            if len(self.pending_ts) >= self.block_size:
+                self._write_block()
+
+    def _write_block(self):
+        ts = self.pending_ts
+        columns = [encode_timestamps(ts)] + [encode_floats(self._scale(field, self.pending[field]))
+                                             for field in self.fields]
+        block = BLOCK_HEADER.pack(ts[0], ts[-1], len(ts)) + b''.join(
+            COLUMN_LENGTH.pack(len(column)) + column for column in columns)
+        offset = self.data.tell()
+        self.data.write(block)
+        self.data.flush()
+        entry = (ts[0] * TS_UNIT, ts[-1] * TS_UNIT, offset, len(block))
+        self.index_file.write(INDEX_ENTRY.pack(*entry))
+        self.index_file.flush()
+        self.index.append(entry)
+        self.index_ends.append(entry[1])
+        self.pending_ts = []
+        self.pending = {field: [] for field in self.fields}
+
+    def _scale(self, field, values):
+        if field not in self.precision:
+            return values
+        scale = 10 ** self.precision[field]
+        return [float(round(x * scale)) if x - x == 0 else x for x in values]
+
+    def _unscale(self, field, values):
+        if field not in self.precision:
+            return values
+        digits = self.precision[field]
+        scale = 10 ** digits
+        return array('d', [round(x / scale, digits) if x - x == 0 else x for x in values])
+
+    def flush(self):
+        with self.lock:
+            if self.pending_ts:
+                self._write_block()
+
+    def close(self):
+        self.flush()
+        self.data.close()
+        self.index_file.close()
+
+    def _read_block(self, entry, fields):
+        with open(os.path.join(self.path, 'data'), 'rb') as f:
+            f.seek(entry[2])
+            block = f.read(entry[3])
+        _start, _end, count = BLOCK_HEADER.unpack_from(block)
+        position = BLOCK_HEADER.size
+        columns = {}
+        for name in ('ts',) + self.fields:
+            length, = COLUMN_LENGTH.unpack_from(block, position)
+            position += COLUMN_LENGTH.size
+            if name == 'ts':
+                columns['ts'] = [t * TS_UNIT for t in decode_timestamps(block[position:position + length], count)]
+            elif name in fields:
+                columns[name] = self._unscale(name, decode_floats(block[position:position + length], count))
+            position += length
+        return columns
+
+    # Readings with start <= ts < end as columns, {'ts': [...], field: [...]}
+    def query(self, start: int, end: int, fields: Sequence[str] = None) -> Dict[str, list]:
+        fields = tuple(fields or self.fields)
+        result = {name: [] for name in ('ts',) + fields}
+        # Timestamps are kept rounded down to TS_UNIT, the bounds are rounded the same way
+        start, end = start // TS_UNIT * TS_UNIT, end // TS_UNIT * TS_UNIT
+        with self.lock:
+            entries = self.index[bisect.bisect_left(self.index_ends, start):]
+            pending = [{'ts': [t * TS_UNIT for t in self.pending_ts]}] if self.pending_ts else []
+            if pending:
+                pending[0].update({field: list(self.pending[field]) for field in fields})
+        blocks = (self._read_block(entry, fields) for entry in entries if entry[0] < end)
+        for columns in list(blocks) + pending:
+            ts = columns['ts']
+            first, last = bisect.bisect_left(ts, start), bisect.bisect_left(ts, end)
+            result['ts'].extend(ts[first:last])
+            for field in fields:
+                result[field].extend(columns[field][first:last])
+        return result
+
+    # Means over consecutive buckets of interval seconds, NaN values are skipped
+    def downsample(self, start: int, end: int, interval: float, fields: Sequence[str] = None) -> Dict[str, list]:
+        fields = tuple(fields or self.fields)
+        start = start // TS_UNIT * TS_UNIT
+        columns = self.query(start, end, fields)
+        step = int(interval * 1000 * 1000 * 1000)
+        result = {name: [] for name in ('ts',) + fields}
+        bucket_start = None
+        sums, counts = {}, {}
+        for i, t in enumerate(columns['ts'] + [None]):
+            bucket = None if t is None else start + (t - start) // step * step
+            if bucket != bucket_start and bucket_start is not None:
+                result['ts'].append(bucket_start)
+                for field in fields:
+                    result[field].append(sums[field] / counts[field] if counts[field] else float('nan'))
+            if t is None:
+                break
+            if bucket != bucket_start:
+                bucket_start = bucket
+                sums, counts = dict.fromkeys(fields, 0.0), dict.fromkeys(fields, 0)
+            for field in fields:
+                value = columns[field][i]
+                if value == value:
+                    sums[field] += value
+                    counts[field] += 1
+        return result
+
+    def nbytes(self) -> int:
+        return self.data.tell() if not self.data.closed else os.path.getsize(os.path.join(self.path, 'data'))
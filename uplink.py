@@ -0,0 +1,144 @@
+import threading
+import time
+import zlib
+from collections import deque
+from typing import Iterable, Iterator, Optional
+
+GZIP = 'gzip'
+DEFLATE = 'deflate'
+ENCODINGS = (GZIP, DEFLATE)
+# zlib window bits of each Content-Encoding, HTTP deflate is the zlib format
+WBITS = {GZIP: 16 + zlib.MAX_WBITS, DEFLATE: zlib.MAX_WBITS}
+# Bytes a request costs besides its body: request and response headers and TCP/IP framing, an estimate
+HTTP_REQUEST_OVERHEAD = 500
+# IP and UDP headers of a datagram
+UDP_DATAGRAM_OVERHEAD = 28
+# Weight of the newest request in the running averages
+SMOOTHING = 0.2
+
+
+def check_encoding(encoding: Optional[str]) -> Optional[str]:
+    if encoding not in (None,) + ENCODINGS:
+        raise ValueError("Unknown content encoding: {}".format(encoding))
+    return encoding
+
+
+def compressor(encoding: str, level: int = 6):
+    return zlib.compressobj(level, zlib.DEFLATED, WBITS[encoding])
+
+
+# Body as it goes on the wire, unchanged without an encoding
+def compress(body: bytes, encoding: Optional[str], level: int = 6) -> bytes:
+    if encoding is None:
+        return body
+    compress_obj = compressor(encoding, level)
+    return compress_obj.compress(body) + compress_obj.flush()
+
+
+# Streamed body compressed piece by piece as it is sent, counting the bytes before and after compression
+class BodyStream:
+    def __init__(self, pieces: Iterable[bytes], encoding: Optional[str] = None, level: int = 6) -> None:
+        self.pieces = pieces
+        self.encoding = encoding
+        self.level = level
+        self.raw_bytes = 0
+        self.sent_bytes = 0
+
+    def __iter__(self) -> Iterator[bytes]:
+        compress_obj = compressor(self.encoding, self.level) if self.encoding else None
+        for piece in self.pieces:
+            self.raw_bytes += len(piece)
+            if compress_obj is not None:
+                piece = compress_obj.compress(piece)
+            # An empty chunk would end a chunked body
+            if piece:
+                self.sent_bytes += len(piece)
+                yield piece
+        if compress_obj is not None:
+            piece = compress_obj.flush()
+            self.sent_bytes += len(piece)
+            yield piece
+
+
+# Bytes a sink sends, before and after compression and with the per-request overhead, over the last hour and day in
+# minute buckets, plus running averages of the round trip time, compression ratio and sent bytes per reading
+class UplinkTraffic:
+    def __init__(self, name: str, request_overhead: int = HTTP_REQUEST_OVERHEAD, bytes_per_hour: int = None,
+                 clock=time.time) -> None:
+        self.name = name
+        self.request_overhead = request_overhead
+        self.bytes_per_hour = bytes_per_hour
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.failures = 0
+        self.readings = 0
+        self.raw_bytes = 0
+        self.body_bytes = 0
+        self.wire_bytes = 0
+        # (minute, wire bytes) for the last day
+        self.minutes = deque()
+        self.rtt = None
+        self.ratio = None
+        self.bytes_per_reading = None
+
+    # A request sent with readings in it, raw_bytes before and body_bytes after compression. Failed requests count
+    # against the cap too, only successful ones update the averages.
+    def record(self, readings: int, raw_bytes: int, body_bytes: int, seconds: float, ok: bool = True):
+        wire_bytes = body_bytes + self.request_overhead
+        minute = int(self.clock() // 60)
+        with self.lock:
+            self.requests += 1
+            self.readings += readings
+            self.raw_bytes += raw_bytes
+            self.body_bytes += body_bytes
+            self.wire_bytes += wire_bytes
+            if self.minutes and self.minutes[-1][0] == minute:
+                self.minutes[-1][1] += wire_bytes
+            else:
+                self.minutes.append([minute, wire_bytes])
+            while self.minutes[0][0] <= minute - 24 * 60:
+                self.minutes.popleft()
+            if not ok:
+                self.failures += 1
+                return
+            self.rtt = self._average(self.rtt, seconds)
+            if raw_bytes:
+                self.ratio = self._average(self.ratio, body_bytes / raw_bytes)
+            if readings:
+                self.bytes_per_reading = self._average(self.bytes_per_reading, body_bytes / readings)
+
+    @staticmethod
+    def _average(average, value):
+        return value if average is None else average + SMOOTHING * (value - average)
+
+    def sent_since(self, seconds: float) -> int:
+        start = int((self.clock() - seconds) // 60)
+        with self.lock:
+            return sum(wire_bytes for minute, wire_bytes in self.minutes if minute > start)
+
+    # Share of the hourly budget sent over the last hour
+    def budget_used(self) -> Optional[float]:
+        return self.sent_since(3600) / self.bytes_per_hour if self.bytes_per_hour else None
+
+    def stats(self) -> dict:
+        stats = {'requests': self.requests, 'failures': self.failures, 'readings': self.readings,
+                 'raw_bytes': self.raw_bytes, 'wire_bytes': self.wire_bytes, 'last_hour': self.sent_since(3600),
+                 'last_day': self.sent_since(86400)}
+        if self.ratio is not None:
+            stats['ratio'] = round(self.ratio, 3)
+        if self.rtt is not None:
+            stats['rtt'] = round(self.rtt, 3)
+        if self.bytes_per_hour:
+            stats['budget_used'] = round(self.budget_used(), 3)
+        return stats
+
+    def collect_metrics(self):
+        for kind in ('raw', 'body', 'wire'):
+            yield 'uplink_bytes_total', 'counter', {'sink': self.name, 'kind': kind}, getattr(self, kind + '_bytes')
+        yield 'uplink_requests_total', 'counter', {'sink': self.name}, self.requests
+        yield 'uplink_last_hour_bytes', 'gauge', {'sink': self.name}, self.sent_since(3600)
+        if self.ratio is not None:
+            yield 'uplink_compression_ratio', 'gauge', {'sink': self.name}, self.ratio
+        if self.bytes_per_hour:
+            yield 'uplink_budget_used_ratio', 'gauge', {'sink': self.name}, self.budget_used()